@@ -0,0 +1,560 @@
+# analitico.py
+
+"""
+Snapshot colunar de abastecimentos, pedagios e manutencoes para leituras analíticas.
+
+Cada tabela vira um conjunto de segmentos imutáveis em disco (um .npy por coluna, aberto com
+mmap_mode='r'): colunas numéricas em float64 (NULL = NaN), datas em int32 (dias desde 1970)
+e colunas categóricas em códigos int32 de um dicionário (código 0 = NULL). Leituras não copiam
+dados e, por serem arquivos mapeados, as páginas são compartilhadas entre os workers do gunicorn.
+
+Atualização incremental: linhas com id acima da marca d'água viram um novo segmento, junto com
+a versão atual das linhas alteradas/excluídas desde a última atualização (log snapshot_alteracoes).
+Os ids dessas linhas são registrados como removidos dos segmentos anteriores. Com muitos
+segmentos ou muitas alterações o snapshot é reconstruído inteiro. A atualização só lê o log; o
+que ela já consumiu é apagado por podar_alteracoes (inicialização do servidor e migracao.py).
+"""
+
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+import database
+
+try:
+    import fcntl
+except ImportError:  # Windows: só o lock entre threads
+    fcntl = None
+
+# Colunas novas aqui precisam entrar também nos triggers do log (migração 015 em database.py)
+TABELAS_SNAPSHOT = {
+    'abastecimentos': {
+        'data': 'data',
+        'numericas': ['litros', 'desconto', 'odometro', 'custo_por_litro', 'custo_bruto', 'custo_liquido',
+                      'km_rodados', 'km_litro'],
+        'categoricas': ['placa', 'centro_custo', 'combustivel', 'posto', 'responsavel'],
+    },
+    'pedagios': {
+        'data': 'data',
+        'numericas': ['valor'],
+        'categoricas': ['placa'],
+    },
+    'manutencoes': {
+        'data': 'data_abertura',
+        'numericas': ['valor', 'finalizada', 'parcelas'],
+        'categoricas': ['identificacao', 'tipo', 'frota', 'fornecedor', 'forma_pagamento'],
+    },
+}
+
+SNAPSHOT_MAX_SEGMENTOS = 8
+SNAPSHOT_FRACAO_RECONSTRUCAO = 0.2  # removidos acima desta fração das linhas -> reconstrução completa
+TAMANHO_LOTE = 100000
+DIA_NULO = np.iinfo(np.int32).min
+
+_lock = threading.Lock()
+_carregados = {}
+
+
+def pasta_snapshot():
+    """Diretório do snapshot, ao lado do arquivo do banco (um snapshot por banco)."""
+    return os.path.splitext(os.path.abspath(database.DB_PATH))[0] + '_snapshot'
+
+
+class SnapshotTabela:
+    """Visão somente leitura de uma geração do snapshot de uma tabela."""
+
+    def __init__(self, tabela, manifesto, segmentos, dicionarios):
+        self.tabela = tabela
+        self.versao = manifesto['versao_tabela']
+        self.geracao = manifesto['geracao']
+        self.segmentos = segmentos  # [{'colunas': {nome: memmap}, 'mascara': bool array ou None}]
+        self.dicionarios = dicionarios  # {coluna: [None, valor1, valor2, ...]}
+        self.linhas = sum(int(s['mascara'].sum()) if s['mascara'] is not None else len(s['colunas']['id'])
+                          for s in self.segmentos)
+
+    def coluna(self, nome):
+        """Coluna inteira das linhas válidas. Sem cópia quando há um único segmento sem removidos."""
+        partes = [s['colunas'][nome] if s['mascara'] is None else s['colunas'][nome][s['mascara']]
+                  for s in self.segmentos]
+        if len(partes) == 1:
+            return partes[0]
+        if not partes:
+            return np.empty(0, dtype=np.float64)
+        return np.concatenate(partes)
+
+    def codigo(self, coluna, valor):
+        """Código de um valor categórico (None se não existe no dicionário)."""
+        try:
+            return self.dicionarios[coluna].index(valor)
+        except ValueError:
+            return None
+
+
+# --- Leitura do banco ---
+
+def _selecao(tabela):
+    definicao = TABELAS_SNAPSHOT[tabela]
+    colunas = ['id', f"CAST(julianday({definicao['data']}) - 2440587.5 AS INTEGER) as dia"]
+    colunas += definicao['numericas'] + definicao['categoricas']
+    return f"SELECT {', '.join(colunas)} FROM {tabela}"
+
+
+def _codificar(valores, dicionario):
+    """Converte valores (objetos) em códigos int32, estendendo o dicionário (append-only) com os novos."""
+    valores = pd.Series(valores, dtype=object)
+    nulos = valores.isna().to_numpy()
+    indice = pd.Index(dicionario[1:], dtype=object)
+    codigos = indice.get_indexer(valores.where(~nulos, None))
+    novos = (codigos == -1) & ~nulos
+    if novos.any():
+        for valor in pd.unique(valores[novos]):
+            dicionario.append(valor)
+        codigos = pd.Index(dicionario[1:], dtype=object).get_indexer(valores.where(~nulos, None))
+    codigos = codigos.astype(np.int32) + 1
+    codigos[nulos] = 0
+    return codigos
+
+
+def _ler_linhas(cursor, tabela, dicionarios, filtro='', params=()):
+    """Lê as linhas em lotes e devolve {coluna: array} já no formato do snapshot."""
+    definicao = TABELAS_SNAPSHOT[tabela]
+    nomes = ['id', 'dia'] + definicao['numericas'] + definicao['categoricas']
+    partes = {nome: [] for nome in nomes}
+    cursor.execute(f"{_selecao(tabela)} {filtro} ORDER BY id", params)
+    while True:
+        lote = cursor.fetchmany(TAMANHO_LOTE)
+        if not lote:
+            break
+        colunas = dict(zip(nomes, zip(*lote)))
+        partes['id'].append(np.array(colunas['id'], dtype=np.int64))
+        partes['dia'].append(np.array([DIA_NULO if d is None else d for d in colunas['dia']], dtype=np.int32))
+        for nome in definicao['numericas']:
+            partes[nome].append(np.array(colunas[nome], dtype=np.float64))  # None -> nan
+        for nome in definicao['categoricas']:
+            partes[nome].append(_codificar(colunas[nome], dicionarios[nome]))
+    tipos = {'id': np.int64, 'dia': np.int32, **{n: np.float64 for n in definicao['numericas']},
+             **{n: np.int32 for n in definicao['categoricas']}}
+    return {nome: (np.concatenate(partes[nome]) if partes[nome] else np.empty(0, dtype=tipos[nome]))
+            for nome in nomes}
+
+
+# --- Escrita em disco ---
+
+def _pasta_tabela(tabela):
+    return os.path.join(pasta_snapshot(), tabela)
+
+
+def _ler_manifesto(tabela):
+    try:
+        with open(os.path.join(_pasta_tabela(tabela), 'manifesto.json'), encoding='utf-8') as arquivo:
+            return json.load(arquivo)
+    except FileNotFoundError:
+        return None
+
+
+def _gravar_json(caminho, dados):
+    temporario = caminho + '.tmp'
+    with open(temporario, 'w', encoding='utf-8') as arquivo:
+        json.dump(dados, arquivo, ensure_ascii=False)
+    os.replace(temporario, caminho)  # troca atômica: leitores nunca veem o arquivo pela metade
+
+
+def _gravar_segmento(tabela, nome, colunas, removidos):
+    pasta = os.path.join(_pasta_tabela(tabela), nome)
+    os.makedirs(pasta, exist_ok=True)
+    for coluna, valores in colunas.items():
+        np.save(os.path.join(pasta, f'{coluna}.npy'), valores)
+    np.save(os.path.join(pasta, 'removidos.npy'), np.asarray(removidos, dtype=np.int64))
+    return {'nome': nome, 'linhas': int(len(colunas['id'])), 'removidos': int(len(removidos))}
+
+
+def _limpar_geracoes_antigas(tabela, manifesto):
+    """Apaga segmentos e dicionários que nem a geração atual nem a anterior usam."""
+    pasta = _pasta_tabela(tabela)
+    em_uso = {s['nome'] for s in manifesto['segmentos']}
+    minima = manifesto['geracao'] - 1
+    for nome in os.listdir(pasta):
+        if nome.startswith('seg_') and nome not in em_uso and int(nome[4:]) < minima:
+            shutil.rmtree(os.path.join(pasta, nome), ignore_errors=True)
+        elif nome.startswith('dicionarios_') and nome.endswith('.json') and int(nome[12:-5]) < minima:
+            os.remove(os.path.join(pasta, nome))
+
+
+class _TravaArquivo:
+    """Exclusão mútua entre threads e entre processos (workers) durante a atualização."""
+
+    def __init__(self, tabela):
+        os.makedirs(_pasta_tabela(tabela), exist_ok=True)
+        self.caminho = os.path.join(_pasta_tabela(tabela), '.lock')
+
+    def __enter__(self):
+        _lock.acquire()
+        self.arquivo = open(self.caminho, 'a')
+        if fcntl:
+            fcntl.flock(self.arquivo, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self.arquivo, fcntl.LOCK_UN)
+        self.arquivo.close()
+        _lock.release()
+
+
+# --- Atualização ---
+
+def atualizar_snapshot(tabela, completo=False):
+    """
+    Deixa o snapshot da tabela em dia com o banco e devolve o manifesto.
+    Incremental por padrão; completo=True (ou sem snapshot anterior) reconstrói do zero.
+    """
+    with _TravaArquivo(tabela):
+        conn = database.abrir_conexao_avulsa()
+        conn.row_factory = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN")  # transação de leitura: versão, log e linhas do mesmo instante
+            versao = cursor.execute("SELECT versao FROM versoes_tabelas WHERE tabela = ?", (tabela,)).fetchone()
+            versao = versao[0] if versao else 0
+            ultima_alteracao = cursor.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM snapshot_alteracoes WHERE tabela = ?", (tabela,)
+            ).fetchone()[0]
+            manifesto = None if completo else _ler_manifesto(tabela)
+            if manifesto and manifesto['versao_tabela'] == versao:
+                return manifesto
+
+            if manifesto:
+                alterados = [linha[0] for linha in cursor.execute("""
+                    SELECT DISTINCT registro_id FROM snapshot_alteracoes
+                    WHERE tabela = ? AND seq > ? AND registro_id <= ?
+                """, (tabela, manifesto['ultima_alteracao'], manifesto['ultimo_id']))]
+                removidos_total = manifesto['removidos'] + len(alterados)
+                if (len(manifesto['segmentos']) >= SNAPSHOT_MAX_SEGMENTOS
+                        or removidos_total > SNAPSHOT_FRACAO_RECONSTRUCAO * max(manifesto['linhas'], 1)):
+                    manifesto = None
+
+            geracao = (_ler_manifesto(tabela) or {'geracao': 0})['geracao'] + 1
+            nome_segmento = f'seg_{geracao:06d}'
+            if manifesto is None:
+                dicionarios = {nome: [None] for nome in TABELAS_SNAPSHOT[tabela]['categoricas']}
+                colunas = _ler_linhas(cursor, tabela, dicionarios)
+                segmentos = [_gravar_segmento(tabela, nome_segmento, colunas, [])]
+                removidos_total = 0
+            else:
+                with open(os.path.join(_pasta_tabela(tabela), f"dicionarios_{manifesto['geracao']}.json"),
+                          encoding='utf-8') as arquivo:
+                    dicionarios = json.load(arquivo)
+                colunas = _ler_linhas(cursor, tabela, dicionarios,
+                                      "WHERE id > ? OR id IN (SELECT value FROM json_each(?))",
+                                      (manifesto['ultimo_id'], json.dumps(alterados)))
+                segmentos = manifesto['segmentos'] + [_gravar_segmento(tabela, nome_segmento, colunas, alterados)]
+
+            ultimo_id = max(int(colunas['id'].max()) if len(colunas['id']) else 0,
+                            manifesto['ultimo_id'] if manifesto else 0)
+            conn.rollback()
+
+            _gravar_json(os.path.join(_pasta_tabela(tabela), f'dicionarios_{geracao}.json'), dicionarios)
+            novo = {
+                'geracao': geracao, 'versao_tabela': versao, 'ultimo_id': ultimo_id,
+                'ultima_alteracao': ultima_alteracao, 'removidos': removidos_total,
+                'linhas': sum(s['linhas'] for s in segmentos) - removidos_total, 'segmentos': segmentos,
+            }
+            _gravar_json(os.path.join(_pasta_tabela(tabela), 'manifesto.json'), novo)
+
+            _limpar_geracoes_antigas(tabela, novo)
+            return novo
+        finally:
+            conn.close()
+
+
+def podar_alteracoes(*tabelas):
+    """
+    Apaga do log snapshot_alteracoes o que o snapshot de cada tabela já consumiu (o log inteiro da
+    tabela ainda sem snapshot: a primeira construção lê tudo do banco). Roda na inicialização do
+    servidor e pelo migracao.py, não nas leituras. Retorna quantas linhas foram apagadas.
+    """
+    apagadas = 0
+    for tabela in tabelas or TABELAS_SNAPSHOT:
+        with _TravaArquivo(tabela):  # nenhuma atualização lendo o log enquanto ele é podado
+            manifesto = _ler_manifesto(tabela)
+            conn = database.abrir_conexao_avulsa()
+            try:
+                cursor = conn.execute("DELETE FROM snapshot_alteracoes WHERE tabela = ? AND seq <= ?",
+                                      (tabela, manifesto['ultima_alteracao'] if manifesto else float('inf')))
+                apagadas += cursor.rowcount
+                conn.commit()
+            finally:
+                conn.close()
+    return apagadas
+
+
+def reconstruir_snapshot(*tabelas):
+    """Reconstrói do zero o snapshot das tabelas (todas, se nenhuma for passada)."""
+    for tabela in tabelas or TABELAS_SNAPSHOT:
+        manifesto = atualizar_snapshot(tabela, completo=True)
+        print(f"Snapshot de {tabela}: {manifesto['linhas']} linhas (geração {manifesto['geracao']}).")
+    podar_alteracoes(*tabelas)
+    return True
+
+
+# --- Leitura ---
+
+def _carregar(tabela, manifesto):
+    pasta = _pasta_tabela(tabela)
+    with open(os.path.join(pasta, f"dicionarios_{manifesto['geracao']}.json"), encoding='utf-8') as arquivo:
+        dicionarios = json.load(arquivo)
+    nomes = ['id', 'dia'] + TABELAS_SNAPSHOT[tabela]['numericas'] + TABELAS_SNAPSHOT[tabela]['categoricas']
+    segmentos = []
+    for segmento in manifesto['segmentos']:
+        caminho = os.path.join(pasta, segmento['nome'])
+        colunas = {nome: np.load(os.path.join(caminho, f'{nome}.npy'), mmap_mode='r') for nome in nomes}
+        removidos = np.load(os.path.join(caminho, 'removidos.npy'))
+        segmentos.append({'colunas': colunas, 'removidos': removidos, 'mascara': None})
+    # Ids removidos por um segmento valem para todos os anteriores a ele
+    removidos_depois = np.empty(0, dtype=np.int64)
+    for segmento in reversed(segmentos):
+        if len(removidos_depois):
+            mascara = ~np.isin(segmento['colunas']['id'], removidos_depois)
+            segmento['mascara'] = None if mascara.all() else mascara
+        removidos_depois = np.union1d(removidos_depois, segmento.pop('removidos'))
+    return SnapshotTabela(tabela, manifesto, segmentos, dicionarios)
+
+
+def obter_snapshot(tabela):
+    """
+    Snapshot atual da tabela. Confere a versão em versoes_tabelas (uma leitura) e só atualiza
+    ou recarrega quando a tabela mudou; a visão carregada fica em memória por processo.
+    """
+    versao = database.obter_versoes_tabelas(tabela)[0]
+    atual = _carregados.get(tabela)
+    if atual is not None and atual.versao == versao:
+        return atual
+    manifesto = _ler_manifesto(tabela)
+    if manifesto is None or manifesto['versao_tabela'] != versao:
+        manifesto = atualizar_snapshot(tabela)
+    if atual is None or atual.geracao != manifesto['geracao']:
+        atual = _carregar(tabela, manifesto)
+        _carregados[tabela] = atual
+    return atual
+
+
+# --- Agregação ---
+
+# Medidas por tabela: ('contagem',), ('soma', coluna) ou ('razao', numerador, denominador).
+# Na razão só entram linhas com as duas colunas preenchidas (ex.: km/l ponderado pelos litros).
+MEDIDAS = {
+    'abastecimentos': {
+        'registros': ('contagem',),
+        'litros': ('soma', 'litros'),
+        'gasto': ('soma', 'custo_liquido'),
+        'gasto_bruto': ('soma', 'custo_bruto'),
+        'descontos': ('soma', 'desconto'),
+        'km_rodados': ('soma', 'km_rodados'),
+        'km_litro': ('razao', 'km_rodados', 'litros'),
+        'custo_medio_litro': ('razao', 'custo_liquido', 'litros'),
+    },
+    'pedagios': {
+        'registros': ('contagem',),
+        'valor': ('soma', 'valor'),
+    },
+    'manutencoes': {
+        'registros': ('contagem',),
+        'valor': ('soma', 'valor'),
+        'finalizadas': ('soma', 'finalizada'),
+    },
+}
+CHAVES_TEMPO = {'dia': 'datetime64[D]', 'mes': 'datetime64[M]', 'ano': 'datetime64[Y]'}
+
+AGREGACAO_MAX_GRUPOS_DENSOS = 1 << 20  # acima disso os grupos são numerados com np.unique
+AGREGACAO_CACHE_MAX = 256
+
+_agregacoes = {}
+_agregacoes_lock = threading.Lock()
+
+
+def _dia(texto):
+    try:
+        return int(np.datetime64(str(texto)[:10], 'D').astype(np.int64))
+    except ValueError:
+        raise ValueError(f"data inválida '{texto}'")
+
+
+def _chave_tempo(dias, unidade):
+    """Códigos de período (0 = sem data, depois em ordem cronológica) e o rótulo de cada código."""
+    nulos = dias == DIA_NULO
+    validos = dias[~nulos]
+    primeiro = int(validos.min()) if len(validos) else 0
+    ultimo = int(validos.max()) if len(validos) else 0
+    # Converte cada dia distinto uma vez só (tabela de consulta) em vez de cada linha
+    tabela = np.arange(primeiro, ultimo + 1).astype('datetime64[D]').astype(unidade).astype(np.int64)
+    periodos = tabela[np.where(nulos, primeiro, dias) - primeiro]
+    base = int(tabela[0])
+    codigos = periodos - (base - 1)
+    codigos[nulos] = 0
+    tamanho = int(codigos.max()) + 1 if len(codigos) else 1
+    datas = (np.arange(1, tamanho) + (base - 1)).astype(unidade)
+    rotulos = np.empty(tamanho, dtype=object)
+    rotulos[1:] = (datas.astype(np.int64) + 1970) if unidade == 'datetime64[Y]' else datas.astype(str)
+    return codigos, rotulos, np.arange(tamanho)
+
+
+def _chave_categorica(dicionario):
+    """Rótulos do dicionário e a posição de cada código na ordem dos valores (NULL primeiro)."""
+    rotulos = np.empty(len(dicionario), dtype=object)
+    rotulos[:] = dicionario
+    try:
+        ordem = sorted(range(1, len(dicionario)), key=dicionario.__getitem__)
+    except TypeError:  # tipos misturados na mesma coluna
+        ordem = sorted(range(1, len(dicionario)), key=lambda i: str(dicionario[i]))
+    posicoes = np.zeros(len(dicionario), dtype=np.int64)
+    posicoes[ordem] = np.arange(1, len(dicionario))
+    return rotulos, posicoes
+
+
+def _calcular_agregacao(snapshot, chaves, medidas, data_inicio, data_fim, filtros):
+    definicoes = MEDIDAS[snapshot.tabela]
+
+    # Seleção: intervalo de datas (inclusivo, por dia) e filtros por valores das categóricas
+    selecao = None
+
+    def restringir(condicao):
+        nonlocal selecao
+        selecao = condicao if selecao is None else selecao & condicao
+
+    if data_inicio or data_fim:
+        dia = snapshot.coluna('dia')
+        restringir(dia >= (_dia(data_inicio) if data_inicio else DIA_NULO + 1))
+        if data_fim:
+            restringir(dia <= _dia(data_fim))
+    for coluna, valores in filtros.items():
+        codigos = [c for c in (snapshot.codigo(coluna, v) for v in valores) if c is not None]
+        restringir(np.isin(snapshot.coluna(coluna), codigos))
+
+    def coluna(nome):
+        valores = snapshot.coluna(nome)
+        return valores if selecao is None else valores[selecao]
+
+    n = snapshot.linhas if selecao is None else int(np.count_nonzero(selecao))
+
+    # Chave composta em base mista: grupo = ((k1 * c2) + k2) * c3 + k3 ...
+    grupo = np.zeros(n, dtype=np.int64)
+    cardinalidade = 1
+    codigos_chaves, rotulos, posicoes = [], [], []
+    for chave in chaves:
+        if chave in CHAVES_TEMPO:
+            codigos, rotulos_chave, posicoes_chave = _chave_tempo(coluna('dia'), CHAVES_TEMPO[chave])
+        else:
+            codigos = coluna(chave)
+            rotulos_chave, posicoes_chave = _chave_categorica(snapshot.dicionarios[chave])
+        tamanho = len(rotulos_chave)
+        if cardinalidade * tamanho >= 1 << 62:  # compacta antes de estourar o int64
+            unicos, grupo = np.unique(grupo, return_inverse=True)
+            cardinalidade = len(unicos)
+        grupo = grupo * tamanho + codigos
+        cardinalidade *= tamanho
+        codigos_chaves.append(codigos)
+        rotulos.append(rotulos_chave)
+        posicoes.append(posicoes_chave)
+
+    if cardinalidade > AGREGACAO_MAX_GRUPOS_DENSOS:
+        unicos, grupo = np.unique(grupo, return_inverse=True)
+        cardinalidade = len(unicos)
+    contagem = np.bincount(grupo, minlength=cardinalidade)
+    presentes = np.flatnonzero(contagem)
+    representante = np.empty(cardinalidade, dtype=np.int64)
+    representante[grupo] = np.arange(n)  # qualquer linha do grupo serve para ler os códigos das chaves
+    representante = representante[presentes]
+
+    def somar(valores, validos=None):
+        pesos = np.where(np.isnan(valores) if validos is None else ~validos, 0.0, valores)
+        return np.bincount(grupo, weights=pesos, minlength=cardinalidade)[presentes], float(pesos.sum())
+
+    resultados, total = {}, {}
+    for medida in medidas:
+        definicao = definicoes[medida]
+        if definicao[0] == 'contagem':
+            resultados[medida] = contagem[presentes]
+            total[medida] = n
+        elif definicao[0] == 'soma':
+            resultados[medida], total[medida] = somar(coluna(definicao[1]))
+        else:
+            numerador, denominador = coluna(definicao[1]), coluna(definicao[2])
+            validos = ~np.isnan(numerador) & ~np.isnan(denominador)
+            soma_num, total_num = somar(numerador, validos)
+            soma_den, total_den = somar(denominador, validos)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                resultados[medida] = np.where(soma_den > 0, soma_num / soma_den, np.nan)
+            total[medida] = total_num / total_den if total_den > 0 else None
+
+    # Grupos já ordenados pelas chaves; a saída é montada por coluna, sem laço por grupo em Python
+    codigos_grupos = [codigos_chaves[k][representante] for k in range(len(chaves))]
+    ordem = np.lexsort([posicoes[k][codigos_grupos[k]] for k in reversed(range(len(chaves)))]) if chaves else None
+    if ordem is not None:
+        codigos_grupos = [codigos[ordem] for codigos in codigos_grupos]
+        resultados = {medida: valores[ordem] for medida, valores in resultados.items()}
+    saida = [rotulos[k][codigos_grupos[k]].tolist() for k in range(len(chaves))]
+    for medida in medidas:
+        valores = resultados[medida]
+        if valores.dtype.kind == 'f':
+            nulos = np.isnan(valores)
+            valores = np.round(valores, 4).astype(object)
+            valores[nulos] = None
+        saida.append(valores.tolist())
+    nomes = list(chaves) + list(medidas)
+    grupos = [dict(zip(nomes, linha)) for linha in zip(*saida)]
+    total = {medida: (round(valor, 4) if isinstance(valor, float) else valor) for medida, valor in total.items()}
+    return {'tabela': snapshot.tabela, 'chaves': list(chaves), 'medidas': list(medidas), 'linhas': n,
+            'grupos': grupos, 'total': total}
+
+
+def agregar(tabela='abastecimentos', chaves=(), medidas=('registros',), data_inicio=None, data_fim=None,
+            filtros=None, ordenar_por=None, ordem='asc', limite=None):
+    """
+    Group-by genérico sobre o snapshot colunar: agrupa pelas chaves (colunas categóricas da tabela ou
+    dia/mes/ano), filtra por intervalo de datas e por valores das categóricas ({coluna: [valores]})
+    e calcula as medidas de MEDIDAS. O resultado fica memorizado pela versão da tabela.
+    Levanta ValueError para chaves, medidas ou filtros desconhecidos.
+    """
+    if tabela not in TABELAS_SNAPSHOT:
+        raise ValueError(f"Tabela desconhecida: {tabela}")
+    categoricas = TABELAS_SNAPSHOT[tabela]['categoricas']
+    chaves, medidas = list(dict.fromkeys(chaves)), list(dict.fromkeys(medidas))
+    invalidas = [c for c in chaves if c not in categoricas and c not in CHAVES_TEMPO]
+    if invalidas:
+        raise ValueError(f"Chave inválida: {', '.join(invalidas)}. Use: {', '.join(categoricas + list(CHAVES_TEMPO))}.")
+    invalidas = [m for m in medidas if m not in MEDIDAS[tabela]]
+    if invalidas or not medidas:
+        raise ValueError(f"Medida inválida: {', '.join(invalidas) or '(nenhuma)'}. Use: {', '.join(MEDIDAS[tabela])}.")
+    filtros = {c: sorted(set(valores), key=str) for c, valores in (filtros or {}).items() if valores}
+    invalidas = [c for c in filtros if c not in categoricas]
+    if invalidas:
+        raise ValueError(f"Filtro inválido: {', '.join(invalidas)}. Use: {', '.join(categoricas)}.")
+    if ordenar_por is not None and ordenar_por not in chaves and ordenar_por not in medidas:
+        raise ValueError("ordenar_por deve ser uma das chaves ou medidas pedidas.")
+
+    snapshot = obter_snapshot(tabela)
+    memo = (tabela, snapshot.versao, tuple(chaves), tuple(medidas), data_inicio or None, data_fim or None,
+            tuple((c, tuple(v)) for c, v in sorted(filtros.items())))
+    with _agregacoes_lock:
+        resultado = _agregacoes.get(memo)
+    if resultado is None:
+        resultado = _calcular_agregacao(snapshot, chaves, medidas, data_inicio, data_fim, filtros)
+        with _agregacoes_lock:
+            if len(_agregacoes) >= AGREGACAO_CACHE_MAX:
+                del _agregacoes[next(iter(_agregacoes))]  # a mais antiga (versões velhas saem primeiro)
+            _agregacoes[memo] = resultado
+
+    grupos = resultado['grupos']
+    if ordenar_por:
+        nulos = [g for g in grupos if g[ordenar_por] is None]
+        grupos = sorted((g for g in grupos if g[ordenar_por] is not None), key=lambda g: g[ordenar_por],
+                        reverse=(ordem == 'desc')) + nulos
+    elif ordem == 'desc':
+        grupos = grupos[::-1]
+    if limite:
+        grupos = grupos[:limite]
+    return {**resultado, 'grupos': grupos, 'versao': snapshot.versao}
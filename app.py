@@ -1,45 +1,68 @@
 # app.py
 
 from flask import Flask
-from database import criar_tabelas
+from database import criar_tabelas, liberar_conexao, marcar_jobs_interrompidos
 from utils import load_logged_in_user, inject_now
 from auth import auth_bp
 from frota import frota_bp
 from dealer import dealer_bp
+from jobs import jobs_bp, limpar_jobs_expirados
+from analitico import podar_alteracoes
 import os
 
-# --- Configuração Inicial ---
-app = Flask(__name__)
-app.secret_key = 'sua_chave_secreta_aqui_123'
-app.config['STATIC_FOLDER'] = 'static'
 
-# Define o caminho absoluto para a pasta de uploads (Replica a configuração original)
-UPLOAD_FOLDER = os.path.join(os.getcwd(), 'uploads')
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+def create_app():
+    """
+    Cria e configura a aplicação Flask.
+    Não toca no banco: o esquema/migrações são aplicados por quem sobe o servidor
+    (__main__ abaixo ou o hook on_starting do gunicorn_config.py, no processo master).
+    """
+    # --- Configuração Inicial ---
+    app = Flask(__name__)
+    app.secret_key = 'sua_chave_secreta_aqui_123'
+    app.config['STATIC_FOLDER'] = 'static'
 
-# --- Registro de Blueprints (Módulos) ---
+    # Define o caminho absoluto para a pasta de uploads (Replica a configuração original)
+    UPLOAD_FOLDER = os.path.join(os.getcwd(), 'uploads')
+    if not os.path.exists(UPLOAD_FOLDER):
+        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-# Rotas de Autenticação e Administração (usuários)
-# Rotas: /login, /logout, /admin/users, /api/users
-app.register_blueprint(auth_bp)
+    # --- Registro de Blueprints (Módulos) ---
 
-# Rotas do Módulo Dealer/Compras
-# Rotas: /dealers/cotacoes-relatorio, /dealers/pedido/<id>, etc.
-# O prefixo '/dealers' é definido dentro do Blueprint em routes/dealer.py
-app.register_blueprint(dealer_bp)
+    # Rotas de Autenticação e Administração (usuários)
+    # Rotas: /login, /logout, /admin/users, /api/users
+    app.register_blueprint(auth_bp)
 
-# Rotas Principais (Frota, Index, APIs de Frota)
-# Rotas: /, /relatorios, /manutencoes, /api/dashboard, /api/registros, etc.
-app.register_blueprint(frota_bp)
+    # Rotas do Módulo Dealer/Compras
+    # Rotas: /dealers/cotacoes-relatorio, /dealers/pedido/<id>, etc.
+    # O prefixo '/dealers' é definido dentro do Blueprint em routes/dealer.py
+    app.register_blueprint(dealer_bp)
 
-# --- Controles de Acesso e Contexto ---
-app.before_request(load_logged_in_user)
-app.context_processor(inject_now)
+    # Rotas Principais (Frota, Index, APIs de Frota)
+    # Rotas: /, /relatorios, /manutencoes, /api/dashboard, /api/registros, etc.
+    app.register_blueprint(frota_bp)
 
-# --- Inicialização ---
+    # Jobs em segundo plano: /api/jobs, /api/jobs/<id>, /api/jobs/<id>/resultado
+    app.register_blueprint(jobs_bp)
+
+    # --- Controles de Acesso e Contexto ---
+    app.before_request(load_logged_in_user)
+    app.context_processor(inject_now)
+
+    # Devolve a conexão SQLite da requisição ao pool (ver database.get_db_connection)
+    app.teardown_appcontext(liberar_conexao)
+
+    return app
+
+
+# --- Inicialização (servidor de desenvolvimento) ---
+# Produção: gunicorn -c gunicorn_config.py
 if __name__ == '__main__':
     # Cria as tabelas se não existirem
-    criar_tabelas() 
-    app.run(debug=True, host='0.0.0.0', port='5005')
\ No newline at end of file
+    criar_tabelas()
+    marcar_jobs_interrompidos()
+    limpar_jobs_expirados()
+    podar_alteracoes()
+    app = create_app()
+    app.run(debug=True, host='0.0.0.0', port='5005')
@@ -0,0 +1,526 @@
+"""
+Benchmarks de desempenho sobre bancos sintéticos (o banco real não é tocado).
+Uso: python benchmark.py [nome ...]   (sem argumentos roda todos)
+"""
+import http.client
+import io
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta
+
+import database
+
+
+def _banco_sintetico(nome='bench.db'):
+    """Aponta database.DB_PATH para um banco novo em um diretório temporário e cria o esquema."""
+    diretorio = tempfile.mkdtemp(prefix='abas_bench_')
+    database.DB_PATH = os.path.join(diretorio, nome)
+    database.criar_tabelas()
+    return database.DB_PATH
+
+
+def _medir(funcao, repeticoes=5):
+    """Executa a função algumas vezes e retorna a mediana em milissegundos."""
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    tempos.sort()
+    return tempos[len(tempos) // 2]
+
+
+def _popular_frota(conn, veiculos, maquinas, abastecimentos_por_veiculo=50, checklists_por_maquina=30):
+    inicio = date(2023, 1, 1)
+    abastecimentos = []
+    for v in range(veiculos):
+        placa = f'BCH{v:04d}'
+        odometro = random.uniform(10000, 200000)
+        for i in range(abastecimentos_por_veiculo):
+            odometro += random.uniform(200, 800)
+            abastecimentos.append(((inicio + timedelta(days=i * 3)).isoformat(), placa, 40.0, odometro, 5.5, 220.0, 220.0))
+    conn.executemany("""
+        INSERT INTO abastecimentos (data, placa, litros, odometro, custo_por_litro, custo_bruto, custo_liquido)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, abastecimentos)
+
+    checklists = []
+    for m in range(maquinas):
+        horimetro = random.uniform(100, 5000)
+        for i in range(checklists_por_maquina):
+            horimetro += random.uniform(5, 20)
+            checklists.append((f'MAQ{m:04d}', (inicio + timedelta(days=i * 7)).isoformat(), horimetro))
+    conn.executemany("INSERT INTO checklists (identificacao, data, horimetro) VALUES (?, ?, ?)", checklists)
+
+    trocas = [(f'BCH{v:04d}', 'veiculo', '2023-01-01', 100000.0, None, 110000.0, None) for v in range(veiculos)]
+    trocas += [(f'MAQ{m:04d}', 'maquina', '2023-01-01', None, 1000.0, None, 1350.0) for m in range(maquinas)]
+    conn.executemany("""
+        INSERT INTO trocas_oleo (identificacao, tipo, data_troca, km_troca, horimetro_troca, proxima_troca_km, proxima_troca_horimetro)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, trocas)
+    conn.commit()
+
+
+def _popular_abastecimentos(conn, linhas, veiculos=2000, lote=200000, perfil_fixo=False):
+    """
+    Abastecimentos variados (placa, centro de custo, combustível, posto, responsável) em lotes.
+    perfil_fixo=True aproxima uma frota real: cada veículo tem centro de custo, combustível,
+    motorista e até três postos fixos (sem ele, cada linha sorteia tudo de forma independente).
+    """
+    centros = [f'CC{i:02d}' for i in range(40)]
+    combustiveis = ['DIESEL S10', 'DIESEL S500', 'GASOLINA', 'ETANOL', 'ARLA']
+    postos = [f'POSTO {i:03d}' for i in range(150)]
+    responsaveis = [f'MOTORISTA {i:03d}' for i in range(600)]
+    perfis = [(random.choice(responsaveis), random.choice(centros), random.choice(combustiveis),
+               random.sample(postos, 3)) for _ in range(veiculos)]
+    inicio = date(2021, 1, 1).toordinal()
+    for base in range(0, linhas, lote):
+        registros = []
+        for _ in range(min(lote, linhas - base)):
+            litros = random.uniform(20, 300)
+            preco = random.uniform(4.5, 7.0)
+            km = random.uniform(100, 1500)
+            veiculo = random.randrange(veiculos)
+            if perfil_fixo:
+                responsavel, centro, combustivel, postos_veiculo = perfis[veiculo]
+                posto = random.choice(postos_veiculo)
+            else:
+                responsavel, centro, combustivel = random.choice(responsaveis), random.choice(centros), random.choice(combustiveis)
+                posto = random.choice(postos)
+            registros.append((date.fromordinal(inicio + random.randrange(1500)).isoformat(),
+                              f'BCH{veiculo:04d}', responsavel, litros, centro, combustivel, preco, litros * preco,
+                              litros * preco * 0.98, km, km / litros, posto))
+        conn.executemany("""
+            INSERT INTO abastecimentos (data, placa, responsavel, litros, centro_custo, combustivel, custo_por_litro,
+                                        custo_bruto, custo_liquido, km_rodados, km_litro, posto)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, registros)
+        conn.commit()
+
+
+def bench_trocas_oleo():
+    """obter_trocas_oleo com frotas crescentes: o número de consultas é fixo (uma)."""
+    print("trocas_oleo: frota (veículos + máquinas) -> mediana obter_trocas_oleo")
+    for tamanho in (50, 200, 800, 1600):
+        _banco_sintetico()
+        conn = database.get_db_connection()
+        _popular_frota(conn, veiculos=tamanho, maquinas=tamanho // 2)
+        conn.close()
+        ms = _medir(database.obter_trocas_oleo)
+        ativos = tamanho + tamanho // 2
+        print(f"  {ativos:>6} ativos: {ms:8.1f} ms  ({ms / ativos * 1000:6.1f} µs/ativo)")
+
+
+def _popular_cotacoes(conn, cotacoes, orcamentos_por_cotacao=4, taxa_pedidos=0.7):
+    conn.execute("INSERT OR IGNORE INTO users (id, username, password_hash, role) VALUES (1, 'bench', '-', 'Administrador')")
+    conn.execute("INSERT OR IGNORE INTO fornecedores (id, cnpj, nome, tipo) VALUES (1, '00000000000100', 'Fornecedor Bench', 'Peças')")
+    inicio = datetime(2024, 1, 1, 8, 0)
+    linhas_cotacoes, linhas_orcamentos, linhas_pedidos = [], [], []
+    for c in range(1, cotacoes + 1):
+        registro = inicio + timedelta(minutes=c * 7)
+        linhas_cotacoes.append((c, 1, f'Cotação {c}', registro.strftime('%Y-%m-%d'), registro.strftime('%Y-%m-%d %H:%M:%S')))
+        valores = [round(random.uniform(500, 5000), 2) for _ in range(orcamentos_por_cotacao)]
+        aprovado = random.randrange(orcamentos_por_cotacao)
+        linhas_orcamentos += [(c, 1, valor, int(i == aprovado)) for i, valor in enumerate(valores)]
+        if random.random() < taxa_pedidos:
+            abertura = registro + timedelta(days=1)
+            finalizacao = abertura + timedelta(days=random.randint(1, 20))
+            linhas_pedidos.append((c, 1, 1, valores[aprovado], abertura.strftime('%Y-%m-%d %H:%M:%S'),
+                                   'Finalizado', finalizacao.strftime('%Y-%m-%d')))
+    conn.executemany("INSERT INTO cotacoes (id, user_id, titulo, data_limite, data_registro) VALUES (?, ?, ?, ?, ?)", linhas_cotacoes)
+    conn.executemany("INSERT INTO orcamentos (cotacao_id, fornecedor_id, valor, aprovado) VALUES (?, ?, ?, ?)", linhas_orcamentos)
+    conn.executemany("""
+        INSERT INTO pedidos_compra (cotacao_id, user_id, fornecedor_id, valor_total, data_abertura, status, data_finalizacao)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, linhas_pedidos)
+    conn.commit()
+
+
+def bench_dealer_intelligence():
+    """obter_dealer_intelligence sobre todo o período com volumes crescentes de cotações."""
+    print("dealer_intelligence: cotações (4 orçamentos cada) -> mediana obter_dealer_intelligence")
+    for tamanho in (5000, 20000, 50000):
+        _banco_sintetico()
+        conn = database.get_db_connection()
+        _popular_cotacoes(conn, tamanho)
+        conn.close()
+        ms = _medir(lambda: database.obter_dealer_intelligence('2024-01-01', '2026-12-31'), repeticoes=3)
+        print(f"  {tamanho:>6} cotações: {ms:8.1f} ms  ({ms / tamanho * 1000:6.1f} µs/cotação)")
+
+
+def bench_aprovacao_concorrente():
+    """
+    Aprovações paralelas: vários compradores disputando a mesma cotação e cotações diferentes.
+    Verifica que cada cotação gera exatamente um pedido (com todos os itens) e mede a vazão.
+    """
+    print("aprovacao_concorrente: threads -> aprovações/s, pedidos por cotação")
+    cotacoes, orcamentos_por_cotacao, itens_por_cotacao = 300, 3, 5
+    for threads in (1, 4, 16):
+        _banco_sintetico()
+        conn = database.get_db_connection()
+        _popular_cotacoes(conn, cotacoes, orcamentos_por_cotacao, taxa_pedidos=0)
+        conn.executemany("INSERT INTO cotacao_itens (cotacao_id, descricao, quantidade) VALUES (?, ?, ?)",
+                         [(c, f'Item {i}', i + 1) for c in range(1, cotacoes + 1) for i in range(itens_por_cotacao)])
+        conn.commit()
+        orcamentos = [row[0] for row in conn.execute("SELECT id FROM orcamentos")]
+        conn.close()
+        random.shuffle(orcamentos)
+
+        saida = io.StringIO()
+        inicio = time.perf_counter()
+        with redirect_stdout(saida), ThreadPoolExecutor(max_workers=threads) as executor:
+            resultados = list(executor.map(lambda orcamento_id: database.aprovar_orcamento(orcamento_id, 1), orcamentos))
+        segundos = time.perf_counter() - inicio
+
+        conn = database.get_db_connection()
+        pedidos_por_cotacao = conn.execute("SELECT COUNT(*) FROM pedidos_compra GROUP BY cotacao_id").fetchall()
+        itens_errados = conn.execute(
+            "SELECT COUNT(*) FROM (SELECT pedido_id FROM pedido_itens GROUP BY pedido_id HAVING COUNT(*) != ?)",
+            (itens_por_cotacao,)).fetchone()[0]
+        aprovados_errados = conn.execute(
+            "SELECT COUNT(*) FROM (SELECT cotacao_id FROM orcamentos GROUP BY cotacao_id HAVING SUM(aprovado) != 1)"
+        ).fetchone()[0]
+        conn.close()
+
+        bloqueios = saida.getvalue().count('database is locked')
+        criados = sum(1 for r in resultados if r)
+        correto = (criados == cotacoes and len(pedidos_por_cotacao) == cotacoes
+                   and all(n == 1 for (n,) in pedidos_por_cotacao) and itens_errados == 0
+                   and aprovados_errados == 0 and bloqueios == 0)
+        print(f"  {threads:>3} threads: {len(orcamentos) / segundos:8.0f} aprovações/s  "
+              f"pedidos={criados}/{cotacoes}  bloqueios={bloqueios}  {'OK' if correto else 'FALHA'}")
+
+
+def _requisicao(porta, caminho, cookie):
+    conn = http.client.HTTPConnection('127.0.0.1', porta, timeout=30)
+    try:
+        conn.request('GET', caminho, headers={'Cookie': cookie})
+        resposta = conn.getresponse()
+        resposta.read()
+        return resposta.status
+    finally:
+        conn.close()
+
+
+def _carga(porta, cookie, caminhos, concorrencia, segundos):
+    """Dispara requisições em paralelo por alguns segundos; retorna (req/s, p50 ms, p95 ms, erros)."""
+    fim = time.perf_counter() + segundos
+    latencias, erros = [], [0]
+    lock = threading.Lock()
+
+    def cliente(indice):
+        i = indice
+        while time.perf_counter() < fim:
+            inicio = time.perf_counter()
+            try:
+                ok = _requisicao(porta, caminhos[i % len(caminhos)], cookie) == 200
+            except OSError:
+                ok = False
+            with lock:
+                latencias.append((time.perf_counter() - inicio) * 1000)
+                erros[0] += not ok
+            i += 1
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        list(executor.map(cliente, range(concorrencia)))
+    duracao = time.perf_counter() - inicio
+    latencias.sort()
+    return (len(latencias) / duracao, latencias[len(latencias) // 2],
+            latencias[int(len(latencias) * 0.95)], erros[0])
+
+
+def _esperar_porta(porta, processo, limite=30):
+    fim = time.time() + limite
+    while time.time() < fim:
+        if processo.poll() is not None:
+            raise RuntimeError(f"servidor encerrou (código {processo.returncode})")
+        try:
+            socket.create_connection(('127.0.0.1', porta), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"servidor não respondeu na porta {porta}")
+
+
+def bench_servidor():
+    """
+    Carga HTTP no mesmo banco sintético: servidor de desenvolvimento do Flask (threaded, com e sem
+    debug) x gunicorn com gunicorn_config.py. Cliente e servidores dividem a mesma máquina.
+    """
+    repo = os.path.dirname(os.path.abspath(__file__))
+    _banco_sintetico('abastecimentos.db')
+    diretorio = os.path.dirname(database.DB_PATH)
+    conn = database.get_db_connection()
+    _popular_frota(conn, veiculos=200, maquinas=50)
+    conn.execute("INSERT INTO users (username, password_hash, role) VALUES ('carga', ?, 'Gestor')",
+                 (database.generate_password_hash('carga'),))
+    conn.commit()
+    conn.close()
+    database.reconstruir_tabelas_derivadas()
+
+    caminhos = ['/api/dashboard', '/api/relatorios?data_inicio=2023-01-01&data_fim=2023-12-31',
+                '/api/manutencoes/relatorio', '/medias-veiculos-dados', '/']
+    ambiente = dict(os.environ, PYTHONPATH=repo)
+    servidores = {
+        'flask dev': [sys.executable, '-c', 'from app import create_app; create_app().run(host="127.0.0.1", port=5931)'],
+        'flask debug': [sys.executable, '-c', 'from app import create_app; '
+                        'create_app().run(host="127.0.0.1", port=5933, debug=True, use_reloader=False)'],
+        'gunicorn': [sys.executable, '-m', 'gunicorn', '-c', os.path.join(repo, 'gunicorn_config.py')],
+    }
+    portas = {'flask dev': 5931, 'flask debug': 5933, 'gunicorn': 5932}
+    ambiente_servidor = {'gunicorn': {'GUNICORN_BIND': '127.0.0.1:5932'}}
+    concorrencia = int(os.environ.get('BENCH_CONCORRENCIA', 16))
+    segundos = int(os.environ.get('BENCH_SEGUNDOS', 15))
+
+    print(f"servidor: {concorrencia} clientes por {segundos}s, {os.cpu_count()} CPU(s) -> req/s, p50, p95")
+    for nome, comando in servidores.items():
+        porta = portas[nome]
+        processo = subprocess.Popen(comando, cwd=diretorio, env=dict(ambiente, **ambiente_servidor.get(nome, {})),
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            _esperar_porta(porta, processo)
+            login = http.client.HTTPConnection('127.0.0.1', porta, timeout=30)
+            login.request('POST', '/login', body='username=carga&password=carga',
+                          headers={'Content-Type': 'application/x-www-form-urlencoded'})
+            resposta = login.getresponse()
+            resposta.read()
+            cookie = resposta.getheader('Set-Cookie').split(';', 1)[0]
+            login.close()
+            for caminho in caminhos:  # aquece caches e conexões
+                _requisicao(porta, caminho, cookie)
+            rps, p50, p95, erros = _carga(porta, cookie, caminhos, concorrencia, segundos)
+            print(f"  {nome:<10} {rps:8.1f} req/s  p50 {p50:7.1f} ms  p95 {p95:7.1f} ms  erros {erros}")
+        finally:
+            processo.terminate()
+            processo.wait(timeout=30)
+
+
+def bench_snapshot():
+    """Snapshot colunar: construção, atualização incremental e soma de uma coluna vs. SQL."""
+    import analitico
+    import numpy as np
+    print("snapshot: abastecimentos -> construção completa / incremental (100 alterações) / soma custo_liquido")
+    for tamanho in (100000, 1000000):
+        _banco_sintetico()
+        conn = database.get_db_connection()
+        _popular_abastecimentos(conn, tamanho)
+        inicio = time.perf_counter()
+        analitico.atualizar_snapshot('abastecimentos', completo=True)
+        construcao = (time.perf_counter() - inicio) * 1000
+        ids = random.sample(range(1, tamanho + 1), 100)
+        conn.executemany("UPDATE abastecimentos SET desconto = 1 WHERE id = ?", [(i,) for i in ids])
+        conn.commit()
+        inicio = time.perf_counter()
+        snapshot = analitico.obter_snapshot('abastecimentos')
+        incremental = (time.perf_counter() - inicio) * 1000
+        ms_snapshot = _medir(lambda: np.nansum(snapshot.coluna('custo_liquido')))
+        ms_sql = _medir(lambda: conn.execute("SELECT TOTAL(custo_liquido) FROM abastecimentos").fetchone(), repeticoes=3)
+        conn.close()
+        print(f"  {tamanho:>8} linhas: construção {construcao:8.1f} ms  incremental {incremental:7.1f} ms  "
+              f"soma {ms_snapshot:6.1f} ms (SQL {ms_sql:7.1f} ms)")
+
+
+def bench_agregacao():
+    """analitico.agregar (sem memo) em históricos grandes vs. o GROUP BY equivalente no SQLite."""
+    import analitico
+    consultas = [
+        ('combustível x mes', dict(chaves=['combustivel', 'mes'], medidas=['litros', 'gasto', 'km_litro']),
+         "SELECT combustivel, strftime('%Y-%m', data), TOTAL(litros), TOTAL(custo_liquido), TOTAL(km_rodados) "
+         "FROM abastecimentos GROUP BY 1, 2"),
+        ('placa x mes', dict(chaves=['placa', 'mes'], medidas=['litros', 'gasto', 'km_litro']),
+         "SELECT placa, strftime('%Y-%m', data), TOTAL(litros), TOTAL(custo_liquido), TOTAL(km_rodados) "
+         "FROM abastecimentos GROUP BY 1, 2"),
+        ('cc x combustível, 1 ano', dict(chaves=['centro_custo', 'combustivel'], medidas=['litros', 'gasto', 'descontos'],
+                                         data_inicio='2022-01-01', data_fim='2022-12-31'),
+         "SELECT centro_custo, combustivel, TOTAL(litros), TOTAL(custo_liquido), TOTAL(desconto) FROM abastecimentos "
+         "WHERE data BETWEEN '2022-01-01' AND '2022-12-31' GROUP BY 1, 2"),
+        ('posto x responsável, diesel', dict(chaves=['posto', 'responsavel'], medidas=['registros', 'gasto'],
+                                             filtros={'combustivel': ['DIESEL S10', 'DIESEL S500']}),
+         "SELECT posto, responsavel, COUNT(*), TOTAL(custo_liquido) FROM abastecimentos "
+         "WHERE combustivel IN ('DIESEL S10', 'DIESEL S500') GROUP BY 1, 2"),
+    ]
+    print("agregacao: abastecimentos -> mediana agregar() sem memo / com memo / SQL GROUP BY")
+    for tamanho in (1000000, 3000000):
+        _banco_sintetico()
+        conn = database.get_db_connection()
+        _popular_abastecimentos(conn, tamanho)
+        analitico.atualizar_snapshot('abastecimentos', completo=True)
+        print(f"  {tamanho:>8} linhas:")
+        for nome, parametros, sql in consultas:
+            def sem_memo():
+                analitico._agregacoes.clear()
+                analitico.agregar('abastecimentos', **parametros)
+            ms = _medir(sem_memo)
+            ms_memo = _medir(lambda: analitico.agregar('abastecimentos', **parametros))
+            ms_sql = _medir(lambda: conn.execute(sql).fetchall(), repeticoes=1)
+            grupos = len(analitico.agregar('abastecimentos', **parametros)['grupos'])
+            print(f"    {nome:<28} {grupos:>7} grupos {ms:7.1f} ms  memo {ms_memo:6.2f} ms  (SQL {ms_sql:8.1f} ms)")
+        conn.close()
+
+
+def bench_resumos():
+    """Totais por período: tabelas de resumo vs. agregação direta da tabela original, e custo por escrita."""
+    consultas = [
+        ('totais relatório, 1 ano', lambda: database.obter_totais_relatorio('2022-01-01', '2022-12-31')),
+        ('totais relatório, 17 dias', lambda: database.obter_totais_relatorio('2022-03-05', '2022-03-21', centro_custo='CC07')),
+        ('gasto por cc, trimestre', lambda: database.resumir('abastecimentos', '2022-01-01', '2022-03-31',
+                                                              agrupar_por=['centro_custo'])),
+        ('dashboard (todo o período)', database.obter_resumo_dashboard),
+    ]
+    print("resumos: abastecimentos -> mediana com resumos / agregação direta")
+    for tamanho in (100000, 1000000):
+        _banco_sintetico()
+        conn = database.get_db_connection()
+        _popular_abastecimentos(conn, tamanho, veiculos=500, perfil_fixo=True)
+        conn.close()
+        inicio = time.perf_counter()
+        database.reconstruir_resumos()
+        print(f"  {tamanho:>8} linhas (reconstrução dos resumos {time.perf_counter() - inicio:5.1f} s):")
+        for nome, consulta in consultas:
+            database._cache_dashboard['versao'] = None
+            ms = _medir(consulta)
+            nivel_resumo = database._nivel_resumo
+            database._nivel_resumo = lambda *args: None  # força a consulta direta
+            try:
+                ms_direto = _medir(lambda: (database._cache_dashboard.update(versao=None), consulta()), repeticoes=3)
+            finally:
+                database._nivel_resumo = nivel_resumo
+            print(f"    {nome:<28} {ms:8.1f} ms  (direto {ms_direto:8.1f} ms)")
+        dados = {'data': '2022-06-15', 'placa': 'BCH0001', 'responsavel': 'BENCH', 'litros': 50, 'desconto': 0,
+                 'odometro': None, 'centro_custo': 'CC01', 'combustivel': 'DIESEL S10', 'custo_por_litro': 5.5,
+                 'custo_bruto': 275, 'custo_liquido': 275, 'posto': 'POSTO 001'}
+        ms = _medir(lambda: database.criar_registro(dados), repeticoes=21)
+        atualizar = database._atualizar_resumos
+        database._atualizar_resumos = lambda *args: None
+        try:
+            ms_sem = _medir(lambda: database.criar_registro(dados), repeticoes=21)
+        finally:
+            database._atualizar_resumos = atualizar
+        print(f"    criar_registro               {ms:8.2f} ms  (sem atualizar resumos {ms_sem:6.2f} ms)")
+
+
+def _popular_manutencoes(conn, linhas, lote=100000):
+    identificacoes = [f'{prefixo}{i:04d}' for prefixo in ('TRATOR ', 'CAM ', 'GERADOR ', 'BCH') for i in range(500)]
+    fornecedores = [f'Fornecedor {i:03d}' for i in range(300)] + [None]
+    inicio = date(2021, 1, 1).toordinal()
+    for base in range(0, linhas, lote):
+        registros = [(random.choice(identificacoes), random.choice(['corretiva', 'preventiva']),
+                      random.choice(['apoio', 'maquinas', 'equipamento']), 'Manutenção sintética',
+                      random.choice(fornecedores), round(random.uniform(50, 20000), 2),
+                      date.fromordinal(inicio + random.randrange(1500)).isoformat(), random.random() < 0.8,
+                      random.choice(['pix', 'boleto', 'dinheiro', '']))
+                     for _ in range(min(lote, linhas - base))]
+        conn.executemany("""
+            INSERT INTO manutencoes (identificacao, tipo, frota, descricao, fornecedor, valor, data_abertura,
+                                     finalizada, forma_pagamento)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, registros)
+        conn.commit()
+
+
+def bench_listagens():
+    """Páginas de /api/listas/<nome> (consultar_listagem) vs. carregar a tabela inteira, como as telas faziam."""
+    print("listagens: mediana por página de 25 linhas")
+    for tamanho in (100000, 500000):
+        _banco_sintetico()
+        conn = database.get_db_connection()
+        _popular_manutencoes(conn, tamanho)
+        _popular_abastecimentos(conn, 1000000, veiculos=500, perfil_fixo=True)
+        conn.close()
+        consultas = [
+            ('manutenções, 1ª página', lambda: database.consultar_listagem('manutencoes')),
+            ('manutenções, página 400', lambda: database.consultar_listagem('manutencoes', inicio=10000)),
+            ('manutenções, valor desc + tipo', lambda: database.consultar_listagem(
+                'manutencoes', ordenacao=[('valor', 'desc')], filtros={'tipo': 'corretiva', 'finalizada': '0'})),
+            ('manutenções, busca "trator 01"', lambda: database.consultar_listagem('manutencoes', busca='trator 01')),
+            ('manutenções, ident. + fornecedor', lambda: database.consultar_listagem(
+                'manutencoes', ordenacao=[('identificacao', 'asc'), ('fornecedor', 'asc')])),
+            ('abastec. (1 mi), 1 ano, 1ª página', lambda: database.consultar_listagem(
+                'abastecimentos', filtros={'data': '2022-01-01|2022-12-31'})),
+            ('abastec. (1 mi), mês por litros', lambda: database.consultar_listagem(
+                'abastecimentos', ordenacao=[('litros', 'desc')], filtros={'data': '2022-03-01|2022-03-31'})),
+            ('abastec. (1 mi), 1 ano, busca placa', lambda: database.consultar_listagem(
+                'abastecimentos', filtros={'data': '2022-01-01|2022-12-31'}, busca='bch01')),
+            ('abastec. (1 mi), 1 ano, linha 100 mil', lambda: database.consultar_listagem(
+                'abastecimentos', inicio=100000, filtros={'data': '2022-01-01|2022-12-31'})),
+            ('abastec. (1 mi), 1 ano, cursor 100 mil', lambda: database.consultar_listagem(
+                'abastecimentos', filtros={'data': '2022-01-01|2022-12-31'}, cursor=cursor_100_mil)),
+        ]
+        # Cursor da linha 100 mil, como a rolagem do relatório chegaria nela
+        cursor_100_mil = database.consultar_listagem(
+            'abastecimentos', inicio=99999, quantidade=1, filtros={'data': '2022-01-01|2022-12-31'})['cursor']
+        print(f"  {tamanho:>8} manutenções:")
+        ms_completo = _medir(database.obter_manutencoes, repeticoes=3)
+        print(f"    {'manutenções, tabela inteira':<36} {ms_completo:8.1f} ms  (carga antiga da tela)")
+        for nome, consulta in consultas:
+            ms_sem_memo = _medir(lambda: (database._cache_contagens.clear(), consulta()), repeticoes=3)
+            print(f"    {nome:<36} {_medir(consulta):8.1f} ms  (contagens sem memo {ms_sem_memo:8.1f} ms)")
+
+
+def bench_qualidade():
+    """Varredura de qualidade: completa (snapshot) e incremental (100 abastecimentos novos) vs. LAG no SQLite."""
+    import analitico
+    import qualidade
+    print("qualidade: abastecimentos -> varredura completa / incremental / só retrocesso+salto com LAG no SQL")
+    for tamanho in (100000, 1000000):
+        _banco_sintetico()
+        conn = database.get_db_connection()
+        _popular_abastecimentos(conn, tamanho)
+        conn.execute("""
+            UPDATE abastecimentos SET odometro = h.odometro
+            FROM (SELECT id, 10000 + SUM(km_rodados) OVER (PARTITION BY placa ORDER BY data, id) AS odometro
+                  FROM abastecimentos) h
+            WHERE h.id = abastecimentos.id
+        """)
+        conn.execute("UPDATE abastecimentos SET odometro = odometro - 5000 WHERE abs(random()) % 1000 = 0")
+        conn.commit()
+        analitico._carregados.clear()  # visão carregada do banco sintético anterior
+        analitico.atualizar_snapshot('abastecimentos', completo=True)
+        completa = _medir(qualidade.varrer_abastecimentos, repeticoes=3)
+        inconsistencias = qualidade.obter_ultima_varredura()['inconsistencias']
+
+        def inserir_e_varrer():
+            conn.executemany("""
+                INSERT INTO abastecimentos (data, placa, litros, odometro, custo_por_litro, custo_bruto, custo_liquido)
+                VALUES ('2025-02-01', ?, 50, 1e7, 5.5, 275, 275)
+            """, [(f'BCH{random.randrange(2000):04d}',) for _ in range(100)])
+            conn.commit()
+            qualidade.varrer_abastecimentos(incremental=True)
+        incremental = _medir(inserir_e_varrer, repeticoes=3)
+        ms_sql = _medir(lambda: conn.execute("""
+            SELECT COUNT(*) FROM (
+                SELECT odometro - LAG(odometro) OVER (PARTITION BY placa ORDER BY data, id) AS delta,
+                       julianday(data) - julianday(LAG(data) OVER (PARTITION BY placa ORDER BY data, id)) AS dias
+                FROM abastecimentos WHERE odometro IS NOT NULL)
+            WHERE delta < 0 OR delta > ? * MAX(dias, 1)
+        """, (qualidade.KM_MAX_POR_DIA,)).fetchone(), repeticoes=1)
+        conn.close()
+        print(f"  {tamanho:>8} linhas: completa {completa:8.1f} ms ({inconsistencias} inconsistências)  "
+              f"incremental {incremental:7.1f} ms  (SQL LAG {ms_sql:8.1f} ms)")
+
+
+BENCHMARKS = {
+    'trocas_oleo': bench_trocas_oleo,
+    'dealer_intelligence': bench_dealer_intelligence,
+    'aprovacao_concorrente': bench_aprovacao_concorrente,
+    'servidor': bench_servidor,
+    'snapshot': bench_snapshot,
+    'agregacao': bench_agregacao,
+    'resumos': bench_resumos,
+    'listagens': bench_listagens,
+    'qualidade': bench_qualidade,
+}
+
+if __name__ == '__main__':
+    random.seed(42)
+    for nome in sys.argv[1:] or list(BENCHMARKS):
+        BENCHMARKS[nome]()
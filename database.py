@@ -1,6 +1,14 @@
 import sqlite3
+import queue
+import threading
+import time
+import unicodedata
+import html
+import numpy as np
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, date, timedelta
+from openpyxl import load_workbook
+from flask import g, has_app_context
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
 import io
@@ -11,12 +19,127 @@ LIMITE_HORIMETRO_TROCA = 350
 ATENCAO_KM = 1000
 ATENCAO_HORAS = 50
 
-def get_db_connection():
-    """Retorna uma conexão com o banco de dados com row_factory ativado."""
-    conn = sqlite3.connect('abastecimentos.db')
+# Configuração do Banco / Pool de Conexões
+DB_PATH = 'abastecimentos.db'
+POOL_MAX_CONEXOES = 8
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA mmap_size = 268435456",   # 256 MB
+    "PRAGMA cache_size = -20000",     # ~20 MB
+    "PRAGMA temp_store = MEMORY",
+)
+
+class ConexaoPool(sqlite3.Connection):
+    """
+    Conexão reaproveitável. Dentro de uma requisição, close() não fecha a conexão:
+    ela é devolvida ao pool no teardown_appcontext (ver liberar_conexao). Como um close() de
+    verdade, descarta o que não foi confirmado: uma escrita que falhou sem rollback não pode
+    ser gravada pelo commit() da próxima função chamada na mesma requisição.
+    """
+    emprestada = False
+
+    def close(self):
+        if self.emprestada:
+            if self.in_transaction:
+                self.rollback()
+            return
+        super().close()
+
+_pool = queue.LifoQueue(maxsize=POOL_MAX_CONEXOES)
+
+# Callback de sqlite3 set_trace_callback para as conexões novas (usado por migracao.verificar_planos_consulta)
+RASTREAR_SQL = None
+
+def _abrir_conexao():
+    """Abre uma conexão nova já com row_factory e PRAGMAs de desempenho aplicados."""
+    conn = sqlite3.connect(DB_PATH, timeout=5, check_same_thread=False, factory=ConexaoPool)
     conn.row_factory = sqlite3.Row
+    if RASTREAR_SQL is not None:
+        conn.set_trace_callback(RASTREAR_SQL)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
+def _emprestar_conexao():
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        conn = _abrir_conexao()
+    conn.emprestada = True
+    return conn
+
+def abrir_conexao_avulsa():
+    """Conexão própria, fora do pool e de g, para leituras longas (o chamador a fecha)."""
+    return _abrir_conexao()
+
+def get_db_connection():
+    """
+    Retorna uma conexão com o banco de dados com row_factory ativado.
+    Dentro de um contexto Flask a mesma conexão (vinda do pool) é usada por toda a
+    requisição e guardada em g; fora dele (scripts, migrações) abre uma conexão avulsa.
+    """
+    if not has_app_context():
+        return _abrir_conexao()
+    if 'db' not in g:
+        g.db = _emprestar_conexao()
+    return g.db
+
+_pools_herdados = []
+
+def reiniciar_pool():
+    """
+    Chamado no processo filho logo após o fork (gunicorn post_fork): cada worker passa a abrir
+    as próprias conexões. As herdadas do master não podem ser usadas (nem fechadas) no filho,
+    então só ficam referenciadas para não serem finalizadas pelo coletor de lixo.
+    """
+    global _pool
+    _pools_herdados.append(_pool)
+    _pool = queue.LifoQueue(maxsize=POOL_MAX_CONEXOES)
+
+def liberar_conexao(exception=None):
+    """Devolve a conexão da requisição ao pool. Registrado em app.teardown_appcontext."""
+    conn = g.pop('db', None)
+    if conn is None:
+        return
+    # Transações deixadas abertas por erro não podem vazar para a próxima requisição
+    if conn.in_transaction:
+        conn.rollback()
+    conn.emprestada = False
+    try:
+        _pool.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+# --- Cache de Dados de Referência ---
+# Listas pequenas e muito lidas (opções de filtro, placas, preços, fornecedores) ficam em
+# memória. As funções de escrita invalidam a tabela correspondente; o TTL cobre as escritas
+# feitas por outros processos (workers do gunicorn, scripts).
+
+CACHE_REFERENCIA_TTL = 300  # segundos
+_cache_referencia = {}
+_cache_referencia_lock = threading.Lock()
+
+def _cache_referencia_obter(tabela, chave, carregar):
+    """Retorna o valor em cache de (tabela, chave) ou o carrega com carregar()."""
+    agora = time.monotonic()
+    with _cache_referencia_lock:
+        item = _cache_referencia.get((tabela, chave))
+    if item and agora - item[0] < CACHE_REFERENCIA_TTL:
+        return list(item[1])
+    valor = carregar()
+    with _cache_referencia_lock:
+        _cache_referencia[(tabela, chave)] = (agora, valor)
+    return list(valor)
+
+def invalidar_cache_referencia(*tabelas):
+    """Descarta as entradas em cache das tabelas informadas (todas, se nenhuma for passada)."""
+    with _cache_referencia_lock:
+        for tabela_chave in list(_cache_referencia):
+            if not tabelas or tabela_chave[0] in tabelas:
+                del _cache_referencia[tabela_chave]
+
 # A função criar_tabelas é usada apenas para novas instalações.
 # A migração de um banco existente deve ser feita com o script migracao_multi_item.py
 def criar_tabelas():
@@ -125,11 +248,440 @@ def criar_tabelas():
         FOREIGN KEY (abastecimento_id) REFERENCES abastecimentos(id)
     )
 ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS notion_pages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, category TEXT NOT NULL,
+        title TEXT NOT NULL, content TEXT, status TEXT DEFAULT 'Ativa',
+        data_registro TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )''')
 
-    
     conn.commit()
     conn.close()
 
+    aplicar_migracoes()
+
+# --- Migrações Versionadas ---
+# Cada migração roda uma única vez; a versão aplicada fica em PRAGMA user_version.
+# Para evoluir o esquema, acrescente uma função _migracao_NNN e registre-a em MIGRACOES.
+
+def _migracao_001_indices(cursor):
+    """Índices para os filtros por data/placa e para as chaves estrangeiras das tabelas filhas."""
+    indices = [
+        "CREATE INDEX IF NOT EXISTS idx_abastecimentos_placa_data ON abastecimentos (placa, data, odometro)",
+        "CREATE INDEX IF NOT EXISTS idx_abastecimentos_placa_odometro ON abastecimentos (placa, odometro)",
+        "CREATE INDEX IF NOT EXISTS idx_abastecimentos_data ON abastecimentos (data)",
+        "CREATE INDEX IF NOT EXISTS idx_pedagios_data_placa ON pedagios (data, placa)",
+        "CREATE INDEX IF NOT EXISTS idx_manutencoes_data_abertura ON manutencoes (data_abertura)",
+        "CREATE INDEX IF NOT EXISTS idx_checklists_identificacao ON checklists (identificacao, horimetro)",
+        "CREATE INDEX IF NOT EXISTS idx_checklists_data ON checklists (data)",
+        "CREATE INDEX IF NOT EXISTS idx_cotacoes_data_registro ON cotacoes (data_registro)",
+        "CREATE INDEX IF NOT EXISTS idx_cotacao_itens_cotacao ON cotacao_itens (cotacao_id)",
+        "CREATE INDEX IF NOT EXISTS idx_orcamentos_cotacao ON orcamentos (cotacao_id, aprovado)",
+        "CREATE INDEX IF NOT EXISTS idx_pedidos_compra_cotacao ON pedidos_compra (cotacao_id)",
+        "CREATE INDEX IF NOT EXISTS idx_pedidos_compra_data_abertura ON pedidos_compra (data_abertura)",
+        "CREATE INDEX IF NOT EXISTS idx_pedido_itens_pedido ON pedido_itens (pedido_id)",
+        "CREATE INDEX IF NOT EXISTS idx_requisicoes_data ON requisicoes_abastecimento (data_solicitacao, id)",
+        "CREATE INDEX IF NOT EXISTS idx_notion_pages_categoria ON notion_pages (category, data_registro)",
+    ]
+    for sql in indices:
+        cursor.execute(sql)
+
+def _migracao_002_km_litro(cursor):
+    """Recalcula km_litro de todo o histórico uma vez; daqui em diante a manutenção é incremental."""
+    recalcular_km_litro(cursor)
+
+def _migracao_003_vehicle_stats(cursor):
+    """Tabela de estatísticas materializadas por veículo, já populada."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS vehicle_stats (
+        placa TEXT PRIMARY KEY, total_abastecimentos INTEGER NOT NULL, total_litros REAL NOT NULL,
+        soma_km_litro REAL NOT NULL, total_gasto REAL NOT NULL, km_atual REAL, data_atualizacao TEXT
+    )''')
+    _reconstruir_vehicle_stats(cursor)
+
+# Tabelas cujo número de versão é mantido por triggers em versoes_tabelas
+TABELAS_VERSIONADAS = [
+    'abastecimentos', 'pedagios', 'manutencoes', 'checklists', 'trocas_oleo', 'precos_combustivel',
+    'fornecedores', 'cotacoes', 'orcamentos', 'pedidos_compra', 'requisicoes_abastecimento',
+    'notion_pages', 'users',
+]
+
+def _criar_triggers_versao(cursor, tabela, registrar_data=False):
+    # registrar_data exige a coluna atualizado_em (migração 009)
+    cursor.execute("INSERT OR IGNORE INTO versoes_tabelas (tabela, versao) VALUES (?, 0)", (tabela,))
+    data = ", atualizado_em = CAST(strftime('%s', 'now') AS INTEGER)" if registrar_data else ""
+    for evento in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_versao_{tabela}_{evento.lower()} AFTER {evento} ON {tabela}
+        BEGIN
+            UPDATE versoes_tabelas SET versao = versao + 1{data} WHERE tabela = '{tabela}';
+        END''')
+
+def _migracao_004_versoes_tabelas(cursor):
+    """Contador de alterações por tabela, usado como chave dos caches em memória."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS versoes_tabelas (
+        tabela TEXT PRIMARY KEY, versao INTEGER NOT NULL DEFAULT 0
+    )''')
+    for tabela in TABELAS_VERSIONADAS:
+        _criar_triggers_versao(cursor, tabela)
+
+def _migracao_005_asset_last_reading(cursor):
+    """Última leitura (odômetro/horímetro) por ativo, já populada."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS asset_last_reading (
+        identificacao TEXT NOT NULL, tipo TEXT NOT NULL CHECK(tipo IN ('veiculo', 'maquina')),
+        leitura REAL NOT NULL, data_leitura TEXT,
+        PRIMARY KEY (identificacao, tipo)
+    ) WITHOUT ROWID''')
+    _reconstruir_ultima_leitura(cursor)
+
+def _migracao_006_indices_manutencoes(cursor):
+    """Índices para os filtros do relatório de manutenções."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_manutencoes_frota_tipo ON manutencoes (frota, tipo, data_abertura)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_manutencoes_finalizada ON manutencoes (finalizada, data_abertura)")
+
+def _reconstruir_totais_compras(cursor):
+    """Recalcula total_itens/valor_aprovado de cotacoes e total_itens de pedidos_compra a partir dos itens."""
+    cursor.execute('''
+        UPDATE cotacoes SET
+            total_itens = (SELECT COUNT(*) FROM cotacao_itens ci WHERE ci.cotacao_id = cotacoes.id),
+            valor_aprovado = (SELECT SUM(o.valor) FROM orcamentos o WHERE o.cotacao_id = cotacoes.id AND o.aprovado = 1)
+    ''')
+    cursor.execute('''
+        UPDATE pedidos_compra SET
+            total_itens = (SELECT COUNT(*) FROM pedido_itens pi WHERE pi.pedido_id = pedidos_compra.id)
+    ''')
+
+def _criar_triggers_contagem(cursor, tabela_itens, coluna_pai, tabela_pai):
+    """Mantém tabela_pai.total_itens em dia com INSERT/DELETE/mudança de pai em tabela_itens."""
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_totais_{tabela_itens}_insert AFTER INSERT ON {tabela_itens}
+    BEGIN
+        UPDATE {tabela_pai} SET total_itens = total_itens + 1 WHERE id = NEW.{coluna_pai};
+    END''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_totais_{tabela_itens}_delete AFTER DELETE ON {tabela_itens}
+    BEGIN
+        UPDATE {tabela_pai} SET total_itens = total_itens - 1 WHERE id = OLD.{coluna_pai};
+    END''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_totais_{tabela_itens}_update AFTER UPDATE OF {coluna_pai} ON {tabela_itens}
+    WHEN OLD.{coluna_pai} IS NOT NEW.{coluna_pai}
+    BEGIN
+        UPDATE {tabela_pai} SET total_itens = total_itens - 1 WHERE id = OLD.{coluna_pai};
+        UPDATE {tabela_pai} SET total_itens = total_itens + 1 WHERE id = NEW.{coluna_pai};
+    END''')
+
+def _migracao_007_totais_compras(cursor):
+    """Colunas desnormalizadas para as listagens de cotações e pedidos, mantidas por triggers."""
+    cursor.execute("ALTER TABLE cotacoes ADD COLUMN total_itens INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("ALTER TABLE cotacoes ADD COLUMN valor_aprovado REAL")
+    cursor.execute("ALTER TABLE pedidos_compra ADD COLUMN total_itens INTEGER NOT NULL DEFAULT 0")
+    _criar_triggers_contagem(cursor, 'cotacao_itens', 'cotacao_id', 'cotacoes')
+    _criar_triggers_contagem(cursor, 'pedido_itens', 'pedido_id', 'pedidos_compra')
+    # valor_aprovado só é recalculado (pelo índice cotacao_id, aprovado) quando um orçamento aprovado está envolvido
+    recalculo = '''
+        UPDATE cotacoes SET valor_aprovado =
+            (SELECT SUM(valor) FROM orcamentos WHERE cotacao_id = {ref}.cotacao_id AND aprovado = 1)
+        WHERE id = {ref}.cotacao_id;'''
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_totais_orcamentos_insert AFTER INSERT ON orcamentos WHEN NEW.aprovado = 1
+    BEGIN {recalculo.format(ref='NEW')}
+    END''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_totais_orcamentos_delete AFTER DELETE ON orcamentos WHEN OLD.aprovado = 1
+    BEGIN {recalculo.format(ref='OLD')}
+    END''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_totais_orcamentos_update AFTER UPDATE OF valor, aprovado, cotacao_id ON orcamentos
+    WHEN OLD.aprovado = 1 OR NEW.aprovado = 1
+    BEGIN {recalculo.format(ref='OLD')} {recalculo.format(ref='NEW')}
+    END''')
+    _reconstruir_totais_compras(cursor)
+
+# Índices de texto (FTS5, conteúdo externo): tabela de origem -> colunas indexadas
+FONTES_BUSCA = {
+    'cotacoes': ('titulo', 'observacoes'),
+    'cotacao_itens': ('descricao',),
+    'pedido_itens': ('descricao',),
+    'fornecedores': ('nome', 'cnpj', 'contato', 'endereco'),
+    'notion_pages': ('title', 'content'),
+}
+
+def _criar_indice_busca(cursor, tabela, colunas):
+    """Cria fts_<tabela> sobre as colunas, as triggers que o mantêm sincronizado e o popula."""
+    lista = ', '.join(colunas)
+    novos = ', '.join(f'NEW.{c}' for c in colunas)
+    antigos = ', '.join(f'OLD.{c}' for c in colunas)
+    cursor.execute(f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS fts_{tabela} USING fts5(
+        {lista}, content='{tabela}', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_busca_{tabela}_insert AFTER INSERT ON {tabela}
+    BEGIN
+        INSERT INTO fts_{tabela} (rowid, {lista}) VALUES (NEW.id, {novos});
+    END''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_busca_{tabela}_delete AFTER DELETE ON {tabela}
+    BEGIN
+        INSERT INTO fts_{tabela} (fts_{tabela}, rowid, {lista}) VALUES ('delete', OLD.id, {antigos});
+    END''')
+    # Só reindexa quando uma coluna indexada muda (as triggers de totais também fazem UPDATE em cotacoes)
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_busca_{tabela}_update AFTER UPDATE OF {lista} ON {tabela}
+    BEGIN
+        INSERT INTO fts_{tabela} (fts_{tabela}, rowid, {lista}) VALUES ('delete', OLD.id, {antigos});
+        INSERT INTO fts_{tabela} (rowid, {lista}) VALUES (NEW.id, {novos});
+    END''')
+    cursor.execute(f"INSERT INTO fts_{tabela} (fts_{tabela}) VALUES ('rebuild')")
+
+def _migracao_008_busca_texto(cursor):
+    """Busca textual FTS5 em cotações, itens, fornecedores e páginas Notion."""
+    for tabela, colunas in FONTES_BUSCA.items():
+        _criar_indice_busca(cursor, tabela, colunas)
+
+def _migracao_009_data_versoes(cursor):
+    """Instante (epoch, em segundos) da última alteração de cada tabela versionada, para o Last-Modified das APIs."""
+    cursor.execute("ALTER TABLE versoes_tabelas ADD COLUMN atualizado_em INTEGER")
+    cursor.execute("UPDATE versoes_tabelas SET atualizado_em = CAST(strftime('%s', 'now') AS INTEGER)")
+    for tabela in TABELAS_VERSIONADAS:
+        for evento in ('insert', 'update', 'delete'):
+            cursor.execute(f"DROP TRIGGER IF EXISTS trg_versao_{tabela}_{evento}")
+        _criar_triggers_versao(cursor, tabela, registrar_data=True)
+
+def _migracao_010_jobs(cursor):
+    """Estado das tarefas executadas em segundo plano (jobs.py)."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, tipo TEXT NOT NULL, parametros TEXT, user_id INTEGER,
+        status TEXT NOT NULL DEFAULT 'Pendente' CHECK(status IN ('Pendente', 'Executando', 'Concluido', 'Erro')),
+        progresso REAL NOT NULL DEFAULT 0, mensagem TEXT,
+        resultado_caminho TEXT, resultado_mimetype TEXT, resultado_nome TEXT,
+        data_criacao TEXT DEFAULT CURRENT_TIMESTAMP, data_inicio TEXT, data_fim TEXT,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs (user_id, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)")
+
+def _migracao_011_snapshot_alteracoes(cursor):
+    """Log de UPDATE/DELETE usado pela atualização incremental do snapshot colunar (analitico.py)."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS snapshot_alteracoes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT, tabela TEXT NOT NULL, registro_id INTEGER NOT NULL
+    )''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_snapshot_alteracoes_tabela ON snapshot_alteracoes (tabela, seq)")
+    for tabela in ('abastecimentos', 'pedagios', 'manutencoes'):
+        for evento in ('UPDATE', 'DELETE'):
+            cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_snapshot_{tabela}_{evento.lower()} AFTER {evento} ON {tabela}
+            BEGIN
+                INSERT INTO snapshot_alteracoes (tabela, registro_id) VALUES ('{tabela}', OLD.id);
+            END''')
+
+def _migracao_012_resumos(cursor):
+    """Tabelas de resumo (rollups) diário/mensal de abastecimentos, pedágios e manutenções, já populadas."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS resumo_abastecimentos_dia (
+        dia TEXT NOT NULL, placa TEXT, centro_custo TEXT, combustivel TEXT, posto TEXT,
+        registros INTEGER NOT NULL, litros REAL, desconto REAL, custo_bruto REAL, custo_liquido REAL
+    )''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS resumo_abastecimentos_mes (
+        mes TEXT NOT NULL, placa TEXT, centro_custo TEXT, combustivel TEXT, posto TEXT,
+        registros INTEGER NOT NULL, litros REAL, desconto REAL, custo_bruto REAL, custo_liquido REAL
+    )''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS resumo_pedagios_mes (
+        mes TEXT NOT NULL, placa TEXT, registros INTEGER NOT NULL, valor REAL
+    )''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS resumo_manutencoes_mes (
+        mes TEXT NOT NULL, frota TEXT, tipo TEXT, finalizada INTEGER, registros INTEGER NOT NULL, valor REAL
+    )''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_resumo_abastecimentos_dia ON resumo_abastecimentos_dia (dia, placa)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_resumo_abastecimentos_mes ON resumo_abastecimentos_mes (mes, placa)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_resumo_pedagios_mes ON resumo_pedagios_mes (mes, placa)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_resumo_manutencoes_mes ON resumo_manutencoes_mes (mes, frota)")
+    _reconstruir_resumos(cursor)
+
+def _migracao_013_indices_listagens(cursor):
+    """Índices das listagens paginadas no servidor (LISTAGENS): filtros por prefixo e colunas ordenáveis."""
+    indices = [
+        "CREATE INDEX IF NOT EXISTS idx_manutencoes_identificacao ON manutencoes (identificacao COLLATE NOCASE, data_abertura)",
+        "CREATE INDEX IF NOT EXISTS idx_manutencoes_fornecedor ON manutencoes (fornecedor COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS idx_manutencoes_valor ON manutencoes (valor)",
+        "CREATE INDEX IF NOT EXISTS idx_checklists_identificacao_nocase ON checklists (identificacao COLLATE NOCASE, data)",
+        "CREATE INDEX IF NOT EXISTS idx_checklists_nivel_oleo ON checklists (nivel_oleo, data)",
+        "CREATE INDEX IF NOT EXISTS idx_pedagios_placa_data ON pedagios (placa, data)",
+        "CREATE INDEX IF NOT EXISTS idx_pedagios_valor ON pedagios (valor)",
+        "CREATE INDEX IF NOT EXISTS idx_requisicoes_status ON requisicoes_abastecimento (status, data_solicitacao, id)",
+        "CREATE INDEX IF NOT EXISTS idx_requisicoes_placa ON requisicoes_abastecimento (placa COLLATE NOCASE, data_solicitacao)",
+        "CREATE INDEX IF NOT EXISTS idx_requisicoes_motorista ON requisicoes_abastecimento (motorista COLLATE NOCASE)",
+    ]
+    for indice in indices:
+        cursor.execute(indice)
+
+def _migracao_014_qualidade_abastecimentos(cursor):
+    """Inconsistências de odômetro/litros/km por litro encontradas pela varredura de qualidade (qualidade.py)."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS inconsistencias_abastecimentos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, abastecimento_id INTEGER NOT NULL, placa TEXT NOT NULL, data TEXT,
+        regra TEXT NOT NULL, valor REAL, referencia REAL, escore REAL,
+        data_deteccao TEXT DEFAULT CURRENT_TIMESTAMP, UNIQUE (abastecimento_id, regra)
+    )''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_inconsistencias_placa ON inconsistencias_abastecimentos (placa, data)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_inconsistencias_regra ON inconsistencias_abastecimentos (regra, data)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_inconsistencias_data ON inconsistencias_abastecimentos (data)")
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS varreduras_qualidade (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, modo TEXT NOT NULL CHECK(modo IN ('completa', 'incremental')),
+        ultimo_id INTEGER NOT NULL, placas INTEGER, linhas INTEGER, inconsistencias INTEGER, duracao_ms REAL,
+        data_execucao TEXT DEFAULT CURRENT_TIMESTAMP
+    )''')
+    # Uma versão por varredura (não por inconsistência gravada), para o ETag de /api/qualidade
+    _criar_triggers_versao(cursor, 'varreduras_qualidade', registrar_data=True)
+
+def _migracao_015_snapshot_alteracoes_colunas(cursor):
+    """
+    Os triggers de UPDATE do log snapshot_alteracoes passam a registrar só alterações reais nas colunas
+    que o snapshot colunar guarda (analitico.TABELAS_SNAPSHOT): recálculos que regravam o mesmo km/l,
+    por exemplo, não geram mais linhas no log.
+    """
+    colunas = {
+        'abastecimentos': ['data', 'placa', 'responsavel', 'litros', 'desconto', 'odometro', 'centro_custo',
+                           'combustivel', 'custo_por_litro', 'custo_bruto', 'custo_liquido', 'posto',
+                           'km_rodados', 'km_litro'],
+        'pedagios': ['data', 'placa', 'valor'],
+        'manutencoes': ['data_abertura', 'identificacao', 'tipo', 'frota', 'fornecedor', 'valor',
+                        'forma_pagamento', 'finalizada', 'parcelas'],
+    }
+    for tabela, nomes in colunas.items():
+        alterou = ' OR '.join(f'OLD.{nome} IS NOT NEW.{nome}' for nome in nomes)
+        cursor.execute(f"DROP TRIGGER IF EXISTS trg_snapshot_{tabela}_update")
+        cursor.execute(f'''
+        CREATE TRIGGER trg_snapshot_{tabela}_update AFTER UPDATE ON {tabela}
+        WHEN {alterou}
+        BEGIN
+            INSERT INTO snapshot_alteracoes (tabela, registro_id) VALUES ('{tabela}', OLD.id);
+        END''')
+
+def _migracao_016_indice_pedidos_fornecedor(cursor):
+    """Pesquisa de pedidos por fornecedor (fts_fornecedores -> pedidos_compra.fornecedor_id) sem varrer os pedidos."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_compra_fornecedor ON pedidos_compra (fornecedor_id)")
+
+def _migracao_017_jobs_data_local(cursor):
+    """
+    jobs.data_criacao vinha do DEFAULT CURRENT_TIMESTAMP (UTC), enquanto data_inicio/data_fim são gravadas
+    na hora local: converte as existentes para a hora local, como criar_job passa a gravar.
+    """
+    cursor.execute("UPDATE jobs SET data_criacao = datetime(data_criacao, 'localtime') WHERE data_criacao IS NOT NULL")
+
+MIGRACOES = [
+    (1, _migracao_001_indices),
+    (2, _migracao_002_km_litro),
+    (3, _migracao_003_vehicle_stats),
+    (4, _migracao_004_versoes_tabelas),
+    (5, _migracao_005_asset_last_reading),
+    (6, _migracao_006_indices_manutencoes),
+    (7, _migracao_007_totais_compras),
+    (8, _migracao_008_busca_texto),
+    (9, _migracao_009_data_versoes),
+    (10, _migracao_010_jobs),
+    (11, _migracao_011_snapshot_alteracoes),
+    (12, _migracao_012_resumos),
+    (13, _migracao_013_indices_listagens),
+    (14, _migracao_014_qualidade_abastecimentos),
+    (15, _migracao_015_snapshot_alteracoes_colunas),
+    (16, _migracao_016_indice_pedidos_fornecedor),
+    (17, _migracao_017_jobs_data_local),
+]
+
+# --- Versões de Tabelas ---
+
+def obter_versoes_tabelas(*tabelas):
+    """
+    Retorna uma tupla com a versão atual de cada tabela pedida (ordem preservada).
+    A versão muda a cada INSERT/UPDATE/DELETE, em qualquer processo que use o banco.
+    """
+    conn = get_db_connection()
+    try:
+        placeholders = ', '.join('?' for _ in tabelas)
+        versoes = dict(conn.execute(f"SELECT tabela, versao FROM versoes_tabelas WHERE tabela IN ({placeholders})", tabelas).fetchall())
+        return tuple(versoes.get(tabela, 0) for tabela in tabelas)
+    finally:
+        conn.close()
+
+def obter_estado_tabelas(*tabelas):
+    """
+    Versões das tabelas (como obter_versoes_tabelas) e o instante epoch da alteração mais recente
+    entre elas, em uma única leitura. Base do ETag/Last-Modified das APIs JSON.
+    """
+    conn = get_db_connection()
+    try:
+        placeholders = ', '.join('?' for _ in tabelas)
+        linhas = conn.execute(
+            f"SELECT tabela, versao, atualizado_em FROM versoes_tabelas WHERE tabela IN ({placeholders})", tabelas
+        ).fetchall()
+    finally:
+        conn.close()
+    versoes = {linha['tabela']: linha['versao'] for linha in linhas}
+    datas = [linha['atualizado_em'] for linha in linhas if linha['atualizado_em']]
+    return tuple(versoes.get(tabela, 0) for tabela in tabelas), (max(datas) if datas else None)
+
+# --- Resumo do Dashboard ---
+
+_cache_dashboard = {'versao': None, 'dados': None}
+
+def obter_resumo_dashboard():
+    """
+    Contadores do dashboard (index e /api/dashboard). O resultado fica em memória e só é
+    recalculado quando abastecimentos ou manutencoes mudam de versão.
+    """
+    versao = obter_versoes_tabelas('abastecimentos', 'manutencoes')
+    if _cache_dashboard['versao'] == versao:
+        return dict(_cache_dashboard['dados'])
+
+    # Totais de todo o período: vêm dos resumos mensais
+    por_placa = resumir('abastecimentos', agrupar_por=['placa'])
+    manutencoes = resumir('manutencoes')[0]
+
+    dados = {
+        'total_abastecimentos': sum(grupo['registros'] for grupo in por_placa),
+        'total_veiculos': len(por_placa),
+        'total_manutencoes': manutencoes['valor'],
+        'manutencoescount': manutencoes['registros'],
+        'gasto_total': sum(grupo['custo_liquido'] for grupo in por_placa)
+    }
+    _cache_dashboard['versao'], _cache_dashboard['dados'] = versao, dados
+    return dict(dados)
+
+def aplicar_migracoes():
+    """Aplica, em ordem e cada uma em sua transação, as migrações ainda não registradas no banco."""
+    conn = _abrir_conexao()
+    try:
+        versao_atual = conn.execute("PRAGMA user_version").fetchone()[0]
+        for versao, migracao in MIGRACOES:
+            if versao <= versao_atual:
+                continue
+            cursor = conn.cursor()
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                migracao(cursor)
+                cursor.execute(f"PRAGMA user_version = {versao}")
+                conn.commit()
+                print(f"Migração {versao:03d} ({migracao.__name__}) aplicada.")
+            except Exception:
+                conn.rollback()
+                raise
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA optimize")
+    finally:
+        conn.close()
+
 # --- Funções de Cotação (REESTRUTURADAS) ---
 
 def criar_cotacao_com_itens(user_id, dados):
@@ -171,9 +723,7 @@ def obter_cotacoes():
     query = '''
         SELECT
             c.id, c.titulo, c.data_limite, c.status,
-            u.username as solicitante,
-            (SELECT COUNT(*) FROM cotacao_itens ci WHERE ci.cotacao_id = c.id) as total_itens,
-            (SELECT SUM(o.valor) FROM orcamentos o WHERE o.cotacao_id = c.id AND o.aprovado = 1) as valor_aprovado
+            u.username as solicitante, c.total_itens, c.valor_aprovado
         FROM cotacoes c
         JOIN users u ON c.user_id = u.id
         ORDER BY c.data_registro DESC
@@ -219,45 +769,46 @@ def adicionar_orcamento(dados):
 def aprovar_orcamento(orcamento_id, user_id):
     """
     Aprova um orçamento, atualiza status e cria um Pedido de Compra.
-    Garante que apenas um orçamento seja marcado como 'aprovado' por cotação.
+    Garante que apenas um orçamento seja marcado como 'aprovado' por cotação e que cada cotação gere
+    um único pedido. Tudo ocorre em uma transação BEGIN IMMEDIATE curta, sem consultas em outra conexão.
     """
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        # Pega os dados do orçamento que será aprovado
-        orcamento = pd.read_sql('SELECT * FROM orcamentos WHERE id = ?', conn, params=(orcamento_id,)).iloc[0].to_dict()
+        # Reserva o lock de escrita já no início: aprovações concorrentes esperam (busy_timeout) em vez de conflitar
+        cursor.execute("BEGIN IMMEDIATE")
+        orcamento = cursor.execute(
+            "SELECT cotacao_id, fornecedor_id, valor FROM orcamentos WHERE id = ?", (orcamento_id,)
+        ).fetchone()
+        if orcamento is None:
+            raise ValueError(f"Orçamento {orcamento_id} não encontrado.")
         cotacao_id = orcamento['cotacao_id']
-        
-        # --- LÓGICA DE CORREÇÃO ---
-        # 1. Primeiro, redefine o status de TODOS os orçamentos para esta cotação como NÃO aprovado.
-        cursor.execute("UPDATE orcamentos SET aprovado = 0 WHERE cotacao_id = ?", (cotacao_id,))
-        
-        # 2. Em seguida, marca APENAS o orçamento selecionado como APROVADO.
-        cursor.execute("UPDATE orcamentos SET aprovado = 1 WHERE id = ?", (orcamento_id,))
 
-        # 3. CORREÇÃO: Atualiza o status da cotação-mãe para 'Aprovada' com formato de data consistente
+        if cursor.execute("SELECT 1 FROM pedidos_compra WHERE cotacao_id = ? LIMIT 1", (cotacao_id,)).fetchone():
+            raise ValueError(f"A cotação {cotacao_id} já possui Pedido de Compra.")
+
+        # 1. Marca APENAS o orçamento selecionado como aprovado (os demais da cotação ficam não aprovados)
+        cursor.execute("UPDATE orcamentos SET aprovado = (id = ?) WHERE cotacao_id = ?", (orcamento_id, cotacao_id))
+
+        # 2. Atualiza o status da cotação-mãe para 'Aprovada'
         data_aprovacao = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        cursor.execute("UPDATE cotacoes SET status = 'Aprovada', data_aprovacao = ? WHERE id = ?", 
-                      (data_aprovacao, cotacao_id))
-        
-        # Verifica se a atualização foi bem-sucedida
-        if cursor.rowcount == 0:
-            print(f"AVISO: Nenhuma cotação foi atualizada para ID {cotacao_id}")
-        
-        # 4. Cria o Pedido de Compra
+        cursor.execute("UPDATE cotacoes SET status = 'Aprovada', data_aprovacao = ? WHERE id = ?",
+                       (data_aprovacao, cotacao_id))
+
+        # 3. Cria o Pedido de Compra
         cursor.execute('''
             INSERT INTO pedidos_compra (cotacao_id, user_id, fornecedor_id, valor_total, data_abertura, status)
             VALUES (?, ?, ?, ?, ?, 'Aberto')
         ''', (cotacao_id, user_id, orcamento['fornecedor_id'], orcamento['valor'], data_aprovacao))
         pedido_id = cursor.lastrowid
 
-        # 5. Copia os itens da cotação para o pedido
-        itens_cotacao = obter_itens_por_cotacao_id(cotacao_id)
-        itens_pedido = [(pedido_id, item['descricao'], item['quantidade']) for item in itens_cotacao]
-        cursor.executemany('INSERT INTO pedido_itens (pedido_id, descricao, quantidade) VALUES (?, ?, ?)', itens_pedido)
-        
+        # 4. Copia os itens da cotação para o pedido sem sair do SQLite
+        cursor.execute('''
+            INSERT INTO pedido_itens (pedido_id, descricao, quantidade)
+            SELECT ?, descricao, quantidade FROM cotacao_itens WHERE cotacao_id = ? ORDER BY id
+        ''', (pedido_id, cotacao_id))
+
         conn.commit()
-        print(f"DEBUG: Cotação {cotacao_id} aprovada com sucesso. Status atualizado para 'Aprovada'")
         return pedido_id
     except Exception as e:
         conn.rollback()
@@ -288,8 +839,7 @@ def obter_pedidos_compra():
     query = '''
         SELECT
             p.id, p.cotacao_id, p.status, p.data_abertura, p.valor_total,
-            f.nome as fornecedor_nome,
-            (SELECT COUNT(*) FROM pedido_itens pi WHERE pi.pedido_id = p.id) as total_itens
+            f.nome as fornecedor_nome, p.total_itens
         FROM pedidos_compra p
         JOIN fornecedores f ON p.fornecedor_id = f.id
         ORDER BY p.data_abertura DESC
@@ -332,70 +882,68 @@ def finalizar_pedido_compra(pedido_id, dados):
 
 # --- (O resto das funções permanecem as mesmas) ---
 def obter_dealer_intelligence(data_inicio, data_fim):
+    """
+    Indicadores do Dealer Intelligence no período.
+    Cotações são filtradas por data_registro e pedidos finalizados por data_abertura, ambos no intervalo
+    [data_inicio, data_fim + 1 dia) para que o último dia entre inteiro nos timestamps em texto.
+    Faixa de preços (MIN/MAX) por cotação, pedido selecionado e somatórios saem de uma única consulta.
+    """
+    periodo = (data_inicio, data_fim)
+
+    # Pedidos finalizados no período cuja cotação tem orçamento aprovado (uma linha por pedido)
+    pedidos_cte = '''
+        pedidos AS (
+            SELECT p.id, p.cotacao_id, p.valor_total, p.data_abertura, p.data_finalizacao
+            FROM pedidos_compra p
+            WHERE p.status = 'Finalizado' AND p.data_abertura >= ? AND p.data_abertura < date(?, '+1 day')
+              AND EXISTS (SELECT 1 FROM orcamentos o WHERE o.cotacao_id = p.cotacao_id AND o.aprovado = 1)
+        )'''
     conn = get_db_connection()
-    
-    # Query para obter todos os orçamentos das cotações no período
-    query_orcamentos = '''
-        SELECT c.id as cotacao_id, o.valor
-        FROM orcamentos o
-        JOIN cotacoes c ON o.cotacao_id = c.id
-        WHERE c.data_registro BETWEEN ? AND ?
-    '''
-    df_orcamentos = pd.read_sql(query_orcamentos, conn, params=(data_inicio, data_fim))
-    
-    # Query para obter pedidos finalizados no período
-    query_pedidos = '''
-        SELECT p.valor_total, p.data_abertura, p.data_finalizacao, o.cotacao_id
-        FROM pedidos_compra p
-        JOIN orcamentos o ON p.cotacao_id = o.cotacao_id AND o.aprovado = 1
-        WHERE p.status = 'Finalizado' AND p.data_abertura BETWEEN ? AND ?
-    '''
-    df_pedidos = pd.read_sql(query_pedidos, conn, params=(data_inicio, data_fim))
-    conn.close()
-    
-    # Inicializar variáveis
-    total_fechado = df_pedidos['valor_total'].sum() if not df_pedidos.empty else 0
-    total_orcado = 0
-    valor_poupado = 0
-    descontos_perdidos = 0
-    
-    # Processar cada cotação que tem orçamentos
-    if not df_orcamentos.empty:
-        # Para cada cotação, calcular o valor mínimo e máximo dos orçamentos
-        for cotacao_id, group in df_orcamentos.groupby('cotacao_id'):
-            valor_minimo = group['valor'].min()
-            valor_maximo = group['valor'].max()
-            total_orcado += valor_minimo  # Mantém a lógica atual para referência
-            
-            # Verificar se esta cotação tem um pedido finalizado
-            if cotacao_id in df_pedidos['cotacao_id'].values:
-                valor_selecionado = df_pedidos[df_pedidos['cotacao_id'] == cotacao_id]['valor_total'].iloc[0]
-                
-                # CORREÇÃO: Aplicar a lógica correta
-                # Valor Poupado = Valor máximo - Valor selecionado
-                valor_poupado += max(0, valor_maximo - valor_selecionado)
-                
-                # Descontos Perdidos = Valor selecionado - Valor mínimo
-                descontos_perdidos += max(0, valor_selecionado - valor_minimo)
-    
-    # NOVA LÓGICA: Saldo = Valor Poupado - Descontos Perdidos
-    saldo = valor_poupado - descontos_perdidos
-    
-    # Cálculo do tempo de processamento (mantido igual)
+    try:
+        totais = conn.execute(f'''
+            WITH faixa AS (
+                SELECT o.cotacao_id, MIN(o.valor) as valor_minimo, MAX(o.valor) as valor_maximo
+                FROM orcamentos o
+                JOIN cotacoes c ON o.cotacao_id = c.id
+                WHERE c.data_registro >= ? AND c.data_registro < date(?, '+1 day')
+                GROUP BY o.cotacao_id
+            ),
+            {pedidos_cte},
+            selecionado AS (
+                SELECT cotacao_id, valor_total FROM pedidos
+                WHERE id IN (SELECT MIN(id) FROM pedidos GROUP BY cotacao_id)
+            )
+            SELECT
+                (SELECT COALESCE(SUM(valor_total), 0) FROM pedidos) as total_fechado,
+                COALESCE(SUM(f.valor_minimo), 0) as total_orcado,
+                COALESCE(SUM(MAX(0, f.valor_maximo - s.valor_total)), 0) as valor_poupado,
+                COALESCE(SUM(MAX(0, s.valor_total - f.valor_minimo)), 0) as descontos_perdidos
+            FROM faixa f
+            LEFT JOIN selecionado s ON s.cotacao_id = f.cotacao_id
+        ''', periodo + periodo).fetchone()
+
+        df_pedidos = pd.read_sql(f"WITH {pedidos_cte} SELECT data_abertura, data_finalizacao FROM pedidos ORDER BY id",
+                                 conn, params=periodo)
+    finally:
+        conn.close()
+
+    valor_poupado = float(totais['valor_poupado'])
+    descontos_perdidos = float(totais['descontos_perdidos'])
+
+    # Tempo de processamento: diferença vetorizada entre abertura e finalização
     media_dias_processamento = 0
     relatorio_processamento = []
-    
-    if not df_pedidos.empty and 'data_finalizacao' in df_pedidos.columns and pd.notna(df_pedidos['data_finalizacao']).all():
-        df_pedidos['data_abertura'] = pd.to_datetime(df_pedidos['data_abertura'])
-        df_pedidos['data_finalizacao'] = pd.to_datetime(df_pedidos['data_finalizacao'])
+    if not df_pedidos.empty and df_pedidos['data_finalizacao'].notna().all():
+        df_pedidos['data_abertura'] = pd.to_datetime(df_pedidos['data_abertura'], format='mixed')
+        df_pedidos['data_finalizacao'] = pd.to_datetime(df_pedidos['data_finalizacao'], format='mixed')
         df_pedidos['dias_processamento'] = (df_pedidos['data_finalizacao'] - df_pedidos['data_abertura']).dt.days
         media_dias_processamento = df_pedidos['dias_processamento'].mean()
-        relatorio_processamento = df_pedidos[['data_abertura', 'data_finalizacao', 'dias_processamento']].to_dict('records')
-    
+        relatorio_processamento = df_pedidos.to_dict('records')
+
     return {
-        'total_fechado': total_fechado,
-        'total_orcado': total_orcado,  # Mantido para referência, mas não será exibido
-        'saldo': saldo,  # NOVO: Saldo calculado
+        'total_fechado': float(totais['total_fechado']),
+        'total_orcado': float(totais['total_orcado']),  # Mantido para referência, mas não será exibido
+        'saldo': valor_poupado - descontos_perdidos,
         'valor_poupado': valor_poupado,
         'descontos_perdidos': descontos_perdidos,
         'media_dias_processamento': media_dias_processamento if pd.notna(media_dias_processamento) else 0,
@@ -414,6 +962,39 @@ def get_user_by_id(user_id):
     conn.close()
     return user
 
+# Cache do usuário logado (carregado a cada requisição): user_id -> (instante, versão de users, linha),
+# em ordem de uso (LRU, no máximo CACHE_USUARIO_MAX entradas). Por CACHE_USUARIO_TTL segundos a linha
+# é usada sem consultar o banco; vencido o prazo, compara-se a versão de users (versoes_tabelas) e a
+# linha só é relida se alguma conta mudou. Defasagem: alteração de papel ou exclusão de conta feita em
+# outro worker leva até CACHE_USUARIO_TTL segundos para valer nele; no próprio worker vale na hora.
+CACHE_USUARIO_TTL = 30  # segundos
+CACHE_USUARIO_MAX = 1024
+_cache_usuarios = {}
+_cache_usuarios_lock = threading.Lock()
+
+def obter_usuario_sessao(user_id):
+    """get_user_by_id com cache em memória por user_id (ver CACHE_USUARIO_TTL)."""
+    agora = time.monotonic()
+    with _cache_usuarios_lock:
+        item = _cache_usuarios.pop(user_id, None)
+        if item:
+            _cache_usuarios[user_id] = item  # volta para o fim: usada mais recentemente
+    if item and agora - item[0] < CACHE_USUARIO_TTL:
+        return item[2]
+    # A versão é lida antes do usuário: uma alteração entre as duas leituras força nova leitura depois
+    versao = obter_versoes_tabelas('users')[0]
+    user = item[2] if item and item[1] == versao else get_user_by_id(user_id)
+    with _cache_usuarios_lock:
+        _cache_usuarios.pop(user_id, None)
+        if len(_cache_usuarios) >= CACHE_USUARIO_MAX:
+            del _cache_usuarios[next(iter(_cache_usuarios))]
+        _cache_usuarios[user_id] = (agora, versao, user)
+    return user
+
+def _descartar_usuario_sessao(user_id):
+    with _cache_usuarios_lock:
+        _cache_usuarios.pop(user_id, None)
+
 def get_all_users():
     conn = get_db_connection()
     df = pd.read_sql("SELECT id, username, role FROM users ORDER BY role, username", conn)
@@ -451,6 +1032,7 @@ def update_user(user_id, username, role, password=None):
             cursor.execute("UPDATE users SET username = ?, role = ? WHERE id = ?", (username, role, user_id))
             
         conn.commit()
+        _descartar_usuario_sessao(user_id)
         return cursor.rowcount > 0
     except sqlite3.IntegrityError:
         return False
@@ -465,6 +1047,7 @@ def delete_user(user_id):
     try:
         cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
         conn.commit()
+        _descartar_usuario_sessao(user_id)
         return cursor.rowcount > 0
     finally:
         conn.close()
@@ -478,6 +1061,7 @@ def criar_fornecedor(dados):
             VALUES (?, ?, ?, ?, ?, ?)
         ''', (dados['cnpj'], dados['nome'], dados['ie'], dados['endereco'], dados['tipo'], dados['contato']))
         conn.commit()
+        invalidar_cache_referencia('fornecedores')
         return cursor.lastrowid
     except sqlite3.IntegrityError:
         return False
@@ -485,17 +1069,21 @@ def criar_fornecedor(dados):
         conn.close()
 
 def obter_fornecedores():
-    conn = get_db_connection()
-    df = pd.read_sql('SELECT id, cnpj, nome, ie, tipo, contato, data_registro FROM fornecedores ORDER BY nome', conn)
-    conn.close()
-    return df.to_dict('records')
+    def carregar():
+        conn = get_db_connection()
+        df = pd.read_sql('SELECT id, cnpj, nome, ie, tipo, contato, data_registro FROM fornecedores ORDER BY nome', conn)
+        conn.close()
+        return df.to_dict('records')
+    return _cache_referencia_obter('fornecedores', 'lista', carregar)
 
 def obter_precos_combustivel(): 
-    conn = get_db_connection()
-    query = "SELECT combustivel, preco, data_atualizacao FROM precos_combustivel ORDER BY combustivel"
-    df = pd.read_sql(query, conn)
-    conn.close()
-    return df.to_dict('records')
+    def carregar():
+        conn = get_db_connection()
+        query = "SELECT combustivel, preco, data_atualizacao FROM precos_combustivel ORDER BY combustivel"
+        df = pd.read_sql(query, conn)
+        conn.close()
+        return df.to_dict('records')
+    return _cache_referencia_obter('precos_combustivel', 'lista', carregar)
 
 def atualizar_preco_combustivel(combustivel, novo_preco):
     conn = get_db_connection()
@@ -507,6 +1095,7 @@ def atualizar_preco_combustivel(combustivel, novo_preco):
         WHERE combustivel = ?
         ''', (round(float(novo_preco), 3), datetime.now().strftime('%Y-%m-%d'), combustivel))
         conn.commit()
+        invalidar_cache_referencia('precos_combustivel')
         return True
     except Exception as e:
         print(f"Erro ao atualizar preço: {e}")
@@ -523,6 +1112,7 @@ def criar_combustivel(combustivel, preco):
         VALUES (?, ?, ?)
         ''', (combustivel.upper(), round(float(preco), 3), datetime.now().strftime('%Y-%m-%d')))
         conn.commit()
+        invalidar_cache_referencia('precos_combustivel')
         return True
     except sqlite3.IntegrityError:
         return False
@@ -532,18 +1122,15 @@ def criar_combustivel(combustivel, preco):
     finally:
         conn.close()
 
-def obter_relatorio(data_inicio, data_fim, placa=None, centro_custo=None, combustivel=None, posto=None): 
-    conn = get_db_connection()
-    query = """
-    SELECT 
+COLUNAS_RELATORIO = """
         id, data, placa, responsavel, litros, desconto, odometro,
         centro_custo, combustivel, custo_por_litro, custo_bruto, 
-        custo_liquido, km_litro, posto, integracao_atheris
-    FROM abastecimentos
-    WHERE data BETWEEN ? AND ?
-    """
+        custo_liquido, km_litro, posto, integracao_atheris"""
+
+def _filtros_relatorio(data_inicio, data_fim, placa=None, centro_custo=None, combustivel=None, posto=None):
+    """Monta o WHERE (e seus parâmetros) comum ao relatório de abastecimentos e suas variantes."""
+    conditions = ["data BETWEEN ? AND ?"]
     params = [data_inicio, data_fim]
-    conditions = []
     if placa:
         conditions.append("placa = ?")
         params.append(placa.upper())
@@ -556,10 +1143,12 @@ def obter_relatorio(data_inicio, data_fim, placa=None, centro_custo=None, combus
     if posto:
         conditions.append("posto = ?")
         params.append(posto)
-    
-    if conditions:
-        query += " AND " + " AND ".join(conditions)
-    query += " ORDER BY data DESC"
+    return " AND ".join(conditions), params
+
+def obter_relatorio(data_inicio, data_fim, placa=None, centro_custo=None, combustivel=None, posto=None): 
+    conn = get_db_connection()
+    where, params = _filtros_relatorio(data_inicio, data_fim, placa, centro_custo, combustivel, posto)
+    query = f"SELECT {COLUNAS_RELATORIO} FROM abastecimentos WHERE {where} ORDER BY data DESC"
     
     try:
         df = pd.read_sql(query, conn, params=params)
@@ -570,71 +1159,461 @@ def obter_relatorio(data_inicio, data_fim, placa=None, centro_custo=None, combus
         conn.close()
     return df
 
-def obter_opcoes_filtro(coluna):
+def obter_relatorio_pagina(filtros, cursor_data=None, cursor_id=None, limite=100, ordem='desc'):
+    """
+    Uma página do relatório de abastecimentos com paginação keyset por (data, id).
+    Retorna os registros e o cursor da próxima página (None quando acabou).
+    """
+    where, params = _filtros_relatorio(**filtros)
+    ordem = 'ASC' if str(ordem).lower() == 'asc' else 'DESC'
+    if cursor_data is not None and cursor_id is not None:
+        comparador = '>' if ordem == 'ASC' else '<'
+        where += f" AND (data {comparador} ? OR (data = ? AND id {comparador} ?))"
+        params += [cursor_data, cursor_data, cursor_id]
+
+    query = f"""
+        SELECT {COLUNAS_RELATORIO} FROM abastecimentos
+        WHERE {where}
+        ORDER BY data {ordem}, id {ordem}
+        LIMIT ?
+    """
     conn = get_db_connection()
-    query = f"SELECT DISTINCT {coluna} FROM abastecimentos WHERE {coluna} IS NOT NULL AND {coluna} != '' ORDER BY {coluna}"
     try:
-        resultados = pd.read_sql(query, conn)
-        return resultados[coluna].tolist()
+        # Busca um registro a mais para saber se existe próxima página
+        linhas = [dict(row) for row in conn.execute(query, params + [limite + 1]).fetchall()]
+    finally:
+        conn.close()
+
+    proximo_cursor = None
+    if len(linhas) > limite:
+        linhas = linhas[:limite]
+        proximo_cursor = {'data': linhas[-1]['data'], 'id': linhas[-1]['id']}
+    return linhas, proximo_cursor
+
+def obter_totais_relatorio(data_inicio, data_fim, placa=None, centro_custo=None, combustivel=None, posto=None):
+    """Totais do relatório de abastecimentos, lidos do resumo diário (um grupo por posto)."""
+    filtros = {'placa': placa.upper() if placa else None, 'centro_custo': centro_custo or None,
+               'combustivel': combustivel or None, 'posto': posto or None}
+    por_posto = resumir('abastecimentos', data_inicio, data_fim, filtros, agrupar_por=['posto'])
+    totais = {
+        'total_registros': sum(grupo['registros'] for grupo in por_posto),
+        'total_litros': sum(grupo['litros'] for grupo in por_posto),
+        'total_valor': sum(grupo['custo_liquido'] for grupo in por_posto),
+        'total_postos': sum(1 for grupo in por_posto if grupo['posto']),
+    }
+    n = totais['total_registros']
+    totais['media_litros'] = totais['total_litros'] / n if n else 0
+    totais['media_valor'] = totais['total_valor'] / n if n else 0
+    return totais
+
+# --- Exportação (leitura em fluxo) ---
+
+def consulta_exportacao(relatorio, data_inicio, data_fim, placa=None, centro_custo=None, combustivel=None, posto=None):
+    """Retorna (sql, params) do relatório a exportar: 'abastecimentos', 'pedagios' ou 'manutencoes'."""
+    if relatorio == 'abastecimentos':
+        where, params = _filtros_relatorio(data_inicio, data_fim, placa, centro_custo, combustivel, posto)
+        return f"SELECT {COLUNAS_RELATORIO} FROM abastecimentos WHERE {where} ORDER BY data DESC, id DESC", params
+    if relatorio == 'pedagios':
+        query = "SELECT id, data, placa, valor, observacoes FROM pedagios WHERE data BETWEEN ? AND ?"
+        params = [data_inicio, data_fim]
+        if placa:
+            query += " AND placa = ?"
+            params.append(placa.upper())
+        return query + " ORDER BY data DESC, placa ASC", params
+    if relatorio == 'manutencoes':
+        query = """
+            SELECT id, identificacao, tipo, frota, descricao, fornecedor, valor, data_abertura,
+                   previsao_conclusao, data_conclusao, finalizada, forma_pagamento, parcelas, observacoes
+            FROM manutencoes WHERE data_abertura BETWEEN ? AND ?
+        """
+        params = [data_inicio, data_fim]
+        if placa:
+            query += " AND identificacao = ?"
+            params.append(placa)
+        return query + " ORDER BY data_abertura DESC, id DESC", params
+    raise ValueError(f"Relatório desconhecido: {relatorio}")
+
+def iterar_consulta(query, params=(), tamanho_lote=1000):
+    """
+    Gerador que produz primeiro a lista de colunas e depois as linhas (tuplas) da consulta,
+    lidas em lotes. Usa uma conexão própria, fechada quando o gerador termina.
+    """
+    conn = _abrir_conexao()
+    conn.row_factory = None
+    try:
+        cursor = conn.execute(query, params)
+        yield [coluna[0] for coluna in cursor.description]
+        while True:
+            lote = cursor.fetchmany(tamanho_lote)
+            if not lote:
+                break
+            yield from lote
+    finally:
+        conn.close()
+
+def _valores_distintos(tabela, coluna, condicao_inicial):
+    """
+    Valores distintos de uma coluna indexada, em ordem, saltando de um valor ao seguinte pelo índice
+    (uma busca por valor) em vez de percorrer o índice inteiro como o SELECT DISTINCT faria.
+    """
+    conn = get_db_connection()
+    try:
+        return [linha[0] for linha in conn.execute(f"""
+            WITH RECURSIVE valores(valor) AS (
+                SELECT MIN({coluna}) FROM {tabela} WHERE {condicao_inicial}
+                UNION ALL
+                SELECT (SELECT MIN({coluna}) FROM {tabela} WHERE {coluna} > valor) FROM valores WHERE valor IS NOT NULL
+            )
+            SELECT valor FROM valores WHERE valor IS NOT NULL
+        """)]
+    finally:
+        conn.close()
+
+def obter_opcoes_filtro(coluna):
+    """Opções dos filtros do relatório (centro_custo, combustivel, posto), lidas do resumo mensal."""
+    def carregar():
+        conn = get_db_connection()
+        # O relatório sempre filtra por data, então os abastecimentos sem data (fora dos resumos) não fazem falta
+        query = f"SELECT DISTINCT {coluna} FROM resumo_abastecimentos_mes WHERE {coluna} IS NOT NULL AND {coluna} != '' ORDER BY {coluna}"
+        try:
+            return pd.read_sql(query, conn)[coluna].tolist()
+        finally:
+            conn.close()
+    try:
+        return _cache_referencia_obter('abastecimentos', f'opcoes_{coluna}', carregar)
     except Exception as e:
         print(f"Erro ao obter opções de filtro para {coluna}: {e}")
         return []
-    finally:
-        conn.close()
 
 def obter_placas_veiculos():
-    conn = get_db_connection()
+    def carregar():
+        return _valores_distintos('abastecimentos', 'placa', 'placa IS NOT NULL')  # idx_abastecimentos_placa_data
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT DISTINCT placa FROM abastecimentos WHERE placa IS NOT NULL ORDER BY placa")
-        placas = [row[0] for row in cursor.fetchall()]
-        return placas
+        return _cache_referencia_obter('abastecimentos', 'placas', carregar)
     except Exception as e:
         print(f"Erro ao obter placas: {e}")
         return []
-    finally:
-        conn.close()
 
-def calcular_medias_veiculos():
-    conn = get_db_connection()
-    query_calculo_km = """
+# --- km/litro Incremental ---
+# km_rodados/km_litro de um abastecimento dependem apenas do abastecimento anterior (com
+# odômetro) da mesma placa, em ordem cronológica (data, id). Cada escrita recalcula só a
+# linha afetada e sua vizinha seguinte, inclusive para lançamentos retroativos.
+
+def recalcular_km_litro(cursor, placa=None):
+    """Recálculo completo (set-based) de km_rodados e km_litro, opcionalmente de uma só placa."""
+    filtro_placa = "AND placa = ?" if placa else ""
+    cursor.execute(f"""
     WITH abastecimentos_ordenados AS (
-        SELECT 
-            id, placa, data, odometro, litros,
-            LAG(odometro) OVER (PARTITION BY placa ORDER BY data) as odometro_anterior
+        SELECT
+            id, odometro, litros,
+            LAG(odometro) OVER (PARTITION BY placa ORDER BY data, id) as odometro_anterior
         FROM abastecimentos
-        WHERE odometro IS NOT NULL
+        WHERE odometro IS NOT NULL {filtro_placa}
     ),
     abastecimentos_com_km AS (
-        SELECT 
-            id, odometro, odometro_anterior, litros,
-            CASE WHEN odometro_anterior IS NOT NULL AND odometro > odometro_anterior 
+        SELECT
+            id,
+            CASE WHEN odometro_anterior IS NOT NULL AND odometro > odometro_anterior
                 THEN odometro - odometro_anterior ELSE NULL END as km_rodados,
             CASE WHEN odometro_anterior IS NOT NULL AND odometro > odometro_anterior AND litros > 0
-                THEN (odometro - odometro_anterior) / litros ELSE NULL END as km_litro_calculado
+                THEN (odometro - odometro_anterior) / litros ELSE NULL END as km_litro
         FROM abastecimentos_ordenados
     )
     UPDATE abastecimentos
-    SET km_rodados = (SELECT km_rodados FROM abastecimentos_com_km WHERE abastecimentos_com_km.id = abastecimentos.id),
-    km_litro = (SELECT km_litro_calculado FROM abastecimentos_com_km WHERE abastecimentos_com_km.id = abastecimentos.id)
-    WHERE EXISTS (SELECT 1 FROM abastecimentos_com_km WHERE abastecimentos_com_km.id = abastecimentos.id)
+    SET km_rodados = k.km_rodados, km_litro = k.km_litro
+    FROM abastecimentos_com_km k
+    WHERE k.id = abastecimentos.id
+    """, (placa,) if placa else ())
+
+def _recalcular_km_registro(cursor, id):
+    """Recalcula km_rodados/km_litro de um único abastecimento a partir do anterior da placa."""
+    cursor.execute("SELECT placa, data, odometro, litros FROM abastecimentos WHERE id = ?", (id,))
+    registro = cursor.fetchone()
+    if registro is None:
+        return
+    placa, data, odometro, litros = registro
+    km_rodados = km_litro = None
+    if odometro is not None:
+        cursor.execute("""
+            SELECT odometro FROM abastecimentos
+            WHERE placa = ? AND odometro IS NOT NULL AND (data < ? OR (data = ? AND id < ?))
+            ORDER BY data DESC, id DESC LIMIT 1
+        """, (placa, data, data, id))
+        anterior = cursor.fetchone()
+        if anterior and odometro > anterior[0]:
+            km_rodados = odometro - anterior[0]
+            km_litro = km_rodados / litros if litros > 0 else None
+    cursor.execute("UPDATE abastecimentos SET km_rodados = ?, km_litro = ? WHERE id = ?", (km_rodados, km_litro, id))
+
+def _recalcular_km_seguinte(cursor, placa, data, id):
+    """Recalcula o primeiro abastecimento com odômetro que vem depois da posição (data, id) da placa."""
+    cursor.execute("""
+        SELECT id FROM abastecimentos
+        WHERE placa = ? AND odometro IS NOT NULL AND (data > ? OR (data = ? AND id > ?))
+        ORDER BY data, id LIMIT 1
+    """, (placa, data, data, id))
+    seguinte = cursor.fetchone()
+    if seguinte:
+        _recalcular_km_registro(cursor, seguinte[0])
+
+# --- Última Leitura por Ativo (asset_last_reading) ---
+# Odômetro atual de cada veículo (abastecimentos) e horímetro atual de cada máquina
+# (checklists), mantidos pelas funções de escrita para consulta direta pela chave primária.
+
+FONTES_LEITURA = {
+    'veiculo': ('abastecimentos', 'placa', 'odometro'),
+    'maquina': ('checklists', 'identificacao', 'horimetro'),
+}
+
+def _atualizar_ultima_leitura(cursor, tipo, *identificacoes):
+    """Regrava a última leitura dos ativos informados (busca indexada por identificação)."""
+    tabela, coluna_id, coluna_leitura = FONTES_LEITURA[tipo]
+    for identificacao in set(identificacoes):
+        cursor.execute("DELETE FROM asset_last_reading WHERE identificacao = ? AND tipo = ?", (identificacao, tipo))
+        cursor.execute(f"""
+            INSERT INTO asset_last_reading (identificacao, tipo, leitura, data_leitura)
+            SELECT {coluna_id}, ?, {coluna_leitura}, data FROM {tabela}
+            WHERE {coluna_id} = ? AND {coluna_leitura} IS NOT NULL
+            ORDER BY {coluna_leitura} DESC LIMIT 1
+        """, (tipo, identificacao))
+
+def _reconstruir_ultima_leitura(cursor):
+    cursor.execute("DELETE FROM asset_last_reading")
+    for tipo, (tabela, coluna_id, coluna_leitura) in FONTES_LEITURA.items():
+        # Em SQLite, 'data' acompanha a linha que forneceu o MAX()
+        cursor.execute(f"""
+            INSERT INTO asset_last_reading (identificacao, tipo, leitura, data_leitura)
+            SELECT {coluna_id}, ?, MAX({coluna_leitura}), data FROM {tabela}
+            WHERE {coluna_leitura} IS NOT NULL
+            GROUP BY {coluna_id}
+        """, (tipo,))
+
+def obter_ultima_leitura(identificacao, tipo):
+    """Leitura atual (odômetro ou horímetro) de um ativo, ou None."""
+    conn = get_db_connection()
+    try:
+        row = conn.execute("SELECT leitura FROM asset_last_reading WHERE identificacao = ? AND tipo = ?", (identificacao, tipo)).fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+# --- Estatísticas Materializadas por Veículo (vehicle_stats) ---
+# Uma linha por placa com os agregados de /medias-veiculos (apenas abastecimentos com km_litro).
+# É atualizada por placa nas funções de escrita; reconstruir_tabelas_derivadas refaz tudo.
+
+def _atualizar_vehicle_stats(cursor, *placas):
+    """Recalcula as estatísticas das placas informadas usando o índice por placa."""
+    for placa in set(placas):
+        cursor.execute("DELETE FROM vehicle_stats WHERE placa = ?", (placa,))
+        cursor.execute("""
+            INSERT INTO vehicle_stats (placa, total_abastecimentos, total_litros, soma_km_litro, total_gasto, km_atual, data_atualizacao)
+            SELECT placa, COUNT(*), SUM(litros), SUM(km_litro), SUM(custo_bruto), MAX(odometro), ?
+            FROM abastecimentos
+            WHERE placa = ? AND km_litro IS NOT NULL
+            GROUP BY placa
+        """, (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), placa))
+
+def _reconstruir_vehicle_stats(cursor):
+    cursor.execute("DELETE FROM vehicle_stats")
+    cursor.execute("""
+        INSERT INTO vehicle_stats (placa, total_abastecimentos, total_litros, soma_km_litro, total_gasto, km_atual, data_atualizacao)
+        SELECT placa, COUNT(*), SUM(litros), SUM(km_litro), SUM(custo_bruto), MAX(odometro), ?
+        FROM abastecimentos
+        WHERE km_litro IS NOT NULL
+        GROUP BY placa
+    """, (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),))
+
+# --- Resumos Diários/Mensais (rollups) ---
+# Totais por período e dimensões, mantidos pelas funções de escrita (um balde por data e primeira
+# dimensão afetadas) e lidos por resumir() quando o intervalo pedido cai inteiro nos baldes.
+# A data dos registros é gravada como 'YYYY-MM-DD'; o balde é o dia (date) ou o mês ('YYYY-MM').
+
+RESUMOS = {
+    'abastecimentos': {
+        'data': 'data',
+        'medidas': {'registros': 'COUNT(*)', 'litros': 'SUM(litros)', 'desconto': 'SUM(desconto)',
+                    'custo_bruto': 'SUM(custo_bruto)', 'custo_liquido': 'SUM(custo_liquido)'},
+        # Do mais grosso para o mais fino; a primeira dimensão é a usada na atualização incremental.
+        # posto entra na chave porque o relatório filtra por ele e conta os postos distintos.
+        'niveis': [('mes', ['placa', 'centro_custo', 'combustivel', 'posto']),
+                   ('dia', ['placa', 'centro_custo', 'combustivel', 'posto'])],
+    },
+    'pedagios': {
+        'data': 'data',
+        'medidas': {'registros': 'COUNT(*)', 'valor': 'SUM(valor)'},
+        'niveis': [('mes', ['placa'])],
+    },
+    'manutencoes': {
+        'data': 'data_abertura',
+        'medidas': {'registros': 'COUNT(*)', 'valor': 'SUM(valor)'},
+        'niveis': [('mes', ['frota', 'tipo', 'finalizada'])],
+    },
+}
+
+# Por nível: expressão do balde, início e fim (exclusivo) do balde que contém uma data
+INTERVALOS_RESUMO = {
+    'dia': ("date({})", "date({})", "date({}, '+1 day')"),
+    'mes': ("strftime('%Y-%m', {})", "date({}, 'start of month')", "date({}, 'start of month', '+1 month')"),
+}
+
+RESUMO_MAX_BALDES_INCREMENTAIS = 2000  # acima disso (importações grandes) reconstrói a fonte inteira
+
+def _sql_resumo(fonte, nivel, dimensoes):
+    tabela = f"resumo_{fonte}_{nivel}"
+    medidas = RESUMOS[fonte]['medidas']
+    balde = INTERVALOS_RESUMO[nivel][0].format(RESUMOS[fonte]['data'])
+    insert = f"""
+        INSERT INTO {tabela} ({nivel}, {', '.join(dimensoes)}, {', '.join(medidas)})
+        SELECT {balde}, {', '.join(dimensoes)}, {', '.join(medidas.values())}
+        FROM {fonte}"""
+    return tabela, insert, f"GROUP BY 1, {', '.join(dimensoes)}"
+
+def _reconstruir_resumos(cursor, *fontes):
+    for fonte in fontes or RESUMOS:
+        coluna_data = RESUMOS[fonte]['data']
+        for nivel, dimensoes in RESUMOS[fonte]['niveis']:
+            tabela, insert, agrupamento = _sql_resumo(fonte, nivel, dimensoes)
+            cursor.execute(f"DELETE FROM {tabela}")
+            cursor.execute(f"{insert} WHERE {INTERVALOS_RESUMO[nivel][0].format(coluna_data)} IS NOT NULL {agrupamento}")
+
+def _atualizar_resumos(cursor, fonte, *chaves):
+    """
+    Recalcula os baldes afetados por registros da fonte. chaves são pares (data, valor da primeira
+    dimensão) da versão antiga e da nova de cada registro alterado; a busca usa os índices existentes.
     """
+    chaves = set(chaves)
+    if len(chaves) > RESUMO_MAX_BALDES_INCREMENTAIS:
+        _reconstruir_resumos(cursor, fonte)
+        return
+    coluna_data = RESUMOS[fonte]['data']
+    for nivel, dimensoes in RESUMOS[fonte]['niveis']:
+        tabela, insert, agrupamento = _sql_resumo(fonte, nivel, dimensoes)
+        balde, inicio, fim = (expressao.format('?') for expressao in INTERVALOS_RESUMO[nivel])
+        for data, valor in chaves:
+            cursor.execute(f"DELETE FROM {tabela} WHERE {nivel} = {balde} AND {dimensoes[0]} IS ?", (data, valor))
+            cursor.execute(f"""{insert}
+                WHERE {dimensoes[0]} IS ? AND {coluna_data} >= {inicio} AND {coluna_data} < {fim}
+                {agrupamento}""", (valor, data, data))
+
+def reconstruir_resumos():
+    """Reconstrói todas as tabelas de resumo. Uso: python migracao.py --reconstruir-resumos"""
+    conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        cursor.execute(query_calculo_km)
+        _reconstruir_resumos(cursor)
         conn.commit()
+        return True
     except Exception as e:
-        print(f"Erro ao calcular km/litro: {e}")
+        print(f"Erro ao reconstruir resumos: {e}")
         conn.rollback()
-    
+        return False
+    finally:
+        conn.close()
+
+def _nivel_resumo(fonte, data_inicio, data_fim, colunas):
+    """Nível de resumo mais grosso que cobre as colunas pedidas e cujos baldes o intervalo alinha."""
+    try:
+        inicio = datetime.strptime(data_inicio, '%Y-%m-%d').date() if data_inicio else None
+        fim = datetime.strptime(data_fim, '%Y-%m-%d').date() if data_fim else None
+    except ValueError:
+        return None  # datas com hora ou em outro formato: consulta direta
+    for nivel, dimensoes in RESUMOS[fonte]['niveis']:
+        if not set(colunas) <= set(dimensoes):
+            continue
+        if nivel == 'dia' or ((inicio is None or inicio.day == 1)
+                              and (fim is None or (fim + timedelta(days=1)).day == 1)):
+            return nivel
+    return None
+
+def resumir(fonte, data_inicio=None, data_fim=None, filtros=None, agrupar_por=()):
+    """
+    Totais (RESUMOS[fonte]['medidas']) de uma fonte no intervalo [data_inicio, data_fim], com filtros
+    de igualdade ({coluna: valor}; None é ignorado) e agrupados pelas colunas pedidas.
+    Lê a tabela de resumo quando o intervalo se alinha aos baldes; senão agrega a tabela original.
+    """
+    filtros = {coluna: valor for coluna, valor in (filtros or {}).items() if valor is not None}
+    medidas = RESUMOS[fonte]['medidas']
+    nivel = _nivel_resumo(fonte, data_inicio, data_fim, list(filtros) + list(agrupar_por))
+    if nivel:
+        tabela, coluna_data = f"resumo_{fonte}_{nivel}", nivel
+        expressoes = [f"COALESCE(SUM({medida}), 0) as {medida}" for medida in medidas]
+        if nivel == 'mes':
+            data_inicio, data_fim = data_inicio and data_inicio[:7], data_fim and data_fim[:7]
+    else:
+        tabela, coluna_data = fonte, RESUMOS[fonte]['data']
+        expressoes = [f"COALESCE({expressao}, 0) as {medida}" for medida, expressao in medidas.items()]
+
+    conditions, params = [], []
+    if data_inicio:
+        conditions.append(f"{coluna_data} >= ?")
+        params.append(data_inicio)
+    if data_fim:
+        conditions.append(f"{coluna_data} <= ?")
+        params.append(data_fim)
+    for coluna, valor in filtros.items():
+        conditions.append(f"{coluna} = ?")
+        params.append(valor)
+    query = f"SELECT {', '.join(list(agrupar_por) + expressoes)} FROM {tabela}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    if agrupar_por:
+        query += f" GROUP BY {', '.join(agrupar_por)}"
+
+    conn = get_db_connection()
+    try:
+        return [dict(row) for row in conn.execute(query, params).fetchall()]
+    finally:
+        conn.close()
+
+def reconstruir_tabelas_derivadas():
+    """
+    Reconstrói as tabelas e colunas derivadas (vehicle_stats, asset_last_reading, totais de
+    cotações/pedidos, resumos) a partir dos dados brutos. Uso: python migracao.py --reconstruir-estatisticas
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        _reconstruir_vehicle_stats(cursor)
+        _reconstruir_ultima_leitura(cursor)
+        _reconstruir_totais_compras(cursor)
+        _reconstruir_resumos(cursor)
+        conn.commit()
+        return True
+    except Exception as e:
+        print(f"Erro ao reconstruir tabelas derivadas: {e}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+def recalcular_consumo_frota():
+    """Recálculo completo de km_rodados/km_litro de todas as placas e de vehicle_stats (uso: job em segundo plano)."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        recalcular_km_litro(cursor)
+        atualizados = cursor.rowcount
+        _reconstruir_vehicle_stats(cursor)
+        conn.commit()
+        invalidar_cache_referencia('abastecimentos')
+        return atualizados
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def calcular_medias_veiculos():
+    """Médias por veículo, lidas de vehicle_stats (uma linha por placa)."""
+    conn = get_db_connection()
     query_medias = """
     SELECT 
-        placa, COUNT(*) as total_abastecimentos, AVG(litros) as media_litros,
-        AVG(km_litro) as media_kml, SUM(custo_bruto) as total_gasto,
-        MAX(odometro) as km_atual, SUM(litros) as total_litros
-    FROM abastecimentos
-    WHERE km_litro IS NOT NULL
-    GROUP BY placa ORDER BY media_kml DESC
+        placa, total_abastecimentos, total_litros * 1.0 / total_abastecimentos as media_litros,
+        soma_km_litro / total_abastecimentos as media_kml, total_gasto,
+        km_atual, total_litros
+    FROM vehicle_stats
+    ORDER BY media_kml DESC
     """
     try:
         df = pd.read_sql(query_medias, conn)
@@ -662,30 +1641,37 @@ def obter_registro_por_id(id):
 def atualizar_registro(id, dados):
     conn = get_db_connection()
     cursor = conn.cursor()
-    km_litro = None
-    if dados.get('odometro'):
-        cursor.execute("SELECT MAX(odometro) FROM abastecimentos WHERE placa = ? AND odometro IS NOT NULL AND id != ?", (dados['placa'].upper(), id))
-        ultimo_odometro = cursor.fetchone()[0]
-        if ultimo_odometro and dados['odometro'] > ultimo_odometro and dados['litros'] > 0:
-            km_rodados = dados['odometro'] - ultimo_odometro
-            km_litro = km_rodados / dados['litros']
     query = """
     UPDATE abastecimentos SET
         data = ?, placa = ?, responsavel = ?, litros = ?, desconto = ?, odometro = ?, centro_custo = ?,
-        combustivel = ?, custo_por_litro = ?, custo_bruto = ?, custo_liquido = ?, posto = ?, km_litro = ?
+        combustivel = ?, custo_por_litro = ?, custo_bruto = ?, custo_liquido = ?, posto = ?
     WHERE id = ?
     """
     try:
+        cursor.execute("SELECT placa, data FROM abastecimentos WHERE id = ?", (id,))
+        anterior = cursor.fetchone()
         cursor.execute(query, (
             dados['data'], dados['placa'].upper(), dados['responsavel'], round(float(dados['litros']), 3),
             round(float(dados['desconto']), 2), round(float(dados['odometro']), 1) if dados['odometro'] else None,
             dados['centro_custo'], dados['combustivel'], round(float(dados['custo_por_litro']), 3),
             round(float(dados['custo_bruto']), 2), round(float(dados['custo_liquido']), 2),
-            dados.get('posto', ''), km_litro, id
+            dados.get('posto', ''), id
         ))
+        atualizado = cursor.rowcount > 0
+        if atualizado:
+            # A vizinha da posição antiga (placa/data podem ter mudado) e a da nova posição
+            _recalcular_km_seguinte(cursor, anterior['placa'], anterior['data'], id)
+            _recalcular_km_registro(cursor, id)
+            _recalcular_km_seguinte(cursor, dados['placa'].upper(), dados['data'], id)
+            _atualizar_vehicle_stats(cursor, anterior['placa'], dados['placa'].upper())
+            _atualizar_ultima_leitura(cursor, 'veiculo', anterior['placa'], dados['placa'].upper())
+            _atualizar_resumos(cursor, 'abastecimentos', (anterior['data'], anterior['placa']),
+                               (dados['data'], dados['placa'].upper()))
         conn.commit()
-        return cursor.rowcount > 0
+        invalidar_cache_referencia('abastecimentos')
+        return atualizado
     except Exception as e:
+        conn.rollback()
         conn.close()
         raise e
     finally:
@@ -694,16 +1680,9 @@ def atualizar_registro(id, dados):
 def criar_registro(dados):
     conn = get_db_connection()
     cursor = conn.cursor()
-    km_litro = None
-    if dados.get('odometro'):
-        cursor.execute("SELECT MAX(odometro) FROM abastecimentos WHERE placa = ? AND odometro IS NOT NULL", (dados['placa'].upper(),))
-        ultimo_odometro = cursor.fetchone()[0]
-        if ultimo_odometro and dados['odometro'] > ultimo_odometro and dados['litros'] > 0:
-            km_rodados = dados['odometro'] - ultimo_odometro
-            km_litro = km_rodados / dados['litros']
     query = """
-    INSERT INTO abastecimentos (data, placa, responsavel, litros, desconto, odometro, centro_custo, combustivel, custo_por_litro, custo_bruto, custo_liquido, posto, km_litro)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    INSERT INTO abastecimentos (data, placa, responsavel, litros, desconto, odometro, centro_custo, combustivel, custo_por_litro, custo_bruto, custo_liquido, posto)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     """
     try:
         cursor.execute(query, (
@@ -711,11 +1690,20 @@ def criar_registro(dados):
             round(float(dados['desconto']), 2), round(float(dados['odometro']), 1) if dados['odometro'] else None,
             dados['centro_custo'], dados['combustivel'], round(float(dados['custo_por_litro']), 3),
             round(float(dados['custo_bruto']), 2), round(float(dados['custo_liquido']), 2),
-            dados.get('posto', ''), km_litro
+            dados.get('posto', '')
         ))
+        registro_id = cursor.lastrowid
+        # Lançamentos retroativos também alteram o km/litro do abastecimento seguinte
+        _recalcular_km_registro(cursor, registro_id)
+        _recalcular_km_seguinte(cursor, dados['placa'].upper(), dados['data'], registro_id)
+        _atualizar_vehicle_stats(cursor, dados['placa'].upper())
+        _atualizar_ultima_leitura(cursor, 'veiculo', dados['placa'].upper())
+        _atualizar_resumos(cursor, 'abastecimentos', (dados['data'], dados['placa'].upper()))
         conn.commit()
-        return cursor.lastrowid
+        invalidar_cache_referencia('abastecimentos')
+        return registro_id
     except Exception as e:
+        conn.rollback()
         conn.close()
         raise e
     finally:
@@ -725,23 +1713,185 @@ def excluir_registro(id):
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
+        cursor.execute("SELECT placa, data FROM abastecimentos WHERE id = ?", (id,))
+        registro = cursor.fetchone()
         cursor.execute("DELETE FROM abastecimentos WHERE id = ?", (id,))
+        excluido = cursor.rowcount > 0
+        if excluido:
+            _recalcular_km_seguinte(cursor, registro['placa'], registro['data'], id)
+            _atualizar_vehicle_stats(cursor, registro['placa'])
+            _atualizar_ultima_leitura(cursor, 'veiculo', registro['placa'])
+            _atualizar_resumos(cursor, 'abastecimentos', (registro['data'], registro['placa']))
         conn.commit()
-        return cursor.rowcount > 0
+        invalidar_cache_referencia('abastecimentos')
+        return excluido
     except Exception as e:
+        conn.rollback()
         conn.close()
         raise e
     finally:
         conn.close()
 
+# --- Importação em Lote de Abastecimentos (.xlsx / .csv) ---
+
+IMPORTACAO_TAMANHO_LOTE = 1000
+IMPORTACAO_MAX_ERROS = 50
+
+# Cabeçalhos aceitos além dos nomes das colunas de abastecimentos
+ALIASES_IMPORTACAO = {
+    'km': 'odometro', 'odometro_km': 'odometro', 'quilometragem': 'odometro',
+    'preco_litro': 'custo_por_litro', 'valor_litro': 'custo_por_litro', 'preco': 'custo_por_litro',
+    'litragem': 'litros', 'quantidade': 'litros', 'motorista': 'responsavel',
+    'centro_de_custo': 'centro_custo', 'cc': 'centro_custo', 'veiculo': 'placa',
+}
+
+def _normalizar_cabecalho(nome):
+    nome = unicodedata.normalize('NFKD', str(nome or '')).encode('ascii', 'ignore').decode()
+    nome = nome.strip().lower().replace(' ', '_').replace('/', '_')
+    return ALIASES_IMPORTACAO.get(nome, nome)
+
+def _ler_planilha(arquivo, nome_arquivo, limite=None, tamanho_lote=IMPORTACAO_TAMANHO_LOTE):
+    """
+    Lê .xlsx (openpyxl read-only) ou .csv (pandas em chunks) e gera lotes de dicionários
+    com os cabeçalhos normalizados. Com 'limite', lê apenas as primeiras linhas.
+    """
+    extensao = os.path.splitext(nome_arquivo or '')[1].lower()
+    if extensao == '.xlsx':
+        wb = load_workbook(arquivo, read_only=True, data_only=True)
+        try:
+            linhas = wb.active.iter_rows(values_only=True, max_row=(limite + 1) if limite else None)
+            cabecalho = [_normalizar_cabecalho(c) for c in next(linhas, [])]
+            lote = []
+            for linha in linhas:
+                if all(v is None or v == '' for v in linha):
+                    continue
+                lote.append(dict(zip(cabecalho, linha)))
+                if len(lote) >= tamanho_lote:
+                    yield lote
+                    lote = []
+            if lote:
+                yield lote
+        finally:
+            wb.close()
+    elif extensao == '.csv':
+        leitor = pd.read_csv(arquivo, sep=None, engine='python', dtype=str, keep_default_na=False,
+                             encoding='utf-8-sig', nrows=limite, chunksize=tamanho_lote)
+        for chunk in leitor:
+            chunk.columns = [_normalizar_cabecalho(c) for c in chunk.columns]
+            yield chunk.to_dict('records')
+    else:
+        raise ValueError("Formato não suportado. Envie um arquivo .xlsx ou .csv.")
+
+def _numero(valor, padrao=None):
+    """Converte números de planilha, aceitando vírgula decimal ('5,49' ou '1.234,5')."""
+    if valor is None or (isinstance(valor, str) and not valor.strip()):
+        return padrao
+    if isinstance(valor, (int, float)):
+        return float(valor)
+    texto = str(valor).strip().replace('R$', '').strip()
+    if ',' in texto:
+        texto = texto.replace('.', '').replace(',', '.')
+    return float(texto)
+
+def _data_iso(valor):
+    if isinstance(valor, (datetime, date)):
+        return valor.strftime('%Y-%m-%d')
+    texto = str(valor or '').strip()[:10]
+    for formato in ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y'):
+        try:
+            return datetime.strptime(texto, formato).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    raise ValueError(f"data inválida '{valor}'")
+
+def _normalizar_linha_importacao(linha):
+    """Valida uma linha e calcula custo_bruto/custo_liquido como em api_criar_registro."""
+    if not all([linha.get('data'), linha.get('placa'), linha.get('combustivel')]):
+        raise ValueError("data, placa e combustivel são obrigatórios")
+    litros = _numero(linha.get('litros'), 0)
+    custo_por_litro = _numero(linha.get('custo_por_litro'), 0)
+    desconto = _numero(linha.get('desconto'), 0)
+    odometro = _numero(linha.get('odometro'))
+    custo_bruto = round(litros * custo_por_litro, 2)
+    return (
+        _data_iso(linha['data']), str(linha['placa']).strip().upper(), str(linha.get('responsavel') or ''),
+        round(litros, 3), round(desconto, 2), round(odometro, 1) if odometro else None,
+        str(linha.get('centro_custo') or ''), str(linha['combustivel']).strip(), round(custo_por_litro, 3),
+        custo_bruto, round(custo_bruto - desconto, 2), str(linha.get('posto') or '')
+    )
+
+def pre_visualizar_importacao(arquivo, nome_arquivo, linhas=10):
+    """Lê apenas as primeiras linhas do arquivo para a pré-visualização."""
+    registros = []
+    for lote in _ler_planilha(arquivo, nome_arquivo, limite=linhas):
+        registros.extend(lote)
+    registros = registros[:linhas]
+    colunas = list(registros[0].keys()) if registros else []
+    preview = [{c: (v.strftime('%Y-%m-%d') if isinstance(v, (datetime, date)) else v) for c, v in r.items()} for r in registros]
+    return colunas, preview
+
+def importar_abastecimentos(arquivo, nome_arquivo):
+    """
+    Importa abastecimentos em lote: cada lote é validado e gravado com executemany em uma
+    transação, junto com o recálculo de km/litro (só das linhas novas e das vizinhas seguintes),
+    vehicle_stats, última leitura e resumos das placas e dias/placas do lote. Se um lote falhar,
+    os anteriores já gravados ficam consistentes.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    importados = 0
+    erros = []
+    placas = set()
+    numero_linha = 1  # a linha 1 é o cabeçalho
+    query = """
+    INSERT INTO abastecimentos (data, placa, responsavel, litros, desconto, odometro, centro_custo, combustivel, custo_por_litro, custo_bruto, custo_liquido, posto)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+    try:
+        for lote in _ler_planilha(arquivo, nome_arquivo):
+            validos = []
+            for linha in lote:
+                numero_linha += 1
+                try:
+                    validos.append(_normalizar_linha_importacao(linha))
+                except (ValueError, TypeError) as e:
+                    if len(erros) < IMPORTACAO_MAX_ERROS:
+                        erros.append(f"Linha {numero_linha}: {e}")
+            if validos:
+                placas_lote = {v[1] for v in validos}
+                cursor.executemany(query, validos)
+                # O lote inteiro entra numa transação só, com a trava de escrita: os ids são consecutivos
+                ultimo_id = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+                for id, (data, placa, odometro) in enumerate(((v[0], v[1], v[5]) for v in validos),
+                                                             start=ultimo_id - len(validos) + 1):
+                    if odometro is not None:
+                        _recalcular_km_registro(cursor, id)
+                        _recalcular_km_seguinte(cursor, placa, data, id)
+                _atualizar_vehicle_stats(cursor, *placas_lote)
+                _atualizar_ultima_leitura(cursor, 'veiculo', *placas_lote)
+                _atualizar_resumos(cursor, 'abastecimentos', *{(v[0], v[1]) for v in validos})
+                conn.commit()
+                importados += len(validos)
+                placas.update(placas_lote)
+        return {'importados': importados, 'erros': erros, 'placas': len(placas)}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if importados:
+            invalidar_cache_referencia('abastecimentos')
+        conn.close()
+
 def criar_pedagio(dados):
     conn = get_db_connection()
     cursor = conn.cursor()
     query = "INSERT INTO pedagios (data, placa, valor, observacoes) VALUES (?, ?, ?, ?)"
     try:
         cursor.execute(query, (dados['data'], dados['placa'], round(float(dados['valor']), 2), dados.get('observacoes', '')))
+        pedagio_id = cursor.lastrowid
+        _atualizar_resumos(cursor, 'pedagios', (dados['data'], dados['placa']))
         conn.commit()
-        return cursor.lastrowid
+        return pedagio_id
     except Exception as e:
         print(f"Erro ao criar pedágio: {e}")
         conn.rollback()
@@ -785,9 +1935,13 @@ def atualizar_pedagio(id, dados):
     cursor = conn.cursor()
     query = "UPDATE pedagios SET data = ?, placa = ?, valor = ?, observacoes = ? WHERE id = ?"
     try:
+        anterior = cursor.execute("SELECT data, placa FROM pedagios WHERE id = ?", (id,)).fetchone()
         cursor.execute(query, (dados['data'], dados['placa'], round(float(dados['valor']), 2), dados.get('observacoes', ''), id))
+        atualizado = cursor.rowcount > 0
+        if atualizado:
+            _atualizar_resumos(cursor, 'pedagios', tuple(anterior), (dados['data'], dados['placa']))
         conn.commit()
-        return cursor.rowcount > 0
+        return atualizado
     except Exception as e:
         print(f"Erro ao atualizar pedágio: {e}")
         conn.rollback()
@@ -799,11 +1953,16 @@ def excluir_pedagio(id):
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
+        anterior = cursor.execute("SELECT data, placa FROM pedagios WHERE id = ?", (id,)).fetchone()
         cursor.execute("DELETE FROM pedagios WHERE id = ?", (id,))
+        excluido = cursor.rowcount > 0
+        if excluido:
+            _atualizar_resumos(cursor, 'pedagios', tuple(anterior))
         conn.commit()
-        return cursor.rowcount > 0
+        return excluido
     except Exception as e:
         print(f"Erro ao excluir pedágio: {e}")
+        conn.rollback()
         return False
     finally:
         conn.close()
@@ -859,58 +2018,58 @@ def obter_troca_oleo_por_identificacao_tipo(identificacao, tipo):
     finally:
         conn.close()
 
+ORDEM_STATUS_TROCA = {'VENCIDO': 0, 'ATENÇÃO': 1, 'OK': 2, 'N/A': 3}
+
+def classificar_trocas_oleo(df):
+    """
+    Calcula próxima troca, remanescente e status (VENCIDO/ATENÇÃO/OK/N/A) de forma vetorizada.
+    Espera as colunas de trocas_oleo mais 'valor_atual' (odômetro ou horímetro atual).
+    """
+    veiculo = (df['tipo'] == 'veiculo').to_numpy()
+    valor_atual = pd.to_numeric(df['valor_atual'], errors='coerce').to_numpy(dtype=float)
+    proxima = np.where(veiculo, df['proxima_troca_km'].to_numpy(dtype=float), df['proxima_troca_horimetro'].to_numpy(dtype=float))
+    valor_troca = np.where(veiculo, df['km_troca'].to_numpy(dtype=float), df['horimetro_troca'].to_numpy(dtype=float))
+
+    # Usa a leitura atual quando existir; senão, o valor registrado na própria troca
+    tem_proxima = ~np.isnan(proxima) & (proxima != 0)
+    tem_atual = ~np.isnan(valor_atual) & (valor_atual != 0)
+    tem_troca = ~np.isnan(valor_troca) & (valor_troca != 0)
+    remanescente = np.where(tem_proxima & tem_atual, proxima - valor_atual,
+                            np.where(tem_proxima & tem_troca, proxima - valor_troca, np.nan))
+
+    limite_atencao = np.where(veiculo, ATENCAO_KM, ATENCAO_HORAS)
+    status = np.select(
+        [np.isnan(remanescente), remanescente <= 0, remanescente <= limite_atencao],
+        ['N/A', 'VENCIDO', 'ATENÇÃO'], default='OK'
+    )
+
+    resultado = pd.DataFrame({
+        'identificacao': df['identificacao'], 'tipo': df['tipo'], 'data_troca': df['data_troca'],
+        'km_troca': df['km_troca'], 'horimetro_troca': df['horimetro_troca'],
+        'km_atual': np.where(veiculo, valor_atual, np.nan),
+        'horimetro_atual': np.where(veiculo, np.nan, valor_atual),
+        'proxima_troca': proxima, 'remanescente': remanescente, 'status': status
+    })
+    resultado['_ordem'] = resultado['status'].map(ORDEM_STATUS_TROCA)
+    resultado['_remanescente'] = resultado['remanescente'].fillna(np.inf)
+    resultado = resultado.sort_values(['_ordem', '_remanescente'], kind='stable').drop(columns=['_ordem', '_remanescente'])
+    return resultado.astype(object).where(resultado.notna(), None).to_dict('records')
+
 def obter_trocas_oleo():
     conn = get_db_connection()
     try:
-        query = "SELECT identificacao, tipo, data_troca, km_troca, horimetro_troca, proxima_troca_km, proxima_troca_horimetro FROM trocas_oleo ORDER BY tipo, identificacao"
+        # Leitura atual de cada ativo vem de asset_last_reading (busca pela chave primária)
+        query = """
+        SELECT t.identificacao, t.tipo, t.data_troca, t.km_troca, t.horimetro_troca,
+               t.proxima_troca_km, t.proxima_troca_horimetro, l.leitura as valor_atual
+        FROM trocas_oleo t
+        LEFT JOIN asset_last_reading l ON l.identificacao = t.identificacao AND l.tipo = t.tipo
+        ORDER BY t.tipo, t.identificacao
+        """
         df_trocas = pd.read_sql(query, conn)
-        trocas = []
-        for _, troca in df_trocas.iterrows():
-            identificacao = troca['identificacao']
-            tipo = troca['tipo']
-            km_troca = troca['km_troca']
-            horimetro_troca = troca['horimetro_troca']
-            proxima_troca_km = troca['proxima_troca_km']
-            proxima_troca_horimetro = troca['proxima_troca_horimetro']
-            
-            valor_atual = None
-            proxima_troca = None
-            remanescente = None
-            
-            cursor = conn.cursor()
-            if tipo == 'veiculo':
-                cursor.execute("SELECT MAX(odometro) FROM abastecimentos WHERE placa = ? AND odometro IS NOT NULL", (identificacao,))
-                valor_atual = cursor.fetchone()[0]
-                proxima_troca = proxima_troca_km
-                if valor_atual and proxima_troca: remanescente = proxima_troca - valor_atual
-                elif km_troca and proxima_troca: remanescente = proxima_troca - km_troca
-                if remanescente is not None:
-                    if remanescente <= 0: status = 'VENCIDO'
-                    elif remanescente <= ATENCAO_KM: status = 'ATENÇÃO'
-                    else: status = 'OK'
-                else: status = 'N/A'
-            else:
-                cursor.execute("SELECT MAX(horimetro) FROM checklists WHERE identificacao = ? AND horimetro IS NOT NULL", (identificacao,))
-                valor_atual = cursor.fetchone()[0]
-                proxima_troca = proxima_troca_horimetro
-                if valor_atual and proxima_troca: remanescente = proxima_troca - valor_atual
-                elif horimetro_troca and proxima_troca: remanescente = proxima_troca - horimetro_troca
-                if remanescente is not None:
-                    if remanescente <= 0: status = 'VENCIDO'
-                    elif remanescente <= ATENCAO_HORAS: status = 'ATENÇÃO'
-                    else: status = 'OK'
-                else: status = 'N/A'
-            
-            trocas.append({
-                'identificacao': identificacao, 'tipo': tipo, 'data_troca': troca['data_troca'],
-                'km_troca': km_troca, 'horimetro_troca': horimetro_troca,
-                'km_atual': valor_atual if tipo == 'veiculo' else None,
-                'horimetro_atual': valor_atual if tipo == 'maquina' else None,
-                'proxima_troca': proxima_troca, 'remanescente': remanescente, 'status': status
-            })
-        ordem_status = {'VENCIDO': 0, 'ATENÇÃO': 1, 'OK': 2, 'N/A': 3}
-        trocas.sort(key=lambda x: (ordem_status[x['status']], x['remanescente'] if x['remanescente'] is not None else float('inf')))
-        return trocas
+        if df_trocas.empty:
+            return []
+        return classificar_trocas_oleo(df_trocas)
     except Exception as e:
         print(f"Erro ao obter trocas de óleo: {e}")
         return []
@@ -918,16 +2077,13 @@ def obter_trocas_oleo():
         conn.close()
 
 def obter_identificacoes_equipamentos():
-    conn = get_db_connection()
+    def carregar():
+        return _valores_distintos('checklists', 'identificacao', "identificacao > ''")  # idx_checklists_identificacao
     try:
-        query = "SELECT DISTINCT identificacao FROM checklists WHERE identificacao IS NOT NULL AND identificacao != '' ORDER BY identificacao"
-        df = pd.read_sql(query, conn)
-        return df['identificacao'].tolist()
+        return _cache_referencia_obter('checklists', 'identificacoes', carregar)
     except Exception as e:
         print(f"Erro ao obter identificações de equipamentos: {e}")
         return []
-    finally:
-        conn.close()
 
 def obter_checklists_por_identificacao(identificacao):
     conn = get_db_connection()
@@ -974,24 +2130,106 @@ def obter_manutencoes():
     finally:
         conn.close()
 
-def obter_estatisticas_manutencoes():
+COLUNAS_MANUTENCOES = """
+            id, identificacao, tipo, frota, descricao, COALESCE(fornecedor, '') as fornecedor, COALESCE(valor, 0) as valor, data_abertura,
+            COALESCE(previsao_conclusao, '') as previsao_conclusao, COALESCE(data_conclusao, '') as data_conclusao,
+            COALESCE(observacoes, '') as observacoes, finalizada, COALESCE(prazo_liberacao, 0) as prazo_liberacao,
+            COALESCE(forma_pagamento, '') as forma_pagamento, COALESCE(parcelas, 1) as parcelas, data_registro"""
+
+ORDENACAO_MANUTENCOES = {
+    'valor': 'COALESCE(valor, 0)',
+    'identificacao': 'LOWER(identificacao)',
+    'data_abertura': 'data_abertura',
+}
+
+def obter_relatorio_manutencoes(identificacao='', status='todos', tipo='todos', frota='todos', pagamento='todos',
+                                data_inicio='', data_fim='', ordenar_por='data_abertura', ordenar_direcao='desc',
+                                pagina=None, por_pagina=None):
+    """
+    Relatório de manutenções com filtros, ordenação, estatísticas e paginação feitos no SQL.
+    A identificação casa pelo começo, sem diferenciar maiúsculas, como o filtro da listagem
+    (intervalo sobre idx_manutencoes_identificacao). Sem 'pagina' retorna todas as linhas
+    filtradas (uso da impressão). Retorna (manutencoes, estatisticas, total_linhas).
+    """
+    conditions = []
+    params = []
+    if identificacao.strip():
+        condicao, valores = _condicao_listagem('identificacao', 'prefixo', identificacao.strip())
+        conditions.append(condicao)
+        params += valores
+    if status == 'aberto':
+        conditions.append("finalizada = 0")
+    elif status == 'finalizado':
+        conditions.append("finalizada = 1")
+    if tipo != 'todos':
+        conditions.append("tipo = ?")
+        params.append(tipo)
+    if frota != 'todos':
+        conditions.append("frota = ?")
+        params.append(frota)
+    if pagamento != 'todos':
+        conditions.append("COALESCE(forma_pagamento, '') = ?")
+        params.append(pagamento)
+    if data_inicio:
+        conditions.append("data_abertura >= ?")
+        params.append(data_inicio)
+    if data_fim:
+        conditions.append("data_abertura <= ?")
+        params.append(data_fim)
+    where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+
+    coluna_ordem = ORDENACAO_MANUTENCOES.get(ordenar_por, 'data_abertura')
+    direcao = 'ASC' if ordenar_direcao == 'asc' else 'DESC'
+    query = f"SELECT {COLUNAS_MANUTENCOES} FROM manutencoes {where} ORDER BY {coluna_ordem} {direcao}, id {direcao}"
+    params_linhas = list(params)
+    if pagina is not None and por_pagina:
+        query += " LIMIT ? OFFSET ?"
+        params_linhas += [por_pagina, (max(pagina, 1) - 1) * por_pagina]
+
+    if not identificacao and pagamento == 'todos':
+        # Só filtros cobertos pelo resumo mensal (frota, tipo, finalizada): resumir() escolhe a fonte
+        estatisticas = _estatisticas_manutencoes(resumir('manutencoes', data_inicio or None, data_fim or None, {
+            'tipo': None if tipo == 'todos' else tipo,
+            'frota': None if frota == 'todos' else frota,
+            'finalizada': {'aberto': 0, 'finalizado': 1}.get(status),
+        }, agrupar_por=['finalizada']))
+    else:
+        estatisticas = None
+
     conn = get_db_connection()
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) as total FROM manutencoes")
-        total = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) as abertas FROM manutencoes WHERE finalizada = 0")
-        abertas = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) as finalizadas FROM manutencoes WHERE finalizada = 1")
-        finalizadas = cursor.fetchone()[0]
-        cursor.execute("SELECT COALESCE(SUM(valor), 0) as valor_total FROM manutencoes")
-        valor_total = cursor.fetchone()[0]
-        return {'total': total, 'abertas': abertas, 'finalizadas': finalizadas, 'valor_total': float(valor_total)}
+        if estatisticas is None:
+            estatisticas = dict(conn.execute(f"""
+                SELECT COUNT(*) as total,
+                       COALESCE(SUM(finalizada = 0), 0) as abertas,
+                       COALESCE(SUM(finalizada = 1), 0) as finalizadas,
+                       COALESCE(SUM(valor), 0) as valor_total
+                FROM manutencoes {where}
+            """, params).fetchone())
+        manutencoes = [dict(row) for row in conn.execute(query, params_linhas).fetchall()]
+    finally:
+        conn.close()
+
+    for manutencao in manutencoes:
+        manutencao['finalizada'] = bool(manutencao['finalizada'])
+    estatisticas['valor_total'] = float(estatisticas['valor_total'])
+    return manutencoes, estatisticas, estatisticas['total']
+
+def _estatisticas_manutencoes(por_finalizada):
+    """Contadores do relatório de manutenções a partir de resumir(..., agrupar_por=['finalizada'])."""
+    return {
+        'total': sum(grupo['registros'] for grupo in por_finalizada),
+        'abertas': sum(grupo['registros'] for grupo in por_finalizada if grupo['finalizada'] == 0),
+        'finalizadas': sum(grupo['registros'] for grupo in por_finalizada if grupo['finalizada'] == 1),
+        'valor_total': float(sum(grupo['valor'] for grupo in por_finalizada)),
+    }
+
+def obter_estatisticas_manutencoes():
+    try:
+        return _estatisticas_manutencoes(resumir('manutencoes', agrupar_por=['finalizada']))
     except Exception as e:
         print(f"Erro ao obter estatísticas de manutenções: {e}")
         return {'total': 0, 'abertas': 0, 'finalizadas': 0, 'valor_total': 0.0}
-    finally:
-        conn.close()
 
 def obter_checklists():
     conn = get_db_connection()
@@ -1047,8 +2285,10 @@ def criar_manutencao(dados):
         parcelas = int(dados.get('parcelas', 1)) if dados.get('parcelas') not in [None, ''] else 1
         
         cursor.execute(query, (dados['identificacao'], dados['tipo'], dados['frota'], dados['descricao'], fornecedor, valor, dados['data_abertura'], previsao_conclusao, data_conclusao, observacoes, finalizada, prazo_liberacao, forma_pagamento, parcelas))
+        manutencao_id = cursor.lastrowid
+        _atualizar_resumos(cursor, 'manutencoes', (dados['data_abertura'], dados['frota']))
         conn.commit()
-        return cursor.lastrowid
+        return manutencao_id
     except Exception as e:
         print(f"Erro ao criar manutenção: {e}")
         conn.rollback()
@@ -1075,9 +2315,13 @@ def atualizar_manutencao(id, dados):
         forma_pagamento = dados.get('forma_pagamento', '') or ''
         parcelas = int(dados.get('parcelas', 1)) if dados.get('parcelas') not in [None, ''] else 1
         
+        anterior = cursor.execute("SELECT data_abertura, frota FROM manutencoes WHERE id = ?", (id,)).fetchone()
         cursor.execute(query, (dados['identificacao'], dados['tipo'], dados['frota'], dados['descricao'], fornecedor, valor, dados['data_abertura'], previsao_conclusao, data_conclusao, observacoes, finalizada, prazo_liberacao, forma_pagamento, parcelas, id))
+        atualizado = cursor.rowcount > 0
+        if atualizado:
+            _atualizar_resumos(cursor, 'manutencoes', tuple(anterior), (dados['data_abertura'], dados['frota']))
         conn.commit()
-        return cursor.rowcount > 0
+        return atualizado
     except Exception as e:
         print(f"Erro ao atualizar manutenção: {e}")
         conn.rollback()
@@ -1089,11 +2333,16 @@ def excluir_manutencao(id):
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
+        anterior = cursor.execute("SELECT data_abertura, frota FROM manutencoes WHERE id = ?", (id,)).fetchone()
         cursor.execute("DELETE FROM manutencoes WHERE id = ?", (id,))
+        excluido = cursor.rowcount > 0
+        if excluido:
+            _atualizar_resumos(cursor, 'manutencoes', tuple(anterior))
         conn.commit()
-        return cursor.rowcount > 0
+        return excluido
     except Exception as e:
         print(f"Erro ao excluir manutenção: {e}")
+        conn.rollback()
         return False
     finally:
         conn.close()
@@ -1176,8 +2425,11 @@ def criar_checklist(dados):
             dados['identificacao'], dados['data'], horimetro,
             dados['nivel_oleo'], dados.get('observacoes', ''), dados.get('itens_checklist', '')
         ))
+        checklist_id = cursor.lastrowid
+        _atualizar_ultima_leitura(cursor, 'maquina', dados['identificacao'])
         conn.commit()
-        return cursor.lastrowid
+        invalidar_cache_referencia('checklists')
+        return checklist_id
     finally:
         conn.close()
 
@@ -1199,14 +2451,19 @@ def atualizar_checklist(id, dados):
     WHERE id = ?
     """
     try:
+        anterior = cursor.execute("SELECT identificacao FROM checklists WHERE id = ?", (id,)).fetchone()
         horimetro = float(dados['horimetro']) if dados.get('horimetro') else None
         cursor.execute(query, (
             dados['identificacao'], dados['data'], horimetro,
             dados['nivel_oleo'], dados.get('observacoes', ''),
             dados.get('itens_checklist', ''), id
         ))
+        atualizado = cursor.rowcount > 0
+        if atualizado:
+            _atualizar_ultima_leitura(cursor, 'maquina', anterior['identificacao'], dados['identificacao'])
         conn.commit()
-        return cursor.rowcount > 0
+        invalidar_cache_referencia('checklists')
+        return atualizado
     finally:
         conn.close()
 
@@ -1214,12 +2471,35 @@ def excluir_checklist(id):
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
+        anterior = cursor.execute("SELECT identificacao FROM checklists WHERE id = ?", (id,)).fetchone()
         cursor.execute('DELETE FROM checklists WHERE id = ?', (id,))
+        excluido = cursor.rowcount > 0
+        if excluido:
+            _atualizar_ultima_leitura(cursor, 'maquina', anterior['identificacao'])
         conn.commit()
-        return cursor.rowcount > 0
+        invalidar_cache_referencia('checklists')
+        return excluido
     finally:
         conn.close()
 
+def _condicao_pesquisa(pesquisa, colunas_numero, coluna_texto, indice, coluna_indice):
+    """
+    Campo "Pesquisar" dos relatórios de cotações e pedidos. Um número (com ou sem '#') casa exatamente
+    com colunas_numero; as palavras casam por prefixo (índice FTS5, ver _expressao_busca) com a coluna
+    coluna_indice do índice, cujo rowid é comparado a coluna_texto. Retorna (condição, parâmetros),
+    ou (None, []) sem pesquisa.
+    """
+    termo = (pesquisa or '').strip()
+    expressao = _expressao_busca(termo)
+    if not expressao:
+        return None, []
+    condicoes = [f"{coluna_texto} IN (SELECT rowid FROM {indice} WHERE {indice} MATCH ?)"]
+    params = [f"{coluna_indice} : ({expressao})"]
+    if termo.lstrip('#').isdigit():
+        condicoes = [f"{coluna} = ?" for coluna in colunas_numero] + condicoes
+        params = [int(termo.lstrip('#'))] * len(colunas_numero) + params
+    return "(" + " OR ".join(condicoes) + ")", params
+
 def obter_cotacoes_com_filtros(data_inicio=None, data_fim=None, status=None, pesquisa=None):
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -1227,9 +2507,7 @@ def obter_cotacoes_com_filtros(data_inicio=None, data_fim=None, status=None, pes
     query = """
         SELECT 
             c.id, c.titulo, c.data_limite, c.status, c.data_registro,
-            u.username as solicitante,
-            (SELECT COUNT(*) FROM cotacao_itens ci WHERE ci.cotacao_id = c.id) as total_itens,
-            (SELECT SUM(o.valor) FROM orcamentos o WHERE o.cotacao_id = c.id AND o.aprovado = 1) as valor_aprovado
+            u.username as solicitante, c.total_itens, c.valor_aprovado
         FROM cotacoes c
         JOIN users u ON c.user_id = u.id
         WHERE 1=1
@@ -1245,10 +2523,10 @@ def obter_cotacoes_com_filtros(data_inicio=None, data_fim=None, status=None, pes
     if status:
         query += " AND c.status = ?"
         params.append(status)
-    if pesquisa:
-        pesquisa_like = f'%{pesquisa}%'
-        query += " AND (c.titulo LIKE ? OR c.id LIKE ?)"
-        params.extend([pesquisa_like, pesquisa_like])
+    condicao, valores = _condicao_pesquisa(pesquisa, ['c.id'], 'c.id', 'fts_cotacoes', 'titulo')
+    if condicao:
+        query += f" AND {condicao}"
+        params.extend(valores)
         
     query += " ORDER BY c.data_registro DESC"
     
@@ -1278,10 +2556,11 @@ def obter_pedidos_compra_com_filtros(data_inicio=None, data_fim=None, status=Non
     if status:
         query += " AND pc.status = ?"
         params.append(status)
-    if pesquisa:
-        pesquisa_like = f'%{pesquisa}%'
-        query += " AND (pc.id LIKE ? OR pc.cotacao_id LIKE ? OR f.nome LIKE ?)"
-        params.extend([pesquisa_like, pesquisa_like, pesquisa_like])
+    condicao, valores = _condicao_pesquisa(pesquisa, ['pc.id', 'pc.cotacao_id'], 'pc.fornecedor_id',
+                                           'fts_fornecedores', 'nome')
+    if condicao:
+        query += f" AND {condicao}"
+        params.extend(valores)
         
     query += " ORDER BY pc.id DESC"
     
@@ -1344,7 +2623,7 @@ def concluir_requisicao(requisicao_id, abastecimento_id):
 def atualizar_requisicao(id, dados):
     """Atualiza uma requisição de abastecimento existente."""
     conn = get_db_connection()
-    conn.execute("""
+    cursor = conn.execute("""
         UPDATE requisicoes_abastecimento
         SET placa = ?, motorista = ?, centro_custo = ?, combustivel = ?, quantidade_estimada = ?
         WHERE id = ? AND status = 'Pendente'
@@ -1353,7 +2632,8 @@ def atualizar_requisicao(id, dados):
         dados.get('combustivel'), dados.get('quantidade_estimada'), id
     ))
     conn.commit()
-    rows_updated = conn.total_changes
+    # rowcount (e não total_changes): a conexão do pool é compartilhada na requisição
+    rows_updated = cursor.rowcount
     conn.close()
     return rows_updated > 0
 
@@ -1361,9 +2641,9 @@ def excluir_requisicao(id):
     """Exclui uma requisição de abastecimento se ela estiver pendente."""
     conn = get_db_connection()
     # Apenas requisições com status 'Pendente' podem ser excluídas
-    conn.execute("DELETE FROM requisicoes_abastecimento WHERE id = ? AND status = 'Pendente'", (id,))
+    cursor = conn.execute("DELETE FROM requisicoes_abastecimento WHERE id = ? AND status = 'Pendente'", (id,))
     conn.commit()
-    rows_deleted = conn.total_changes
+    rows_deleted = cursor.rowcount
     conn.close()
     return rows_deleted > 0
 
@@ -1387,15 +2667,16 @@ def create_notion_page(user_id, category, title, content=None):
 def get_notion_pages_by_category(category, search_query=None):
     """
     Busca todas as páginas de uma determinada categoria.
-    Adiciona filtro opcional por título.
+    Adiciona filtro opcional por título e conteúdo (índice FTS5, prefixo por palavra).
     """
     conn = get_db_connection()
     query = "SELECT * FROM notion_pages WHERE category = ?"
     params = [category]
     
-    if search_query:
-        query += " AND title LIKE ?"
-        params.append(f'%{search_query}%')
+    expressao = _expressao_busca(search_query)
+    if expressao:
+        query += " AND id IN (SELECT rowid FROM fts_notion_pages WHERE fts_notion_pages MATCH ?)"
+        params.append(expressao)
         
     query += " ORDER BY data_registro DESC"
     
@@ -1448,4 +2729,396 @@ def delete_notion_page(page_id):
         conn.commit()
         return cursor.rowcount > 0
     finally:
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+# --- Listagens Paginadas no Servidor (protocolo DataTables) ---
+# Motor comum das telas de listagem: paginação, ordenação por várias colunas, filtros por coluna e
+# busca global feitos no SQL. Cada coluna declara o tipo de filtro aceito:
+#   'igual'      valor exato;
+#   'placa'      valor exato em maiúsculas (na busca global, prefixo);
+#   'prefixo'    começa com, sem diferenciar maiúsculas (intervalo sobre índice COLLATE NOCASE);
+#   'intervalo'  "inicio|fim", qualquer lado opcional; sem '|' vale como igual.
+# Não há LIKE '%termo%': todo filtro é igualdade ou intervalo, atendido pelos índices da migração 013.
+# Listagens com 'keyset' (colunas NOT NULL) aceitam um cursor no lugar do OFFSET quando a ordenação
+# usa só essas colunas: a página seguinte começa depois dos valores da última linha recebida.
+
+LISTAGEM_MAX_POR_PAGINA = 500
+LISTAGEM_CACHE_CONTAGENS_MAX = 256
+_FIM_PREFIXO = chr(0x10FFFF)
+
+LISTAGENS = {
+    'manutencoes': {
+        'tabelas': ['manutencoes'],
+        'origem': 'manutencoes',
+        'selecao': COLUNAS_MANUTENCOES,
+        'colunas': {
+            'id': ('id', 'igual'),
+            'identificacao': ('identificacao', 'prefixo'),
+            'tipo': ('tipo', 'igual'),
+            'frota': ('frota', 'igual'),
+            'fornecedor': ('fornecedor', 'prefixo'),
+            'valor': ('valor', 'intervalo'),
+            'forma_pagamento': ("COALESCE(forma_pagamento, '')", 'igual'),
+            'finalizada': ('finalizada', 'igual'),
+            'data_abertura': ('data_abertura', 'intervalo'),
+        },
+        'busca': ['identificacao', 'fornecedor'],
+        'ordem_padrao': [('data_abertura', 'desc')],
+    },
+    'checklists': {
+        'tabelas': ['checklists'],
+        'origem': 'checklists',
+        'selecao': 'id, identificacao, data, horimetro, nivel_oleo',
+        'colunas': {
+            'id': ('id', 'igual'),
+            'identificacao': ('identificacao', 'prefixo'),
+            'data': ('data', 'intervalo'),
+            'horimetro': ('horimetro', 'intervalo'),
+            'nivel_oleo': ('nivel_oleo', 'igual'),
+        },
+        'busca': ['identificacao'],
+        'ordem_padrao': [('data', 'desc')],
+    },
+    'pedagios': {
+        'tabelas': ['pedagios'],
+        'origem': 'pedagios',
+        'selecao': 'id, data, placa, valor, observacoes',
+        'colunas': {
+            'id': ('id', 'igual'),
+            'data': ('data', 'intervalo'),
+            'placa': ('placa', 'placa'),
+            'valor': ('valor', 'intervalo'),
+        },
+        'busca': ['placa'],
+        'ordem_padrao': [('data', 'desc'), ('placa', 'asc')],
+    },
+    'requisicoes': {
+        'tabelas': ['requisicoes_abastecimento', 'users'],
+        'origem': 'requisicoes_abastecimento r JOIN users u ON r.solicitado_por_id = u.id',
+        'selecao': 'r.*, u.username as solicitado_por_nome',
+        'colunas': {
+            'id': ('r.id', 'igual'),
+            'data_solicitacao': ('r.data_solicitacao', 'intervalo'),
+            'motorista': ('r.motorista', 'prefixo'),
+            'placa': ('r.placa', 'prefixo'),
+            'status': ('r.status', 'igual'),
+        },
+        'busca': ['placa', 'motorista'],
+        'ordem_padrao': [('data_solicitacao', 'desc')],
+        'desempate': 'r.id',
+    },
+    'abastecimentos': {
+        'tabelas': ['abastecimentos'],
+        'origem': 'abastecimentos',
+        'selecao': COLUNAS_RELATORIO,
+        'colunas': {
+            'id': ('id', 'igual'),
+            'data': ('data', 'intervalo'),
+            'placa': ('placa', 'placa'),
+            'responsavel': ('responsavel', 'prefixo'),
+            'centro_custo': ('centro_custo', 'igual'),
+            'combustivel': ('combustivel', 'igual'),
+            'posto': ('posto', 'igual'),
+            'litros': ('litros', 'intervalo'),
+            'odometro': ('odometro', 'intervalo'),
+            'km_litro': ('km_litro', 'intervalo'),
+            'custo_liquido': ('custo_liquido', 'intervalo'),
+        },
+        'busca': ['placa'],
+        'ordem_padrao': [('data', 'desc')],
+        'keyset': ['data', 'placa', 'litros', 'custo_liquido'],
+    },
+}
+
+_cache_contagens = {}
+
+def _condicao_listagem(expressao, tipo, valor, busca=False):
+    """Condição SQL (e parâmetros) de um filtro de coluna da listagem."""
+    if tipo == 'placa':
+        valor = valor.upper()
+        if busca:
+            return f"({expressao} >= ? AND {expressao} < ?)", [valor, valor + _FIM_PREFIXO]
+        return f"{expressao} = ?", [valor]
+    if tipo == 'prefixo':
+        return (f"({expressao} >= ? COLLATE NOCASE AND {expressao} < ? COLLATE NOCASE)",
+                [valor, valor + _FIM_PREFIXO])
+    if tipo == 'intervalo' and '|' in valor:
+        inicio, fim = (parte.strip() for parte in valor.split('|', 1))
+        condicoes, params = [], []
+        if inicio:
+            condicoes.append(f"{expressao} >= ?")
+            params.append(inicio)
+        if fim:
+            condicoes.append(f"{expressao} <= ?")
+            params.append(fim)
+        return (" AND ".join(condicoes) or None), params
+    return f"{expressao} = ?", [valor]
+
+def _contar_listagem(nome, versoes, origem, where, params):
+    """COUNT(*) da listagem, memorizado pela versão das tabelas envolvidas."""
+    chave = (nome, where, tuple(params))
+    item = _cache_contagens.get(chave)
+    if item and item[0] == versoes:
+        return item[1]
+    conn = get_db_connection()
+    try:
+        total = conn.execute(f"SELECT COUNT(*) FROM {origem} {where}", params).fetchone()[0]
+    finally:
+        conn.close()
+    if len(_cache_contagens) >= LISTAGEM_CACHE_CONTAGENS_MAX:
+        _cache_contagens.pop(next(iter(_cache_contagens)), None)
+    _cache_contagens[chave] = (versoes, total)
+    return total
+
+def _condicao_keyset(termos, valores):
+    """Linhas depois de 'valores' na ordem dos termos [(expressão, 'ASC'|'DESC')], sem OFFSET."""
+    partes, params = [], []
+    for posicao, (expressao, direcao) in enumerate(termos):
+        comparacoes = [f"{anterior} = ?" for anterior, _ in termos[:posicao]]
+        comparacoes.append(f"{expressao} {'>' if direcao == 'ASC' else '<'} ?")
+        partes.append("(" + " AND ".join(comparacoes) + ")")
+        params += list(valores[:posicao + 1])
+    # Limite redundante na primeira coluna: vira intervalo do índice (o OR sozinho não vira)
+    expressao, direcao = termos[0]
+    limite = f"{expressao} {'>=' if direcao == 'ASC' else '<='} ?"
+    return f"({limite} AND ({' OR '.join(partes)}))", [valores[0]] + params
+
+def consultar_listagem(nome, inicio=0, quantidade=25, ordenacao=None, filtros=None, busca='', cursor=None):
+    """
+    Uma página da listagem 'nome' (chave de LISTAGENS).
+    ordenacao: lista de (coluna, 'asc'|'desc'), aplicada em ordem; o id desempata.
+    filtros: {coluna: valor} conforme o tipo de filtro da coluna; valores vazios são ignorados.
+    busca: prefixo procurado nas colunas de busca global da listagem (OR entre elas).
+    cursor: o 'cursor' devolvido pela página anterior; quando a listagem e a ordenação permitem
+    keyset, substitui 'inicio' (sem OFFSET, o custo não cresce com a posição).
+    Retorna {'total', 'filtrados', 'linhas', 'cursor'}; 'cursor' é None sem keyset ou na última página.
+    Coluna, cursor ou listagem inválidos levantam ValueError.
+    """
+    if nome not in LISTAGENS:
+        raise ValueError(f"Listagem desconhecida: {nome}")
+    listagem = LISTAGENS[nome]
+    colunas = listagem['colunas']
+
+    condicoes, params = [], []
+    for coluna, valor in (filtros or {}).items():
+        if coluna not in colunas:
+            raise ValueError(f"Coluna inválida para filtro: {coluna}")
+        valor = str(valor).strip() if valor is not None else ''
+        if not valor:
+            continue
+        condicao, parametros = _condicao_listagem(*colunas[coluna], valor)
+        if condicao:
+            condicoes.append(condicao)
+            params += parametros
+    busca = (busca or '').strip()
+    if busca:
+        termos = [_condicao_listagem(*colunas[coluna], busca, busca=True) for coluna in listagem['busca']]
+        condicoes.append("(" + " OR ".join(condicao for condicao, _ in termos) + ")")
+        params += [param for _, parametros in termos for param in parametros]
+    where = ("WHERE " + " AND ".join(condicoes)) if condicoes else ""
+
+    ordem = ordenacao or listagem['ordem_padrao']
+    termos_ordem = []
+    for coluna, direcao in ordem:
+        if coluna not in colunas:
+            raise ValueError(f"Coluna inválida para ordenação: {coluna}")
+        expressao, tipo = colunas[coluna]
+        if tipo == 'prefixo':
+            expressao += ' COLLATE NOCASE'
+        termos_ordem.append((expressao, 'ASC' if str(direcao).lower() == 'asc' else 'DESC'))
+    desempate = listagem.get('desempate', 'id')
+    if not any(expressao == desempate for expressao, _ in termos_ordem):
+        termos_ordem.append((desempate, termos_ordem[0][1]))
+    colunas_keyset = [coluna for coluna, _ in ordem] + ['id']
+    keyset = 'keyset' in listagem and all(coluna in listagem['keyset'] for coluna, _ in ordem)
+
+    quantidade = max(1, min(int(quantidade), LISTAGEM_MAX_POR_PAGINA))
+    inicio = max(0, int(inicio))
+    versoes = obter_versoes_tabelas(*listagem['tabelas'])
+    total = _contar_listagem(nome, versoes, listagem['origem'], '', [])
+    filtrados = _contar_listagem(nome, versoes, listagem['origem'], where, params) if where else total
+
+    where_pagina, params_pagina = where, list(params)
+    if keyset and cursor is not None:
+        if not isinstance(cursor, (list, tuple)) or len(cursor) != len(termos_ordem):
+            raise ValueError("Cursor inválido para esta ordenação.")
+        condicao, parametros = _condicao_keyset(termos_ordem, cursor)
+        # O cursor vem antes dos filtros: com dois limites na mesma coluna o SQLite usa o primeiro
+        where_pagina = "WHERE " + condicao + (" AND " + " AND ".join(condicoes) if condicoes else "")
+        params_pagina = parametros + params
+        inicio = 0
+
+    query = f"""
+        SELECT {listagem['selecao']} FROM {listagem['origem']}
+        {where_pagina}
+        ORDER BY {', '.join(f'{expressao} {direcao}' for expressao, direcao in termos_ordem)}
+        LIMIT ? OFFSET ?
+    """
+    conn = get_db_connection()
+    try:
+        linhas = [dict(row) for row in conn.execute(query, params_pagina + [quantidade, inicio]).fetchall()]
+    finally:
+        conn.close()
+    proximo = None
+    if keyset and len(linhas) == quantidade:
+        proximo = [linhas[-1][coluna] for coluna in colunas_keyset]
+    return {'total': total, 'filtrados': filtrados, 'linhas': linhas, 'cursor': proximo}
+
+def contar_manutencoes_proximas_liberacao(dias=3):
+    """Manutenções abertas cujo prazo de liberação vence entre hoje e os próximos 'dias' dias."""
+    conn = get_db_connection()
+    try:
+        return conn.execute("""
+            SELECT COUNT(*) FROM manutencoes
+            WHERE finalizada = 0 AND prazo_liberacao > 0
+              AND date(data_abertura, '+' || prazo_liberacao || ' days')
+                  BETWEEN date('now', 'localtime') AND date('now', 'localtime', ?)
+        """, (f'+{int(dias)} days',)).fetchone()[0]
+    except Exception as e:
+        print(f"Erro ao contar manutenções próximas da liberação: {e}")
+        return 0
+    finally:
+        conn.close()
+
+# --- Busca Textual (FTS5) ---
+
+_MARCA_INICIO, _MARCA_FIM = '\x02', '\x03'
+
+# tipo -> (índice, id do registro a abrir, título exibido, junção com a linha do índice)
+CONSULTAS_BUSCA = {
+    'cotacao': ('fts_cotacoes', "c.id", "c.titulo", "JOIN cotacoes c ON c.id = fts_cotacoes.rowid"),
+    'cotacao_item': ('fts_cotacao_itens', "ci.cotacao_id", "'Cotação #' || ci.cotacao_id || ' - ' || c.titulo",
+                     "JOIN cotacao_itens ci ON ci.id = fts_cotacao_itens.rowid JOIN cotacoes c ON c.id = ci.cotacao_id"),
+    'pedido_item': ('fts_pedido_itens', "pi.pedido_id", "'Pedido de Compra #' || pi.pedido_id",
+                    "JOIN pedido_itens pi ON pi.id = fts_pedido_itens.rowid"),
+    'fornecedor': ('fts_fornecedores', "f.id", "f.nome", "JOIN fornecedores f ON f.id = fts_fornecedores.rowid"),
+    'notion_page': ('fts_notion_pages', "n.id", "n.title", "JOIN notion_pages n ON n.id = fts_notion_pages.rowid"),
+}
+
+def _expressao_busca(termo):
+    """Converte o texto digitado em uma expressão FTS5: cada palavra vira um prefixo ("pal"*), todas obrigatórias."""
+    palavras = ''.join(ch if ch.isalnum() else ' ' for ch in termo or '').split()
+    return ' '.join(f'"{palavra}"*' for palavra in palavras)
+
+def buscar_texto(termo, tipos=None, limite=20):
+    """
+    Busca textual unificada, ordenada por bm25 (menor = mais relevante) entre todos os tipos.
+    Retorna dicts com tipo, id (do registro a abrir), titulo, trecho (HTML com <mark>) e relevancia.
+    """
+    expressao = _expressao_busca(termo)
+    tipos = [tipo for tipo in (tipos or CONSULTAS_BUSCA) if tipo in CONSULTAS_BUSCA]
+    if not expressao or not tipos:
+        return []
+
+    partes, params = [], []
+    for tipo in tipos:
+        indice, coluna_id, coluna_titulo, juncao = CONSULTAS_BUSCA[tipo]
+        partes.append(f'''
+            SELECT '{tipo}' as tipo, {coluna_id} as id, {coluna_titulo} as titulo,
+                   snippet({indice}, -1, '{_MARCA_INICIO}', '{_MARCA_FIM}', '…', 12) as trecho,
+                   bm25({indice}) as relevancia
+            FROM {indice} {juncao}
+            WHERE {indice} MATCH ?''')
+        params.append(expressao)
+    query = ' UNION ALL '.join(partes) + ' ORDER BY relevancia LIMIT ?'
+    params.append(limite)
+
+    conn = get_db_connection()
+    try:
+        linhas = conn.execute(query, params).fetchall()
+    finally:
+        conn.close()
+
+    resultados = []
+    for linha in linhas:
+        trecho = html.escape(linha['trecho'] or '').replace(_MARCA_INICIO, '<mark>').replace(_MARCA_FIM, '</mark>')
+        resultados.append({'tipo': linha['tipo'], 'id': linha['id'], 'titulo': linha['titulo'],
+                           'trecho': trecho, 'relevancia': linha['relevancia']})
+    return resultados
+
+
+# --- Jobs em Segundo Plano ---
+
+COLUNAS_JOB_ATUALIZAVEIS = ('status', 'progresso', 'mensagem', 'resultado_caminho', 'resultado_mimetype',
+                            'resultado_nome', 'data_inicio', 'data_fim')
+JOBS_RETENCAO_DIAS = 7  # jobs encerrados há mais tempo que isso são apagados, com o arquivo de resultado
+
+def criar_job(tipo, parametros, user_id):
+    """Registra um job pendente; parametros já vem serializado em JSON."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        # Hora local, como data_inicio/data_fim (o DEFAULT CURRENT_TIMESTAMP da coluna é UTC)
+        cursor.execute("INSERT INTO jobs (tipo, parametros, user_id, data_criacao) VALUES (?, ?, ?, ?)",
+                       (tipo, parametros, user_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        conn.commit()
+        return cursor.lastrowid
+    finally:
+        conn.close()
+
+def atualizar_job(job_id, **campos):
+    """Atualiza status/progresso/resultado de um job (apenas colunas de COLUNAS_JOB_ATUALIZAVEIS)."""
+    campos = {coluna: valor for coluna, valor in campos.items() if coluna in COLUNAS_JOB_ATUALIZAVEIS}
+    if not campos:
+        return False
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        atribuicoes = ', '.join(f"{coluna} = ?" for coluna in campos)
+        cursor.execute(f"UPDATE jobs SET {atribuicoes} WHERE id = ?", (*campos.values(), job_id))
+        conn.commit()
+        return cursor.rowcount > 0
+    finally:
+        conn.close()
+
+def obter_job(job_id):
+    conn = get_db_connection()
+    job = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    conn.close()
+    return dict(job) if job else None
+
+def obter_jobs_usuario(user_id, limite=50):
+    conn = get_db_connection()
+    jobs = conn.execute(
+        "SELECT * FROM jobs WHERE user_id = ? ORDER BY id DESC LIMIT ?", (user_id, limite)
+    ).fetchall()
+    conn.close()
+    return [dict(job) for job in jobs]
+
+def marcar_jobs_interrompidos():
+    """
+    Na subida do servidor, jobs que estavam pendentes/executando ficaram órfãos (o pool de threads
+    morreu com o processo anterior): marca-os como erro para o cliente não esperar para sempre.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            UPDATE jobs SET status = 'Erro', mensagem = 'Interrompido pelo reinício do servidor', data_fim = ?
+            WHERE status IN ('Pendente', 'Executando')
+        """, (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),))
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        conn.close()
+
+def excluir_jobs_expirados(dias=JOBS_RETENCAO_DIAS):
+    """
+    Apaga os jobs encerrados (Concluido/Erro) há mais de `dias` dias e retorna os caminhos dos arquivos
+    de resultado deles, que o chamador (jobs.limpar_jobs_expirados) remove do disco.
+    """
+    limite = (datetime.now() - timedelta(days=dias)).strftime('%Y-%m-%d %H:%M:%S')
+    condicao = "status IN ('Concluido', 'Erro') AND COALESCE(data_fim, data_criacao) < ?"
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        caminhos = [row[0] for row in cursor.execute(f"SELECT resultado_caminho FROM jobs WHERE {condicao}", (limite,))]
+        cursor.execute(f"DELETE FROM jobs WHERE {condicao}", (limite,))
+        conn.commit()
+        return [caminho for caminho in caminhos if caminho]
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
@@ -22,6 +22,7 @@ from database import (
     obter_pedidos_compra_com_filtros
 )
 from utils import login_required, roles_required
+from jobs import tipo_job, resultado_json
 
 # Define o prefixo '/dealers' para todas as rotas neste Blueprint
 dealer_bp = Blueprint('dealer', __name__, url_prefix='/dealers')
@@ -199,6 +200,13 @@ def fornecedores():
     return render_template('fornecedores.html', active_page='fornecedores', fornecedores=fornecedores_list)
 
 
+@tipo_job('dealer_intelligence', roles=['Gestor'])
+def job_dealer_intelligence(parametros, progresso):
+    """Dealer Intelligence para períodos longos, fora da requisição."""
+    data = obter_dealer_intelligence(parametros['data_inicio'], parametros['data_fim'])
+    return resultado_json(data, 'dealer_intelligence.json')
+
+
 @dealer_bp.route('/dealer-intelligence', methods=['GET', 'POST'])
 @login_required
 @roles_required(['Administrador', 'Gestor'])
@@ -1,15 +1,29 @@
 # routes/frota.py
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session, g, send_from_directory
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session, g, send_from_directory, Response, stream_with_context
 from datetime import datetime, timedelta
+from openpyxl import Workbook
+import csv
+import io
+import json
 import os
-import sqlite3 # Necessário para replicar a lógica de 'index' e 'api_dashboard' que usava sqlite3 diretamente
+import tempfile
 
 from database import (
+    obter_resumo_dashboard,
+    recalcular_consumo_frota,
+    buscar_texto,
     obter_relatorio,
+    obter_relatorio_pagina,
+    obter_totais_relatorio,
+    consultar_listagem,
+    LISTAGENS,
+    LISTAGEM_MAX_POR_PAGINA,
+    resumir,
+    consulta_exportacao,
+    iterar_consulta,
     calcular_medias_veiculos,
     criar_requisicao,
-    obter_todas_requisicoes,
     obter_requisicao_por_id,
     atualizar_requisicao,
     excluir_requisicao,
@@ -21,6 +35,8 @@ from database import (
     atualizar_registro,
     criar_registro,
     obter_registro_por_id,
+    pre_visualizar_importacao,
+    importar_abastecimentos,
     obter_trocas_oleo,
     salvar_troca_oleo,
     obter_placas_veiculos,
@@ -35,6 +51,8 @@ from database import (
     atualizar_manutencao,
     excluir_manutencao,
     obter_estatisticas_manutencoes,
+    contar_manutencoes_proximas_liberacao,
+    obter_relatorio_manutencoes,
     criar_pedagio,
     obter_pedagios_com_filtros,
     obter_pedagio_por_id,
@@ -54,7 +72,10 @@ from database import (
     transfer_notion_page,
     delete_notion_page
 )
-from utils import login_required, roles_required
+from utils import login_required, roles_required, resposta_condicional
+from jobs import tipo_job, submeter_job, resposta_job, resultado_json
+from analitico import agregar, TABELAS_SNAPSHOT
+from qualidade import varrer_abastecimentos, agendar_varredura_incremental, obter_inconsistencias, obter_ultima_varredura, REGRAS
 
 # Blueprint para as rotas principais (sem prefixo)
 frota_bp = Blueprint('frota', __name__)
@@ -65,29 +86,9 @@ frota_bp = Blueprint('frota', __name__)
 @frota_bp.route('/')
 @login_required
 def index():
-    # Lógica original do app.py para / (index) usando sqlite3 diretamente
     try:
-        conn = sqlite3.connect('abastecimentos.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM abastecimentos")
-        total_abastecimentos = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(DISTINCT placa) FROM abastecimentos")
-        total_veiculos = cursor.fetchone()[0]
-        cursor.execute("SELECT SUM(valor) FROM manutencoes")
-        total_manutencoes = cursor.fetchone()[0] or 0
-        cursor.execute("SELECT COUNT(*) FROM manutencoes")
-        manutencoescount = cursor.fetchone()[0] or 0
-        cursor.execute("SELECT SUM(custo_liquido) FROM abastecimentos")
-        gasto_total = cursor.fetchone()[0] or 0
-        conn.close()
-        
-        return render_template('index.html', 
-                             active_page='index',
-                             total_abastecimentos=total_abastecimentos,
-                             total_veiculos=total_veiculos,
-                             total_manutencoes=total_manutencoes,
-                             manutencoescount=manutencoescount,
-                             gasto_total=gasto_total)
+        resumo = obter_resumo_dashboard()
+        return render_template('index.html', active_page='index', **resumo)
     except Exception as e:
         print(f"Erro ao carregar dados do dashboard: {e}")
         return render_template('index.html', active_page='index', total_abastecimentos=0, total_veiculos=0, total_manutencoes=0, manutencoescount=0, gasto_total=0)
@@ -117,20 +118,19 @@ def relatorios():
             'placa': request.args.get('placa', '').strip() or None
         }
 
-    try:
-        df = obter_relatorio(**filtros)
-        dados = df.to_dict('records')
-        if request.values.get('imprimir'):
+    # A listagem é carregada pelo navegador em páginas via /api/relatorios;
+    # apenas a impressão ainda materializa o resultado completo.
+    if request.values.get('imprimir'):
+        try:
+            dados = obter_relatorio(**filtros).to_dict('records')
             return render_template('relatorio_impressao.html', dados=dados, filtros=filtros, data_emissao=datetime.now().strftime('%d/%m/%Y %H:%M'))
-    except Exception as e:
-        flash(f'Erro ao gerar relatório: {str(e)}', 'danger')
-        dados = []
+        except Exception as e:
+            flash(f'Erro ao gerar relatório: {str(e)}', 'danger')
 
     filtros_para_template = {k: (v or '') for k, v in filtros.items()}
 
     return render_template(
         'relatorios.html',
-        dados=dados,
         filtros=filtros_para_template,
         opcoes_centro_custo=obter_opcoes_filtro('centro_custo'),
         opcoes_combustivel=obter_opcoes_filtro('combustivel'),
@@ -143,23 +143,19 @@ def relatorios():
 @frota_bp.route('/manutencoes')
 @login_required
 def manutencoes():
+    # As linhas são carregadas pelo navegador, em páginas, via /api/listas/manutencoes
     try:
-        manutencoes_list = obter_manutencoes()
         estatisticas = obter_estatisticas_manutencoes()
-        return render_template('manutencoes.html', active_page='manutencoes', manutencoes=manutencoes_list, total_manutencoes=estatisticas['total'], manutencoes_abertas=estatisticas['abertas'], manutencoes_finalizadas=estatisticas['finalizadas'], valor_total=estatisticas['valor_total'])
+        return render_template('manutencoes.html', active_page='manutencoes', total_manutencoes=estatisticas['total'], manutencoes_abertas=estatisticas['abertas'], manutencoes_finalizadas=estatisticas['finalizadas'], valor_total=estatisticas['valor_total'], proximas_liberacao=contar_manutencoes_proximas_liberacao())
     except Exception as e:
         flash(f'Erro ao carregar manutenções: {str(e)}', 'danger')
-        return render_template('manutencoes.html', active_page='manutencoes', manutencoes=[], total_manutencoes=0, manutencoes_abertas=0, manutencoes_finalizadas=0, valor_total=0)
+        return render_template('manutencoes.html', active_page='manutencoes', total_manutencoes=0, manutencoes_abertas=0, manutencoes_finalizadas=0, valor_total=0, proximas_liberacao=0)
 
 @frota_bp.route('/checklists')
 @login_required
 def checklists():
-    try:
-        checklists_list = obter_checklists()
-        return render_template('checklists.html', active_page='checklists', checklists=checklists_list)
-    except Exception as e:
-        flash(f'Erro ao carregar checklists: {str(e)}', 'danger')
-        return render_template('checklists.html', active_page='checklists', checklists=[])
+    # As linhas são carregadas pelo navegador, em páginas, via /api/listas/checklists
+    return render_template('checklists.html', active_page='checklists')
 
 @frota_bp.route('/medias-veiculos')
 @login_required
@@ -264,9 +260,8 @@ def pedagios():
             'placa': request.form.get('placa', '').strip() or None
         }
         
-        pedagios_list = obter_pedagios_com_filtros(**filtros)
-        
         if request.values.get('imprimir'):
+            pedagios_list = obter_pedagios_com_filtros(**filtros)
             return render_template('relatorio_pedagios_impressao.html', pedagios=pedagios_list, filtros=filtros, data_emissao=datetime.now().strftime('%d/%m/%Y %H:%M'))
     else:
         filtros = {
@@ -274,9 +269,47 @@ def pedagios():
             'data_fim': request.args.get('data_fim', datetime.now().strftime('%Y-%m-%d')), 
             'placa': request.args.get('placa', '').strip() or None
         }
-        pedagios_list = obter_pedagios_com_filtros(**filtros)
-        
-    return render_template('pedagios.html', active_page='pedagios', pedagios=pedagios_list, filtros=filtros, placas_disponiveis=placas_disponiveis)
+
+    # As linhas vêm de /api/listas/pedagios; aqui só o total do período (resumo mensal quando alinhado)
+    totais = resumir('pedagios', filtros['data_inicio'] or None, filtros['data_fim'] or None,
+                     {'placa': filtros['placa'].upper() if filtros['placa'] else None})
+    total_pedagios = totais[0] if totais else {'registros': 0, 'valor': 0}
+    return render_template('pedagios.html', active_page='pedagios', filtros=filtros, total_pedagios=total_pedagios, placas_disponiveis=placas_disponiveis)
+
+@frota_bp.route('/importar', methods=['GET', 'POST'])
+@login_required
+@roles_required(['Administrador', 'Gestor'])
+def importar():
+    if request.method == 'POST':
+        arquivo = request.files.get('file')
+        if not arquivo or arquivo.filename == '':
+            flash('Selecione um arquivo .xlsx ou .csv.', 'warning')
+            return redirect(url_for('frota.importar'))
+        try:
+            resultado = importar_abastecimentos(arquivo.stream, arquivo.filename)
+            if resultado['importados']:
+                agendar_varredura_incremental()
+            flash(f"{resultado['importados']} abastecimento(s) importado(s) para {resultado['placas']} placa(s).", 'success')
+            for erro in resultado['erros']:
+                flash(erro, 'warning')
+        except Exception as e:
+            flash(f'Erro ao importar arquivo: {str(e)}', 'danger')
+        return redirect(url_for('frota.importar'))
+
+    return render_template('importar.html', active_page='importar')
+
+@frota_bp.route('/preview-import', methods=['POST'])
+@login_required
+@roles_required(['Administrador', 'Gestor'])
+def preview_import():
+    arquivo = request.files.get('file')
+    if not arquivo or arquivo.filename == '':
+        return jsonify({'error': 'Nenhum arquivo enviado.'}), 400
+    try:
+        colunas, preview = pre_visualizar_importacao(arquivo.stream, arquivo.filename)
+        return jsonify({'columns': colunas, 'preview': preview})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
 
 @frota_bp.route('/requisicoes', methods=['GET', 'POST'])
 @login_required
@@ -298,8 +331,8 @@ def requisicoes():
             flash(f'Erro ao criar requisição: {str(e)}', 'danger')
         return redirect(url_for('frota.requisicoes'))
 
-    requisicoes_list = obter_todas_requisicoes()
-    return render_template('requisicoes.html', active_page='requisicoes', requisicoes=requisicoes_list)
+    # As linhas são carregadas pelo navegador, em páginas, via /api/listas/requisicoes
+    return render_template('requisicoes.html', active_page='requisicoes')
 
 @frota_bp.route('/requisicao/<int:id>/imprimir')
 @login_required
@@ -414,36 +447,328 @@ def notion_page_print(id):
 
 @frota_bp.route('/api/dashboard')
 @login_required
+@resposta_condicional(['abastecimentos', 'manutencoes'])
 def api_dashboard():
-    # Lógica original do app.py para /api/dashboard usando sqlite3 diretamente
     try:
-        conn = sqlite3.connect('abastecimentos.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM abastecimentos")
-        total_abastecimentos = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(DISTINCT placa) FROM abastecimentos")
-        total_veiculos = cursor.fetchone()[0]
-        cursor.execute("SELECT SUM(valor) FROM manutencoes")
-        total_manutencoes = cursor.fetchone()[0] or 0
-        cursor.execute("SELECT COUNT(*) FROM manutencoes")
-        manutencoescount = cursor.fetchone()[0] or 0
-        cursor.execute("SELECT SUM(custo_liquido) FROM abastecimentos")
-        gasto_total = cursor.fetchone()[0] or 0
-        conn.close()
-        
-        return jsonify({
-            'success': True,
-            'total_abastecimentos': total_abastecimentos,
-            'total_veiculos': total_veiculos,
-            'total_manutencoes': total_manutencoes,
-            'manutencoescount': manutencoescount,
-            'gasto_total': gasto_total
-        })
+        return jsonify({'success': True, **obter_resumo_dashboard()})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+ROTAS_BUSCA = {
+    'cotacao': ('dealer.cotacao_detalhe', 'cotacao_id'),
+    'cotacao_item': ('dealer.cotacao_detalhe', 'cotacao_id'),
+    'pedido_item': ('dealer.pedido_detalhe', 'pedido_id'),
+    'fornecedor': ('dealer.fornecedores', None),
+    'notion_page': ('frota.notion_page_detail', 'id'),
+}
+
+@frota_bp.route('/api/search')
+@login_required
+def api_search():
+    """Busca textual em cotações, itens de cotação e pedido, fornecedores e páginas Notion (bm25 + trecho)."""
+    try:
+        termo = request.args.get('q', '').strip()
+        tipos = [t for t in request.args.get('tipos', '').split(',') if t] or list(ROTAS_BUSCA)
+        if g.user['role'] not in ['Administrador', 'Gestor', 'Comprador']:
+            tipos = [t for t in tipos if t != 'fornecedor']
+        limite = max(1, min(request.args.get('limite', 20, type=int), 50))
+
+        resultados = buscar_texto(termo, tipos, limite)
+        for resultado in resultados:
+            endpoint, parametro = ROTAS_BUSCA[resultado['tipo']]
+            resultado['url'] = url_for(endpoint, **({parametro: resultado['id']} if parametro else {}))
+        return jsonify({'success': True, 'termo': termo, 'resultados': resultados})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def _periodo_relatorio():
+    """Período pedido ao relatório, com os padrões (últimos 30 dias) já resolvidos para a data de hoje."""
+    hoje = datetime.now()
+    return (request.args.get('data_inicio', (hoje - timedelta(days=30)).strftime('%Y-%m-%d')),
+            request.args.get('data_fim', hoje.strftime('%Y-%m-%d')))
+
+@frota_bp.route('/api/relatorios')
+@login_required
+@resposta_condicional(['abastecimentos'], chave=_periodo_relatorio)
+def api_relatorios():
+    """Relatório de abastecimentos paginado por cursor (data, id). Os totais vêm na primeira página."""
+    try:
+        data_inicio, data_fim = _periodo_relatorio()
+        filtros = {
+            'data_inicio': data_inicio,
+            'data_fim': data_fim,
+            'placa': request.args.get('placa', '').strip() or None,
+            'centro_custo': request.args.get('centro_custo', '').strip() or None,
+            'combustivel': request.args.get('combustivel', '').strip() or None,
+            'posto': request.args.get('posto', '').strip() or None
+        }
+        cursor_data = request.args.get('cursor_data') or None
+        cursor_id = request.args.get('cursor_id', type=int)
+        limite = max(1, min(request.args.get('limite', 100, type=int), 500))
+        ordem = request.args.get('ordem', 'desc')
+
+        registros, proximo_cursor = obter_relatorio_pagina(filtros, cursor_data, cursor_id, limite, ordem)
+        resposta = {'success': True, 'registros': registros, 'proximo_cursor': proximo_cursor}
+        if cursor_data is None:
+            resposta['totais'] = obter_totais_relatorio(**filtros)
+        return jsonify(resposta)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@frota_bp.route('/api/relatorios/totais')
+@login_required
+@resposta_condicional(['abastecimentos'], chave=_periodo_relatorio)
+def api_relatorios_totais():
+    """Totais do relatório de abastecimentos (cards e rodapé), lidos dos resumos."""
+    try:
+        data_inicio, data_fim = _periodo_relatorio()
+        filtros = {
+            'data_inicio': data_inicio,
+            'data_fim': data_fim,
+            'placa': request.args.get('placa', '').strip() or None,
+            'centro_custo': request.args.get('centro_custo', '').strip() or None,
+            'combustivel': request.args.get('combustivel', '').strip() or None,
+            'posto': request.args.get('posto', '').strip() or None
+        }
+        return jsonify({'success': True, 'totais': obter_totais_relatorio(**filtros)})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def _parametros_datatables(valores):
+    """
+    Converte os parâmetros do protocolo de servidor do DataTables (draw, start, length, search[value],
+    order[i][column|dir], columns[i][data|search][value]) nos argumentos de consultar_listagem.
+    O parâmetro extra 'cursor' (JSON devolvido pela página anterior) pede paginação keyset.
+    """
+    colunas = {}
+    ordem = {}
+    for chave, valor in valores.items():
+        partes = chave.replace(']', '').split('[')
+        if partes[0] == 'columns' and len(partes) >= 3:
+            coluna = colunas.setdefault(int(partes[1]), {'data': '', 'busca': '', 'orderable': 'true'})
+            if partes[2] == 'data':
+                coluna['data'] = valor
+            elif partes[2] == 'orderable':
+                coluna['orderable'] = valor
+            elif partes[2:4] == ['search', 'value']:
+                coluna['busca'] = valor
+        elif partes[0] == 'order' and len(partes) == 3:
+            ordem.setdefault(int(partes[1]), {})[partes[2]] = valor
+
+    filtros = {coluna['data']: coluna['busca'] for coluna in colunas.values() if coluna['data'] and coluna['busca']}
+    ordenacao = []
+    for _, termo in sorted(ordem.items()):
+        coluna = colunas.get(int(termo.get('column', -1)))
+        if coluna and coluna['data'] and coluna['orderable'] != 'false':
+            ordenacao.append((coluna['data'], termo.get('dir', 'asc')))
+    quantidade = int(valores.get('length') or 25)
+    return {
+        'inicio': int(valores.get('start') or 0),
+        'quantidade': LISTAGEM_MAX_POR_PAGINA if quantidade < 0 else quantidade,
+        'ordenacao': ordenacao or None,
+        'filtros': filtros,
+        'busca': valores.get('search[value]', ''),
+        'cursor': json.loads(valores['cursor']) if valores.get('cursor') else None,
+    }
+
+@frota_bp.route('/api/listas/<nome>', methods=['GET', 'POST'])
+@login_required
+@resposta_condicional(sorted({tabela for listagem in LISTAGENS.values() for tabela in listagem['tabelas']}))
+def api_listagem(nome):
+    """
+    Listagem paginada no servidor (database.LISTAGENS) no formato do DataTables:
+    {draw, recordsTotal, recordsFiltered, data}, mais 'cursor' para pedir a página seguinte por
+    keyset nas listagens que o suportam. Aceita os parâmetros por GET ou POST (formulário).
+    """
+    valores = request.values.to_dict()
+    draw = request.values.get('draw', 0, type=int)
+    try:
+        pagina = consultar_listagem(nome, **_parametros_datatables(valores))
+        return jsonify({'draw': draw, 'recordsTotal': pagina['total'], 'recordsFiltered': pagina['filtrados'],
+                        'data': pagina['linhas'], 'cursor': pagina['cursor']})
+    except ValueError as e:
+        return jsonify({'draw': draw, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'draw': draw, 'error': str(e)}), 500
+
+@frota_bp.route('/api/analytics/aggregate')
+@login_required
+@resposta_condicional(list(TABELAS_SNAPSHOT))
+def api_analytics_aggregate():
+    """
+    Agregação genérica sobre o snapshot colunar (analitico.agregar).
+    Ex.: ?tabela=abastecimentos&chaves=placa,mes&medidas=litros,gasto,km_litro&data_inicio=2025-01-01
+         &data_fim=2025-06-30&combustivel=DIESEL S10&combustivel=ARLA&ordenar_por=gasto&ordem=desc&limite=20
+    Filtros: qualquer coluna categórica da tabela, repetida para vários valores.
+    """
+    try:
+        tabela = request.args.get('tabela', 'abastecimentos')
+        if tabela not in TABELAS_SNAPSHOT:
+            return jsonify({'success': False, 'error': f'Tabela inválida. Use: {", ".join(TABELAS_SNAPSHOT)}.'}), 400
+        filtros = {coluna: [v for v in request.args.getlist(coluna) if v != '']
+                   for coluna in TABELAS_SNAPSHOT[tabela]['categoricas'] if coluna in request.args}
+        limite = request.args.get('limite', type=int)
+        resultado = agregar(
+            tabela,
+            chaves=[c for c in request.args.get('chaves', '').split(',') if c],
+            medidas=[m for m in request.args.get('medidas', 'registros').split(',') if m],
+            data_inicio=request.args.get('data_inicio') or None,
+            data_fim=request.args.get('data_fim') or None,
+            filtros=filtros,
+            ordenar_por=request.args.get('ordenar_por') or None,
+            ordem=request.args.get('ordem', 'asc'),
+            limite=max(1, limite) if limite else None,
+        )
+        return jsonify({'success': True, **resultado})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# --- Qualidade dos Dados de Abastecimento ---
+
+@frota_bp.route('/api/qualidade/abastecimentos')
+@login_required
+@resposta_condicional(['abastecimentos', 'varreduras_qualidade'])
+def api_qualidade_abastecimentos():
+    """
+    Abastecimentos marcados pela varredura de qualidade (qualidade.py), paginados.
+    Ex.: ?regra=odometro_retrocesso&placa=ABC1D23&data_inicio=2025-01-01&data_fim=2025-06-30&pagina=2
+    Só lê o que já foi gravado: a incremental roda em segundo plano depois de cada gravação de
+    abastecimentos (agendar_varredura_incremental) e a completa é feita por POST /api/qualidade/varredura.
+    """
+    try:
+        pagina = max(1, request.args.get('pagina', 1, type=int))
+        por_pagina = min(max(1, request.args.get('por_pagina', 100, type=int)), 1000)
+        linhas, total, por_regra = obter_inconsistencias(
+            regra=request.args.get('regra') or None,
+            placa=request.args.get('placa') or None,
+            data_inicio=request.args.get('data_inicio') or None,
+            data_fim=request.args.get('data_fim') or None,
+            pagina=pagina,
+            por_pagina=por_pagina,
+        )
+        return jsonify({'success': True, 'inconsistencias': linhas, 'total': total, 'pagina': pagina,
+                        'por_pagina': por_pagina, 'por_regra': por_regra, 'regras': REGRAS,
+                        'ultima_varredura': obter_ultima_varredura()})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@tipo_job('varredura_qualidade', roles=['Gestor'])
+def job_varredura_qualidade(parametros, progresso):
+    incremental = parametros.get('modo') == 'incremental'
+    progresso(0, 'Varrendo abastecimentos' + (' novos' if incremental else ' de toda a frota'))
+    resumo = varrer_abastecimentos(incremental=incremental) or {'modo': 'incremental', 'inconsistencias': 0}
+    return resultado_json(resumo, 'varredura_qualidade.json')
+
+@frota_bp.route('/api/qualidade/varredura', methods=['POST'])
+@login_required
+@roles_required(['Administrador', 'Gestor'])
+def api_qualidade_varredura():
+    """Agenda a varredura (modo 'completa', padrão, ou 'incremental') como job."""
+    dados = request.get_json(silent=True) or {}
+    modo = dados.get('modo', 'completa')
+    if modo not in ('completa', 'incremental'):
+        return jsonify({'success': False, 'error': "Modo inválido. Use: completa, incremental."}), 400
+    return resposta_job(submeter_job('varredura_qualidade', {'modo': modo}, session['user_id']))
+
+# --- Exportação em Fluxo (CSV / NDJSON / XLSX) ---
+
+def _gerar_csv(linhas):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+    yield '\ufeff'  # BOM para o Excel reconhecer UTF-8
+    for i, linha in enumerate(linhas):
+        writer.writerow(linha)
+        if i % 500 == 0 or buffer.tell() > 65536:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def _gerar_ndjson(linhas):
+    colunas = next(linhas)
+    for linha in linhas:
+        yield json.dumps(dict(zip(colunas, linha)), ensure_ascii=False) + '\n'
+
+def _gerar_xlsx(linhas, titulo):
+    # Modo write-only: as linhas vão direto para disco; o arquivo final é enviado em blocos
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=titulo[:31])
+    for linha in linhas:
+        ws.append(linha)
+    with tempfile.TemporaryFile() as arquivo:
+        wb.save(arquivo)
+        arquivo.seek(0)
+        while True:
+            bloco = arquivo.read(65536)
+            if not bloco:
+                break
+            yield bloco
+
+FORMATOS_EXPORTACAO = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+def _corpo_exportacao(relatorio, formato, filtros):
+    """Gerador do arquivo exportado e seu nome; ValueError se o relatório não existir."""
+    query, params = consulta_exportacao(relatorio, **filtros)
+    linhas = iterar_consulta(query, params)
+    if formato == 'csv':
+        corpo = _gerar_csv(linhas)
+    elif formato == 'ndjson':
+        corpo = _gerar_ndjson(linhas)
+    else:
+        corpo = _gerar_xlsx(linhas, relatorio)
+    return corpo, f"{relatorio}_{filtros['data_inicio']}_{filtros['data_fim']}.{formato}"
+
+@tipo_job('exportar')
+def job_exportar(parametros, progresso):
+    relatorio, formato = parametros['relatorio'], parametros.get('formato', 'csv')
+    if formato not in FORMATOS_EXPORTACAO:
+        raise ValueError('Formato inválido. Use csv, ndjson ou xlsx.')
+    corpo, nome_arquivo = _corpo_exportacao(relatorio, formato, parametros['filtros'])
+    return corpo, FORMATOS_EXPORTACAO[formato], nome_arquivo
+
+@frota_bp.route('/exportar/<relatorio>')
+@login_required
+def exportar_relatorio(relatorio):
+    """
+    Exporta abastecimentos, pedágios ou manutenções lendo o cursor do SQLite em fluxo.
+    Com assincrono=1 a exportação vira um job e a resposta (202) traz o id para acompanhar em /api/jobs.
+    """
+    formato = request.args.get('formato', 'csv').lower()
+    if formato not in FORMATOS_EXPORTACAO:
+        return jsonify({'success': False, 'error': 'Formato inválido. Use csv, ndjson ou xlsx.'}), 400
+
+    filtros = {
+        'data_inicio': request.args.get('data_inicio', (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')),
+        'data_fim': request.args.get('data_fim', datetime.now().strftime('%Y-%m-%d')),
+        'placa': request.args.get('placa', '').strip() or None,
+        'centro_custo': request.args.get('centro_custo', '').strip() or None,
+        'combustivel': request.args.get('combustivel', '').strip() or None,
+        'posto': request.args.get('posto', '').strip() or None
+    }
+    try:
+        corpo, nome_arquivo = _corpo_exportacao(relatorio, formato, filtros)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
+
+    if request.args.get('assincrono') == '1':
+        corpo.close()
+        parametros = {'relatorio': relatorio, 'formato': formato, 'filtros': filtros}
+        return resposta_job(submeter_job('exportar', parametros, session['user_id']))
+
+    return Response(stream_with_context(corpo), mimetype=FORMATOS_EXPORTACAO[formato],
+                    headers={'Content-Disposition': f'attachment; filename="{nome_arquivo}"'})
+
 @frota_bp.route('/api/manutencoes', methods=['GET', 'POST'])
 @login_required
+@resposta_condicional(['manutencoes'])
 def api_manutencoes():
     if request.method == 'GET':
         try:
@@ -462,9 +787,22 @@ def api_manutencoes():
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)}), 400
 
+@frota_bp.route('/api/manutencoes/estatisticas')
+@login_required
+@resposta_condicional(['manutencoes'], chave=lambda: datetime.now().strftime('%Y-%m-%d'))  # próximas liberações contam a partir de hoje
+def api_estatisticas_manutencoes():
+    """Contadores dos cards da tela de manutenções, sem as linhas."""
+    try:
+        estatisticas = obter_estatisticas_manutencoes()
+        estatisticas['proximas_liberacao'] = contar_manutencoes_proximas_liberacao()
+        return jsonify({'success': True, 'estatisticas': estatisticas})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @frota_bp.route('/api/manutencoes/<int:id>', methods=['GET', 'PUT', 'DELETE'])
 @login_required
 @roles_required(['Administrador', 'Gestor', 'Comprador'])
+@resposta_condicional(['manutencoes'])
 def api_manutencao(id):
     if request.method == 'GET':
         try:
@@ -488,6 +826,7 @@ def api_manutencao(id):
 
 @frota_bp.route('/api/checklists', methods=['GET', 'POST'])
 @login_required
+@resposta_condicional(['checklists'])
 def api_checklists():
     if request.method == 'GET':
         try:
@@ -507,6 +846,7 @@ def api_checklists():
 
 @frota_bp.route('/api/checklists/<int:id>', methods=['GET', 'PUT', 'DELETE'])
 @login_required
+@resposta_condicional(['checklists'])
 def api_checklist(id):
     if request.method == 'GET':
         try:
@@ -530,6 +870,7 @@ def api_checklist(id):
 
 @frota_bp.route('/api/checklists/<identificacao>')
 @login_required
+@resposta_condicional(['checklists'])
 def api_checklists_por_identificacao(identificacao):
     try:
         checklists_list = obter_checklists_por_identificacao(identificacao)
@@ -574,6 +915,7 @@ def api_criar_registro():
         dados['custo_liquido'] = round(dados['custo_bruto'] - desconto, 2)
         
         id = criar_registro(dados)
+        agendar_varredura_incremental()
         return jsonify({'success': True, 'id': id})
     except (ValueError, TypeError) as e:
         return jsonify({'success': False, 'error': f'Valor numérico inválido: {e}'}), 400
@@ -583,6 +925,7 @@ def api_criar_registro():
 @frota_bp.route('/api/registros/<int:id>', methods=['GET', 'PUT', 'DELETE'])
 @login_required
 @roles_required(['Administrador', 'Gestor', 'Comprador', 'Padrão'])
+@resposta_condicional(['abastecimentos'])
 def gerenciar_registro(id):
     if request.method == 'GET':
         registro = obter_registro_por_id(id)
@@ -600,7 +943,9 @@ def gerenciar_registro(id):
             dados['custo_bruto'] = round(dados['litros'] * dados['custo_por_litro'], 2)
             dados['custo_liquido'] = round(dados['custo_bruto'] - dados['desconto'], 2)
 
+            anterior = obter_registro_por_id(id)
             if atualizar_registro(id, dados):
+                agendar_varredura_incremental(anterior and anterior['placa'], dados['placa'].upper())
                 return jsonify({'success': True})
             return jsonify({'success': False, 'error': 'Erro ao atualizar'}), 400
         except (ValueError, TypeError) as e:
@@ -609,7 +954,10 @@ def gerenciar_registro(id):
             return jsonify({'success': False, 'error': str(e)}), 400
 
     elif request.method == 'DELETE':
-        if excluir_registro(id): return jsonify({'success': True})
+        anterior = obter_registro_por_id(id)
+        if excluir_registro(id):
+            agendar_varredura_incremental(anterior and anterior['placa'])
+            return jsonify({'success': True})
         return jsonify({'success': False, 'error': 'Nenhum registro excluído'}), 404
 
 @frota_bp.route('/api/pedagios', methods=['POST'])
@@ -627,6 +975,7 @@ def api_criar_pedagio():
 
 @frota_bp.route('/api/pedagios/<int:id>', methods=['GET', 'PUT', 'DELETE'])
 @login_required
+@resposta_condicional(['pedagios'])
 def api_gerenciar_pedagio(id):
     if request.method == 'GET':
         try:
@@ -650,6 +999,7 @@ def api_gerenciar_pedagio(id):
 
 @frota_bp.route('/medias-veiculos-dados')
 @login_required
+@resposta_condicional(['abastecimentos'])
 def medias_veiculos_dados():
     try:
         dados = calcular_medias_veiculos()
@@ -660,6 +1010,7 @@ def medias_veiculos_dados():
 @frota_bp.route('/api/requisicao/<int:id>')
 @login_required
 @roles_required(['Administrador', 'Gestor'])
+@resposta_condicional(['requisicoes_abastecimento', 'users'])
 def api_obter_requisicao(id):
     """API para buscar os dados de uma requisição para o modal de edição."""
     requisicao = obter_requisicao_por_id(id)
@@ -667,9 +1018,26 @@ def api_obter_requisicao(id):
         return jsonify(dict(requisicao))
     return jsonify({'error': 'Requisição não encontrada'}), 404
 
+@tipo_job('relatorio_manutencoes')
+def job_relatorio_manutencoes(parametros, progresso):
+    """Mesmos filtros de /api/manutencoes/relatorio, sem paginação."""
+    campos = ('identificacao', 'status', 'tipo', 'frota', 'pagamento', 'data_inicio', 'data_fim',
+              'ordenar_por', 'ordenar_direcao')
+    filtros = {campo: parametros[campo] for campo in campos if campo in parametros}
+    manutencoes, estatisticas, _ = obter_relatorio_manutencoes(**filtros)
+    return resultado_json({'manutencoes': manutencoes, 'estatisticas': estatisticas, 'filtros_aplicados': filtros},
+                          'relatorio_manutencoes.json')
+
+@tipo_job('recalcular_consumo', roles=['Gestor'])
+def job_recalcular_consumo(parametros, progresso):
+    progresso(0, 'Recalculando km/litro de todos os abastecimentos')
+    atualizados = recalcular_consumo_frota()
+    return resultado_json({'abastecimentos_atualizados': atualizados}, 'recalculo_consumo.json')
+
 # --- NOVA API para Relatório de Manutenções ---
 @frota_bp.route('/api/manutencoes/relatorio', methods=['GET'])
 @login_required
+@resposta_condicional(['manutencoes'])
 def api_relatorio_manutencoes():
     """API para gerar relatório completo de manutenções para impressão"""
     try:
@@ -684,71 +1052,23 @@ def api_relatorio_manutencoes():
         ordenar_por = request.args.get('ordenar_por', 'data_abertura')
         ordenar_direcao = request.args.get('ordenar_direcao', 'desc')
         
-        # Obter todas as manutenções
-        manutencoes_list = obter_manutencoes()
-        
-        # Aplicar filtros
-        manutencoes_filtradas = []
-        for manutencao in manutencoes_list:
-            # Filtro por identificação
-            if filtro_identificacao and filtro_identificacao.lower() not in manutencao['identificacao'].lower():
-                continue
-            
-            # Filtro por status
-            if filtro_status != 'todos':
-                if filtro_status == 'aberto' and manutencao['finalizada']:
-                    continue
-                if filtro_status == 'finalizado' and not manutencao['finalizada']:
-                    continue
-            
-            # Filtro por tipo
-            if filtro_tipo != 'todos' and manutencao['tipo'] != filtro_tipo:
-                continue
-            
-            # Filtro por frota
-            if filtro_frota != 'todos' and manutencao['frota'] != filtro_frota:
-                continue
-            
-            # Filtro por forma de pagamento
-            if filtro_pagamento != 'todos' and manutencao.get('forma_pagamento') != filtro_pagamento:
-                continue
-            
-            # Filtro por data
-            if data_inicio:
-                data_abertura = datetime.strptime(manutencao['data_abertura'], '%Y-%m-%d')
-                data_inicio_filtro = datetime.strptime(data_inicio, '%Y-%m-%d')
-                if data_abertura < data_inicio_filtro:
-                    continue
-            
-            if data_fim:
-                data_abertura = datetime.strptime(manutencao['data_abertura'], '%Y-%m-%d')
-                data_fim_filtro = datetime.strptime(data_fim, '%Y-%m-%d')
-                if data_abertura > data_fim_filtro:
-                    continue
-            
-            manutencoes_filtradas.append(manutencao)
-        
-        # Ordenar resultados
-        if ordenar_por == 'valor':
-            manutencoes_filtradas.sort(key=lambda x: x.get('valor', 0), reverse=(ordenar_direcao == 'desc'))
-        elif ordenar_por == 'identificacao':
-            manutencoes_filtradas.sort(key=lambda x: x.get('identificacao', '').lower(), reverse=(ordenar_direcao == 'desc'))
-        else:  # data_abertura (padrão)
-            manutencoes_filtradas.sort(key=lambda x: x.get('data_abertura', ''), reverse=(ordenar_direcao == 'desc'))
-        
-        # Calcular estatísticas do relatório filtrado
-        total_valor = sum(m['valor'] for m in manutencoes_filtradas)
-        total_abertas = sum(1 for m in manutencoes_filtradas if not m['finalizada'])
-        total_finalizadas = sum(1 for m in manutencoes_filtradas if m['finalizada'])
+        pagina = request.args.get('pagina', type=int)
+        por_pagina = max(1, min(request.args.get('por_pagina', 100, type=int), 500)) if pagina else None
+
+        manutencoes_filtradas, estatisticas, total_linhas = obter_relatorio_manutencoes(
+            identificacao=filtro_identificacao, status=filtro_status, tipo=filtro_tipo, frota=filtro_frota,
+            pagamento=filtro_pagamento, data_inicio=data_inicio, data_fim=data_fim,
+            ordenar_por=ordenar_por, ordenar_direcao=ordenar_direcao, pagina=pagina, por_pagina=por_pagina
+        )
         
         return jsonify({
             'success': True,
             'manutencoes': manutencoes_filtradas,
-            'estatisticas': {
-                'total': len(manutencoes_filtradas),
-                'abertas': total_abertas,
-                'finalizadas': total_finalizadas,
-                'valor_total': total_valor
+            'estatisticas': estatisticas,
+            'paginacao': {
+                'pagina': pagina or 1,
+                'por_pagina': por_pagina or total_linhas,
+                'total_paginas': (-(-total_linhas // por_pagina) if por_pagina else 1)
             },
             'filtros_aplicados': {
                 'identificacao': filtro_identificacao,
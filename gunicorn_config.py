@@ -0,0 +1,49 @@
+# gunicorn_config.py
+# Uso: gunicorn -c gunicorn_config.py
+# Variáveis de ambiente opcionais: GUNICORN_BIND, GUNICORN_WORKERS, GUNICORN_THREADS, GUNICORN_TIMEOUT
+
+import os
+
+import analitico
+import database
+import jobs
+
+wsgi_app = 'app:create_app()'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5005')
+
+# Carrega a aplicação uma vez no master; os workers herdam o código já importado (pandas, numpy...)
+preload_app = True
+
+# SQLite aceita um escritor por vez: poucos processos (um por núcleo, no máximo 8) e threads
+# para sobrepor a espera de I/O. Threads por worker não passam do tamanho do pool de conexões.
+_nucleos = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+workers = int(os.environ.get('GUNICORN_WORKERS', min(_nucleos + 1, 8)))
+worker_class = 'gthread'
+threads = min(int(os.environ.get('GUNICORN_THREADS', 4)), database.POOL_MAX_CONEXOES)
+
+# Exportações e importações de planilhas podem demorar; reciclar workers contém o crescimento de memória
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+max_requests = 2000
+max_requests_jitter = 200
+
+accesslog = '-'
+errorlog = '-'
+
+
+def on_starting(server):
+    """
+    Roda uma única vez, no master, antes do fork: cria o esquema, aplica as migrações pendentes,
+    encerra jobs que ficaram órfãos com a parada anterior, apaga os jobs expirados e poda o log já
+    consumido pelo snapshot.
+    """
+    database.criar_tabelas()
+    database.marcar_jobs_interrompidos()
+    jobs.limpar_jobs_expirados()
+    analitico.podar_alteracoes()
+
+
+def post_fork(server, worker):
+    """Cada worker abre as próprias conexões SQLite (nada de conexão herdada através do fork)."""
+    database.reiniciar_pool()
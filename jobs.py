@@ -0,0 +1,209 @@
+# jobs.py
+
+"""
+Tarefas pesadas em segundo plano: um pool de threads por processo executa o job e o estado
+(status, progresso, arquivo de resultado) fica na tabela jobs, visível para todos os workers.
+Jobs encerrados há mais de JOBS_RETENCAO_DIAS são apagados, com o arquivo, por limpar_jobs_expirados.
+
+Os módulos registram seus tipos com @tipo_job('nome', roles=[...]). A função recebe
+(parametros, progresso) e devolve (conteudo, mimetype, nome_arquivo), onde conteudo é
+str/bytes ou um iterável deles (os geradores de exportação servem direto).
+"""
+
+from flask import Blueprint, request, jsonify, session, g, url_for, send_file
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from werkzeug.utils import secure_filename
+import json
+import os
+import threading
+import time
+
+from database import (criar_job, atualizar_job, obter_job, obter_jobs_usuario, excluir_jobs_expirados,
+                      JOBS_RETENCAO_DIAS)
+from utils import login_required
+
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/api/jobs')
+
+JOBS_MAX_THREADS = 2  # por processo; o SQLite só aceita um escritor por vez de qualquer forma
+PASTA_RESULTADOS = os.path.join(os.getcwd(), 'resultados_jobs')
+JOBS_LIMPEZA_INTERVALO = 3600  # segundos entre limpezas de jobs expirados disparadas pelo mesmo processo
+
+TIPOS_JOB = {}
+
+_executor = None
+_executor_lock = threading.Lock()
+_ultima_limpeza = None
+
+
+def tipo_job(nome, roles=None):
+    """Registra uma função como tipo de job. roles=None libera para qualquer usuário logado."""
+    def registrar(funcao):
+        TIPOS_JOB[nome] = (funcao, roles)
+        return funcao
+    return registrar
+
+
+def resultado_json(dados, nome='resultado.json'):
+    """Formata o retorno de jobs cujo resultado é um objeto JSON."""
+    return json.dumps(dados, ensure_ascii=False, default=str), 'application/json', nome
+
+
+def _obter_executor():
+    # Criado sob demanda: com preload_app do gunicorn o módulo é importado no master, e threads não sobrevivem ao fork
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=JOBS_MAX_THREADS, thread_name_prefix='job')
+        return _executor
+
+
+def _agora():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _executar_job(job_id, funcao, parametros):
+    atualizar_job(job_id, status='Executando', data_inicio=_agora())
+
+    def progresso(fracao, mensagem=None):
+        campos = {'progresso': max(0.0, min(float(fracao), 1.0))}
+        if mensagem is not None:
+            campos['mensagem'] = mensagem
+        atualizar_job(job_id, **campos)
+
+    caminho = None
+    try:
+        conteudo, mimetype, nome = funcao(parametros, progresso)
+        os.makedirs(PASTA_RESULTADOS, exist_ok=True)
+        caminho = os.path.join(PASTA_RESULTADOS, f"job_{job_id}_{secure_filename(nome)}")
+        with open(caminho, 'wb') as arquivo:
+            for bloco in ([conteudo] if isinstance(conteudo, (str, bytes)) else conteudo):
+                arquivo.write(bloco.encode('utf-8') if isinstance(bloco, str) else bloco)
+        atualizar_job(job_id, status='Concluido', progresso=1.0, data_fim=_agora(), resultado_caminho=caminho,
+                      resultado_mimetype=mimetype, resultado_nome=nome)
+    except Exception as e:
+        print(f"Erro no job {job_id}: {e}")
+        if caminho and os.path.exists(caminho):
+            os.remove(caminho)
+        atualizar_job(job_id, status='Erro', mensagem=str(e), data_fim=_agora())
+
+
+def limpar_jobs_expirados(dias=JOBS_RETENCAO_DIAS):
+    """
+    Apaga os jobs encerrados há mais de `dias` dias e os arquivos de resultado deles, além de arquivos
+    órfãos de resultados_jobs/ (sem job, de um erro no meio da gravação) mais antigos que isso.
+    Retorna quantos arquivos foram removidos.
+    """
+    caminhos = set(excluir_jobs_expirados(dias))
+    if os.path.isdir(PASTA_RESULTADOS):
+        limite = (datetime.now() - timedelta(days=dias)).timestamp()
+        for nome in os.listdir(PASTA_RESULTADOS):
+            caminho = os.path.join(PASTA_RESULTADOS, nome)
+            if nome.startswith('job_') and os.path.getmtime(caminho) < limite:
+                caminhos.add(caminho)
+    removidos = 0
+    for caminho in caminhos:
+        try:
+            os.remove(caminho)
+            removidos += 1
+        except FileNotFoundError:
+            pass
+    return removidos
+
+
+def _executar_limpeza():
+    try:
+        limpar_jobs_expirados()
+    except Exception as e:
+        print(f"Erro ao limpar jobs expirados: {e}")
+
+
+def _agendar_limpeza():
+    """No máximo uma limpeza por JOBS_LIMPEZA_INTERVALO em cada processo, no pool dos jobs."""
+    global _ultima_limpeza
+    agora = time.monotonic()
+    with _executor_lock:
+        if _ultima_limpeza is not None and agora - _ultima_limpeza < JOBS_LIMPEZA_INTERVALO:
+            return
+        _ultima_limpeza = agora
+    _obter_executor().submit(_executar_limpeza)
+
+
+def pode_submeter(tipo, user):
+    if tipo not in TIPOS_JOB or user is None:
+        return False
+    roles = TIPOS_JOB[tipo][1]
+    return roles is None or user['role'] in roles or user['role'] == 'Administrador'
+
+
+def submeter_job(tipo, parametros, user_id):
+    """Registra o job e o agenda no pool; retorna o id imediatamente."""
+    funcao = TIPOS_JOB[tipo][0]
+    job_id = criar_job(tipo, json.dumps(parametros, ensure_ascii=False), user_id)
+    _obter_executor().submit(_executar_job, job_id, funcao, parametros)
+    _agendar_limpeza()
+    return job_id
+
+
+def resposta_job(job_id):
+    """Resposta 202 padrão para endpoints que delegam o trabalho a um job."""
+    return jsonify({'success': True, 'job_id': job_id,
+                    'status_url': url_for('jobs.api_job', job_id=job_id),
+                    'resultado_url': url_for('jobs.api_job_resultado', job_id=job_id)}), 202
+
+
+def _job_publico(job):
+    dados = {coluna: job[coluna] for coluna in ('id', 'tipo', 'status', 'progresso', 'mensagem',
+                                                  'data_criacao', 'data_inicio', 'data_fim')}
+    dados['parametros'] = json.loads(job['parametros'] or '{}')
+    if job['status'] == 'Concluido':
+        dados['resultado_url'] = url_for('jobs.api_job_resultado', job_id=job['id'])
+    return dados
+
+
+def _job_do_usuario(job_id):
+    job = obter_job(job_id)
+    if job and (job['user_id'] == session.get('user_id') or g.user['role'] == 'Administrador'):
+        return job
+    return None
+
+
+# --- APIs de Jobs ---
+
+@jobs_bp.route('', methods=['GET', 'POST'])
+@login_required
+def api_jobs():
+    if request.method == 'GET':
+        return jsonify({'success': True, 'jobs': [_job_publico(job) for job in obter_jobs_usuario(session['user_id'])]})
+
+    dados = request.get_json(silent=True) or {}
+    tipo = dados.get('tipo')
+    if tipo not in TIPOS_JOB:
+        return jsonify({'success': False, 'error': f'Tipo de job inválido. Use: {", ".join(sorted(TIPOS_JOB))}.'}), 400
+    if not pode_submeter(tipo, g.user):
+        return jsonify({'success': False, 'error': 'Acesso negado para este tipo de job.'}), 403
+    return resposta_job(submeter_job(tipo, dados.get('parametros') or {}, session['user_id']))
+
+
+@jobs_bp.route('/<int:job_id>', methods=['GET'])
+@login_required
+def api_job(job_id):
+    job = _job_do_usuario(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Job não encontrado.'}), 404
+    return jsonify({'success': True, 'job': _job_publico(job)})
+
+
+@jobs_bp.route('/<int:job_id>/resultado', methods=['GET'])
+@login_required
+def api_job_resultado(job_id):
+    job = _job_do_usuario(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Job não encontrado.'}), 404
+    if job['status'] != 'Concluido':
+        return jsonify({'success': False, 'error': f"Job ainda não concluído (status: {job['status']}).",
+                        'job': _job_publico(job)}), 409
+    if not job['resultado_caminho'] or not os.path.exists(job['resultado_caminho']):
+        return jsonify({'success': False, 'error': 'Arquivo de resultado não está mais disponível.'}), 410
+    return send_file(job['resultado_caminho'], mimetype=job['resultado_mimetype'],
+                     as_attachment=True, download_name=job['resultado_nome'])
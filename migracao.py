@@ -1,4 +1,160 @@
+import inspect
+import io
+import os
+import re
+import shutil
 import sqlite3
+import sys
+import tempfile
+import database
+from database import DB_PATH, criar_tabelas, reconstruir_tabelas_derivadas, reconstruir_resumos
+
+# Tabelas que crescem com o uso: um SCAN completo nelas é tratado como regressão
+TABELAS_GRANDES = {'abastecimentos', 'pedagios', 'manutencoes', 'checklists',
+                   'cotacao_itens', 'orcamentos', 'pedido_itens', 'pedidos_compra'}
+
+# Funções seletivas de database.py, chamadas com parâmetros de exemplo. O SQL verificado é o que elas
+# executam de fato (capturado por database.RASTREAR_SQL), não uma cópia das consultas.
+REGISTRO_EXEMPLO = {
+    'data': '2025-01-15', 'placa': 'ABC1234', 'responsavel': 'VERIFICACAO', 'litros': 50, 'desconto': 0,
+    'odometro': 100000, 'centro_custo': 'CC01', 'combustivel': 'DIESEL S10', 'custo_por_litro': 6,
+    'custo_bruto': 300, 'custo_liquido': 300, 'posto': 'POSTO',
+}
+MANUTENCAO_EXEMPLO = {
+    'identificacao': 'MAQ01', 'tipo': 'Preventiva', 'frota': 'Leve', 'descricao': 'VERIFICACAO', 'fornecedor': 'OFICINA',
+    'valor': 100, 'data_abertura': '2025-01-15', 'previsao_conclusao': '', 'data_conclusao': '', 'finalizada': 0,
+    'forma_pagamento': 'Pix', 'parcelas': 1, 'observacoes': '', 'prazo_liberacao': '',
+}
+CHECKLIST_EXEMPLO = {'identificacao': 'MAQ01', 'data': '2025-01-15', 'horimetro': 100, 'nivel_oleo': 'ADEQUADO',
+                     'observacoes': '', 'itens_checklist': ''}
+REQUISICAO_EXEMPLO = {'data_solicitacao': '2025-01-15', 'solicitado_por_id': 1, 'placa': 'ABC1234', 'combustivel': 'DIESEL S10',
+                      'quantidade_estimada': 50, 'motorista': 'VERIFICACAO', 'centro_custo': 'CC01'}
+PEDAGIO_EXEMPLO = {'data': '2025-01-15', 'placa': 'ABC1234', 'valor': 10, 'observacoes': ''}
+ARQUIVO_IMPORTACAO = b"data;placa;combustivel;litros;custo_por_litro;odometro\n2025-01-16;ABC1234;DIESEL S10;40;6;100500\n"
+
+CONSULTAS_MONITORADAS = [
+    # Abastecimentos
+    ('obter_relatorio', lambda: database.obter_relatorio('2025-01-01', '2025-01-31')),
+    ('obter_relatorio (placa)', lambda: database.obter_relatorio('2025-01-01', '2025-01-31', placa='ABC1234')),
+    ('obter_relatorio_pagina', lambda: database.obter_relatorio_pagina(
+        {'data_inicio': '2025-01-01', 'data_fim': '2025-01-31'}, cursor_data='2025-01-20', cursor_id=100)),
+    ('criar_registro', lambda: database.criar_registro(dict(REGISTRO_EXEMPLO))),
+    ('obter_registro_por_id', lambda: database.obter_registro_por_id(1)),
+    ('atualizar_registro', lambda: database.atualizar_registro(1, dict(REGISTRO_EXEMPLO))),
+    ('excluir_registro', lambda: database.excluir_registro(2)),
+    ('importar_abastecimentos', lambda: database.importar_abastecimentos(io.BytesIO(ARQUIVO_IMPORTACAO), 'verificacao.csv')),
+    ('obter_opcoes_filtro', lambda: database.obter_opcoes_filtro('centro_custo')),
+    ('obter_placas_veiculos', lambda: database.obter_placas_veiculos()),
+    ('obter_ultima_leitura', lambda: database.obter_ultima_leitura('ABC1234', 'veiculo')),
+    ('calcular_medias_veiculos', lambda: database.calcular_medias_veiculos()),
+    ('resumir', lambda: database.resumir('abastecimentos', '2025-01-01', '2025-03-31', {'placa': 'ABC1234'}, ['placa'])),
+    ('consultar_listagem', lambda: database.consultar_listagem('abastecimentos', 0, 25, filtros={'placa': 'ABC1234'})),
+    ('consultar_listagem (cursor)', lambda: database.consultar_listagem(
+        'abastecimentos', 0, 25, ordenacao=[('data', 'desc')], cursor=['2025-01-20', 100])),
+    ('consultar_listagem (manutenções)', lambda: database.consultar_listagem(
+        'manutencoes', 0, 25, filtros={'identificacao': 'MAQ'}, busca='OFI')),
+    # Pedágios
+    ('criar_pedagio', lambda: database.criar_pedagio(dict(PEDAGIO_EXEMPLO))),
+    ('obter_pedagios_com_filtros', lambda: database.obter_pedagios_com_filtros('2025-01-01', '2025-01-31', 'ABC1234')),
+    ('obter_pedagio_por_id', lambda: database.obter_pedagio_por_id(1)),
+    ('atualizar_pedagio', lambda: database.atualizar_pedagio(1, dict(PEDAGIO_EXEMPLO))),
+    ('excluir_pedagio', lambda: database.excluir_pedagio(2)),
+    # Manutenções, checklists e trocas de óleo
+    ('criar_manutencao', lambda: database.criar_manutencao(dict(MANUTENCAO_EXEMPLO))),
+    ('obter_manutencao_por_id', lambda: database.obter_manutencao_por_id(1)),
+    ('atualizar_manutencao', lambda: database.atualizar_manutencao(1, dict(MANUTENCAO_EXEMPLO))),
+    ('excluir_manutencao', lambda: database.excluir_manutencao(2)),
+    ('obter_relatorio_manutencoes', lambda: database.obter_relatorio_manutencoes(
+        identificacao='MAQ', status='aberto', data_inicio='2025-01-01', data_fim='2025-03-31', pagina=2, por_pagina=50)),
+    ('contar_manutencoes_proximas_liberacao', lambda: database.contar_manutencoes_proximas_liberacao()),
+    ('criar_checklist', lambda: database.criar_checklist(dict(CHECKLIST_EXEMPLO))),
+    ('obter_checklist_por_id', lambda: database.obter_checklist_por_id(1)),
+    ('atualizar_checklist', lambda: database.atualizar_checklist(1, dict(CHECKLIST_EXEMPLO))),
+    ('excluir_checklist', lambda: database.excluir_checklist(2)),
+    ('obter_checklists_por_identificacao', lambda: database.obter_checklists_por_identificacao('MAQ01')),
+    ('salvar_troca_oleo', lambda: database.salvar_troca_oleo('ABC1234', 'veiculo', '2025-01-15', km_troca=100000)),
+    ('atualizar_troca_oleo', lambda: database.atualizar_troca_oleo('ABC1234', 'veiculo', '2025-01-16', km_troca=100100)),
+    ('obter_troca_oleo_por_identificacao_tipo', lambda: database.obter_troca_oleo_por_identificacao_tipo('ABC1234', 'veiculo')),
+    ('obter_trocas_oleo', lambda: database.obter_trocas_oleo()),
+    ('obter_identificacoes_equipamentos', lambda: database.obter_identificacoes_equipamentos()),
+    ('excluir_troca_oleo', lambda: database.excluir_troca_oleo('ABC1234', 'veiculo')),
+    # Requisições
+    ('criar_requisicao', lambda: database.criar_requisicao(dict(REQUISICAO_EXEMPLO))),
+    ('obter_requisicao_por_id', lambda: database.obter_requisicao_por_id(1)),
+    ('atualizar_requisicao', lambda: database.atualizar_requisicao(1, dict(REQUISICAO_EXEMPLO))),
+    ('concluir_requisicao', lambda: database.concluir_requisicao(1, 1)),
+    ('excluir_requisicao', lambda: database.excluir_requisicao(2)),
+    # Compras
+    ('criar_cotacao_com_itens', lambda: database.criar_cotacao_com_itens(1, {
+        'titulo': 'VERIFICACAO', 'data_limite': '2025-02-01', 'observacoes': '',
+        'itens': [{'descricao': 'Filtro', 'quantidade': 2}]})),
+    ('obter_cotacoes', lambda: database.obter_cotacoes()),
+    ('obter_cotacao_por_id', lambda: database.obter_cotacao_por_id(1)),
+    ('obter_itens_por_cotacao_id', lambda: database.obter_itens_por_cotacao_id(1)),
+    ('adicionar_orcamento', lambda: database.adicionar_orcamento(
+        {'cotacao_id': 1, 'fornecedor_id': 1, 'valor': 100, 'prazo_pagamento': '30', 'faturamento': ''})),
+    ('obter_orcamentos_por_cotacao_id', lambda: database.obter_orcamentos_por_cotacao_id(1)),
+    ('aprovar_orcamento', lambda: database.aprovar_orcamento(1, 1)),
+    ('obter_pedidos_compra', lambda: database.obter_pedidos_compra()),
+    ('obter_pedido_compra_por_id', lambda: database.obter_pedido_compra_por_id(1)),
+    ('obter_itens_por_pedido_id', lambda: database.obter_itens_por_pedido_id(1)),
+    ('finalizar_pedido_compra', lambda: database.finalizar_pedido_compra(1, {'nf_e_chave': '1', 'nfs_pdf_path': ''})),
+    ('obter_cotacoes_com_filtros', lambda: database.obter_cotacoes_com_filtros('2025-01-01', '2025-03-31', pesquisa='filtro 12')),
+    ('obter_pedidos_compra_com_filtros', lambda: database.obter_pedidos_compra_com_filtros(pesquisa='12')),
+    ('obter_dealer_intelligence', lambda: database.obter_dealer_intelligence('2025-01-01', '2025-03-31')),
+    ('criar_fornecedor', lambda: database.criar_fornecedor(
+        {'cnpj': '00000000000191', 'nome': 'VERIFICACAO', 'tipo': 'Peças', 'ie': '', 'contato': '', 'endereco': ''})),
+    ('obter_fornecedores', lambda: database.obter_fornecedores()),
+    ('obter_precos_combustivel', lambda: database.obter_precos_combustivel()),
+    ('criar_combustivel', lambda: database.criar_combustivel('VERIFICACAO', 6)),
+    ('atualizar_preco_combustivel', lambda: database.atualizar_preco_combustivel('VERIFICACAO', 6.5)),
+    ('buscar_texto', lambda: database.buscar_texto('filtro oleo')),
+    # Usuários, Notion e jobs
+    ('get_user_by_username', lambda: database.get_user_by_username('admin')),
+    ('get_user_by_id', lambda: database.get_user_by_id(1)),
+    ('create_user', lambda: database.create_user('verificacao', 'x', 'Padrão')),
+    ('update_user', lambda: database.update_user(1, 'verificacao_1', 'Administrador')),
+    ('delete_user', lambda: database.delete_user(999999)),
+    ('create_notion_page', lambda: database.create_notion_page(1, 'frota', 'VERIFICACAO', '')),
+    ('get_notion_pages_by_category', lambda: database.get_notion_pages_by_category('frota')),
+    ('get_notion_pages_by_category (busca)', lambda: database.get_notion_pages_by_category('frota', 'verif')),
+    ('get_notion_page_by_id', lambda: database.get_notion_page_by_id(1)),
+    ('update_notion_page', lambda: database.update_notion_page(1, 'VERIFICACAO', '', 'Aberto')),
+    ('transfer_notion_page', lambda: database.transfer_notion_page(1, 'historico', 'Concluído')),
+    ('delete_notion_page', lambda: database.delete_notion_page(999999)),
+    ('criar_job', lambda: database.criar_job('verificacao', '{}', 1)),
+    ('atualizar_job', lambda: database.atualizar_job(1, status='Executando')),
+    ('obter_job', lambda: database.obter_job(1)),
+    ('obter_jobs_usuario', lambda: database.obter_jobs_usuario(1)),
+    ('marcar_jobs_interrompidos', lambda: database.marcar_jobs_interrompidos()),
+    ('excluir_jobs_expirados', lambda: database.excluir_jobs_expirados()),
+    ('obter_versoes_tabelas', lambda: database.obter_versoes_tabelas('abastecimentos', 'manutencoes')),
+    ('obter_estado_tabelas', lambda: database.obter_estado_tabelas('abastecimentos')),
+]
+
+# Funções de database.py com SQL que ficam de fora, e por quê. funcoes_com_sql() lista as que abrem conexão;
+# cada uma precisa estar em CONSULTAS_MONITORADAS ou aqui (tests/test_planos_consulta.py confere).
+FUNCOES_NAO_MONITORADAS = {
+    'abrir_conexao_avulsa': 'só abre a conexão',
+    'get_db_connection': 'só abre a conexão',
+    'criar_tabelas': 'esquema e migrações, uma vez por instalação',
+    'aplicar_migracoes': 'esquema e migrações, uma vez por instalação',
+    'reconstruir_resumos': 'reconstrução completa: lê a tabela inteira por definição',
+    'reconstruir_tabelas_derivadas': 'reconstrução completa: lê a tabela inteira por definição',
+    'recalcular_consumo_frota': 'reconstrução completa: lê a tabela inteira por definição',
+    'iterar_consulta': 'executa o SQL recebido do chamador (exportações)',
+    'obter_manutencoes': 'devolve a tabela inteira (API antiga); a tela usa consultar_listagem',
+    'obter_checklists': 'devolve a tabela inteira (API antiga); a tela usa consultar_listagem',
+    'obter_todas_requisicoes': 'devolve a tabela inteira (API antiga); a tela usa consultar_listagem',
+    'get_all_users': 'tabela pequena, inteira, na tela de usuários',
+}
+
+INSTRUCOES_VERIFICADAS = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+# Instruções cuja varredura é inevitável e aceita: o COUNT(*) sem filtro de uma tabela (o recordsTotal das
+# listagens) não tem como ser respondido pelo SQLite sem percorrer o menor índice, e _contar_listagem o
+# memoriza pela versão da tabela, então ele roda uma vez por alteração e não a cada página.
+INSTRUCOES_ACEITAS = re.compile(r'^\s*SELECT COUNT\(\*\) FROM \w+\s*$', re.IGNORECASE)
 
 def adicionar_coluna_se_nao_existir(cursor, tabela, coluna, tipo):
     """Função auxiliar para adicionar uma coluna a uma tabela se ela não existir."""
@@ -17,7 +173,7 @@ def migrar_base_de_dados():
     Este script verifica e adiciona todas as colunas necessárias às tabelas existentes.
     É seguro executar este script várias vezes.
     """
-    db_file = 'abastecimentos.db'
+    db_file = DB_PATH
     print(f"A iniciar a migração da base de dados: {db_file}")
 
     try:
@@ -50,6 +206,9 @@ def migrar_base_de_dados():
 
         conn.commit()
         conn.close()
+
+        # Garante as tabelas novas e aplica as migrações versionadas (índices etc.)
+        criar_tabelas()
         
         print("\nMigração concluída com sucesso!")
         print("A sua base de dados foi atualizada e todos os seus dados foram preservados.")
@@ -57,5 +216,87 @@ def migrar_base_de_dados():
     except Exception as e:
         print(f"\nOcorreu um erro durante a migração: {e}")
 
+def funcoes_com_sql():
+    """Nomes das funções públicas de database.py que abrem conexão com o banco."""
+    return sorted(
+        nome for nome, funcao in inspect.getmembers(database, inspect.isfunction)
+        if not nome.startswith('_') and funcao.__module__ == database.__name__
+        and any(chamada in inspect.getsource(funcao)
+                for chamada in ('get_db_connection()', 'abrir_conexao_avulsa()', '_abrir_conexao()'))
+    )
+
+def _copiar_banco(origem, destino):
+    with sqlite3.connect(origem) as fonte, sqlite3.connect(destino) as copia:
+        fonte.backup(copia)
+
+def verificar_planos_consulta(db_file=DB_PATH):
+    """
+    Executa as funções monitoradas numa cópia migrada do banco (algumas gravam), roda EXPLAIN QUERY PLAN em
+    cada instrução que elas enviaram ao SQLite e aponta qualquer SCAN de uma tabela grande, inclusive
+    a varredura completa de um índice (SCAN ... USING INDEX). Retorna a lista de regressões encontradas.
+    """
+    diretorio = tempfile.mkdtemp(prefix='verificar_planos_')
+    copia = os.path.join(diretorio, 'banco.db')
+    caminho_original = database.DB_PATH
+    regressoes = []
+    try:
+        _copiar_banco(db_file, copia)
+        database.DB_PATH = copia
+        criar_tabelas()  # índices e tabelas derivadas das migrações, como no banco em produção
+        conn = sqlite3.connect(copia)
+        for nome, funcao in CONSULTAS_MONITORADAS:
+            instrucoes = []
+            database.RASTREAR_SQL = instrucoes.append
+            try:
+                funcao()
+            except Exception as e:
+                regressoes.append((nome, f'erro ao executar: {e}'))
+            finally:
+                database.RASTREAR_SQL = None
+            for sql in dict.fromkeys(instrucoes):
+                if not sql.lstrip().upper().startswith(INSTRUCOES_VERIFICADAS) or INSTRUCOES_ACEITAS.match(sql):
+                    continue
+                for linha in conn.execute(f"EXPLAIN QUERY PLAN {sql}"):
+                    partes = linha[3].split()
+                    if len(partes) >= 2 and partes[0] == 'SCAN' and partes[1] in TABELAS_GRANDES:
+                        regressoes.append((nome, linha[3]))
+        conn.close()
+    finally:
+        database.DB_PATH = caminho_original
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+    for nome, detalhe in regressoes:
+        print(f"REGRESSÃO: {nome}: {detalhe}")
+    if not regressoes:
+        print(f"OK: {len(CONSULTAS_MONITORADAS)} funções verificadas, nenhum SCAN em tabelas grandes.")
+    return regressoes
+
 if __name__ == "__main__":
-    migrar_base_de_dados()
\ No newline at end of file
+    if '--verificar-planos' in sys.argv:
+        sys.exit(1 if verificar_planos_consulta() else 0)
+    if '--reconstruir-estatisticas' in sys.argv:
+        sys.exit(0 if reconstruir_tabelas_derivadas() else 1)
+    if '--reconstruir-resumos' in sys.argv:
+        criar_tabelas()
+        sys.exit(0 if reconstruir_resumos() else 1)
+    if '--reconstruir-snapshot' in sys.argv:
+        from analitico import reconstruir_snapshot
+        criar_tabelas()
+        sys.exit(0 if reconstruir_snapshot() else 1)
+    if '--podar-alteracoes' in sys.argv:
+        from analitico import podar_alteracoes
+        criar_tabelas()
+        print(f"Log do snapshot: {podar_alteracoes()} linha(s) já consumida(s) apagada(s).")
+        sys.exit(0)
+    if '--limpar-jobs' in sys.argv:
+        from jobs import limpar_jobs_expirados
+        criar_tabelas()
+        print(f"Jobs expirados: {limpar_jobs_expirados()} arquivo(s) de resultado removido(s).")
+        sys.exit(0)
+    if '--varrer-qualidade' in sys.argv:
+        from qualidade import varrer_abastecimentos
+        criar_tabelas()
+        resumo = varrer_abastecimentos(incremental='--incremental' in sys.argv)
+        print(f"Varredura de qualidade: {resumo}" if resumo else "Nenhum abastecimento novo desde a última varredura.")
+        sys.exit(0)
+    migrar_base_de_dados()
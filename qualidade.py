@@ -0,0 +1,367 @@
+# qualidade.py
+
+"""
+Varredura de qualidade dos abastecimentos: odômetro, litros e km por litro de toda a frota.
+
+O histórico é ordenado uma única vez por (placa, data, id) e as regras são avaliadas em vetores
+NumPy, sem laço por veículo:
+
+  odometro_retrocesso  odômetro menor que o da leitura anterior da mesma placa
+  salto_odometro       mais de KM_MAX_POR_DIA km por dia desde a leitura anterior
+  litros_invalidos     litros zerados ou negativos
+  acima_capacidade     litros acima da capacidade estimada do tanque (não há capacidade no
+                       cadastro: usa-se o percentil QUANTIL_CAPACIDADE dos abastecimentos da própria
+                       placa vezes FATOR_CAPACIDADE_TANQUE, limitado a LITROS_MAX_ABASTECIMENTO)
+  consumo_atipico      km/l com escore robusto |0,6745 * (x - mediana) / MAD| acima de LIMITE_ESCORE,
+                       com mediana e MAD das JANELA_CONSUMO leituras anteriores da mesma placa
+
+O km/l segue a mesma definição de database.py: km desde a leitura anterior com odômetro da placa
+dividido pelos litros do abastecimento atual. Trechos com retrocesso ou salto não entram no km/l.
+
+A varredura completa lê o snapshot colunar (analitico.py) e substitui todas as inconsistências.
+A incremental relê do banco só o histórico das placas com abastecimentos novos (id acima do
+último varrido) e substitui as inconsistências dessas placas. Alterações e exclusões de
+abastecimentos antigos entram na incremental pelas placas informadas em `placas`
+(agendar_varredura_incremental, chamada depois de cada gravação); as inconsistências de
+abastecimentos excluídos são descartadas já na incremental.
+"""
+
+import json
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import database
+from analitico import obter_snapshot
+
+KM_MAX_POR_DIA = 1500
+LITROS_MAX_ABASTECIMENTO = 1500.0
+QUANTIL_CAPACIDADE = 0.95
+FATOR_CAPACIDADE_TANQUE = 1.2
+JANELA_CONSUMO = 12
+HISTORICO_MINIMO = 5  # leituras da placa antes de avaliar capacidade e consumo
+LIMITE_ESCORE = 3.5
+MAD_MINIMO_RELATIVO = 0.05  # piso do MAD em fração da mediana (placas de consumo muito constante)
+LOTE_JANELAS = 200000
+
+REGRAS = {
+    'odometro_retrocesso': 'Odômetro menor que o do abastecimento anterior',
+    'salto_odometro': f'Mais de {KM_MAX_POR_DIA} km por dia desde o abastecimento anterior',
+    'litros_invalidos': 'Litros zerados ou negativos',
+    'acima_capacidade': 'Litros acima da capacidade estimada do tanque',
+    'consumo_atipico': 'km/l fora da faixa habitual do veículo',
+}
+
+_lock = threading.RLock()  # reentrante: _executar_agendada segura enquanto chama varrer_abastecimentos
+_agendamento_lock = threading.Lock()
+_placas_agendadas = None  # None: nenhuma incremental na fila; conjunto: placas a reavaliar na próxima
+
+
+# --- Detecção ---
+
+def _mediana_linhas(blocos, contagem):
+    """Mediana de cada linha ignorando NaN (que a ordenação deixa no fim); NaN para linhas vazias."""
+    ordenados = np.sort(blocos, axis=1)
+    linhas = np.arange(len(blocos))
+    baixo = np.maximum(contagem - 1, 0) // 2
+    mediana = (ordenados[linhas, baixo] + ordenados[linhas, contagem // 2]) / 2
+    return np.where(contagem > 0, mediana, np.nan)
+
+
+def _mediana_mad_moveis(valores, grupos):
+    """
+    Mediana, MAD e tamanho da janela das JANELA_CONSUMO posições anteriores do mesmo grupo,
+    para cada posição (o próprio valor fica de fora). Os grupos precisam estar contíguos.
+    """
+    n = len(valores)
+    mediana = np.full(n, np.nan)
+    mad = np.full(n, np.nan)
+    contagem = np.zeros(n, dtype=np.int64)
+    if n == 0:
+        return mediana, mad, contagem
+    # Com JANELA_CONSUMO posições de preenchimento, a janela i cobre exatamente valores[i - J:i]
+    grupos = grupos.astype(np.int64)
+    preenchidos = np.concatenate([np.full(JANELA_CONSUMO, np.nan), valores])
+    grupos_preenchidos = np.concatenate([np.full(JANELA_CONSUMO, -1, dtype=np.int64), grupos])
+    janelas = np.lib.stride_tricks.sliding_window_view(preenchidos, JANELA_CONSUMO)[:n]
+    janelas_grupo = np.lib.stride_tricks.sliding_window_view(grupos_preenchidos, JANELA_CONSUMO)[:n]
+    for inicio in range(0, n, LOTE_JANELAS):
+        fim = min(inicio + LOTE_JANELAS, n)
+        bloco = np.where(janelas_grupo[inicio:fim] == grupos[inicio:fim, None], janelas[inicio:fim], np.nan)
+        contagem[inicio:fim] = (~np.isnan(bloco)).sum(axis=1)
+        mediana[inicio:fim] = _mediana_linhas(bloco, contagem[inicio:fim])
+        mad[inicio:fim] = _mediana_linhas(np.abs(bloco - mediana[inicio:fim, None]), contagem[inicio:fim])
+    return mediana, mad, contagem
+
+
+def _capacidade_estimada(placas, litros):
+    """Limite de litros por linha: percentil da própria placa (com histórico suficiente) vezes o fator."""
+    limite = np.full(len(litros), LITROS_MAX_ABASTECIMENTO)
+    validos = np.flatnonzero(litros > 0)
+    if not len(validos):
+        return limite
+    ordem = validos[np.lexsort((litros[validos], placas[validos]))]
+    placas_ordenadas = placas[ordem]
+    inicios = np.flatnonzero(np.r_[True, placas_ordenadas[1:] != placas_ordenadas[:-1]])
+    tamanhos = np.diff(np.r_[inicios, len(ordem)])
+    capacidade = litros[ordem[inicios + np.floor(QUANTIL_CAPACIDADE * (tamanhos - 1)).astype(np.int64)]]
+    capacidade = np.minimum(capacidade * FATOR_CAPACIDADE_TANQUE, LITROS_MAX_ABASTECIMENTO)
+
+    grupo = np.clip(np.searchsorted(placas_ordenadas[inicios], placas), 0, len(inicios) - 1)
+    aplicavel = (placas_ordenadas[inicios][grupo] == placas) & (tamanhos[grupo] >= HISTORICO_MINIMO)
+    limite[aplicavel] = capacidade[grupo[aplicavel]]
+    return limite
+
+
+def detectar(ids, placas, dias, odometros, litros):
+    """
+    Aplica as regras a um conjunto de abastecimentos (arrays alinhados; placas em códigos inteiros,
+    dias em int32 desde 1970, NULL = NaN). Retorna um DataFrame com uma linha por inconsistência:
+    indice (posição nos arrays de entrada), regra, valor, referencia e escore.
+    """
+    ordem = np.lexsort((ids, dias, placas))
+    placas = placas[ordem]
+    dias = dias[ordem].astype(np.int64)
+    odometros = np.asarray(odometros, dtype=np.float64)[ordem]
+    litros = np.asarray(litros, dtype=np.float64)[ordem]
+    achados = []
+
+    def registrar(regra, posicoes, valor, referencia, escore=None):
+        achados.append(pd.DataFrame({
+            'indice': ordem[posicoes], 'regra': regra, 'valor': valor, 'referencia': referencia,
+            'escore': np.nan if escore is None else escore,
+        }))
+
+    invalidos = np.flatnonzero(~(litros > 0) & ~np.isnan(litros))
+    registrar('litros_invalidos', invalidos, litros[invalidos], 0.0)
+    limite = _capacidade_estimada(placas, litros)
+    acima = np.flatnonzero(litros > limite)
+    registrar('acima_capacidade', acima, litros[acima], limite[acima])
+
+    # Pares (leitura anterior com odômetro, leitura atual) da mesma placa
+    com_odometro = np.flatnonzero(~np.isnan(odometros))
+    anterior, atual = com_odometro[:-1], com_odometro[1:]
+    mesma_placa = placas[atual] == placas[anterior]
+    delta = odometros[atual] - odometros[anterior]
+    maximo = KM_MAX_POR_DIA * np.maximum(dias[atual] - dias[anterior], 1)
+
+    retrocesso = mesma_placa & (delta < 0)
+    registrar('odometro_retrocesso', atual[retrocesso], odometros[atual[retrocesso]], odometros[anterior[retrocesso]])
+    salto = mesma_placa & (delta > maximo)
+    registrar('salto_odometro', atual[salto], delta[salto], maximo[salto])
+
+    consumo = mesma_placa & (delta > 0) & ~salto & (litros[atual] > 0)
+    posicoes = atual[consumo]
+    km_litro = delta[consumo] / litros[posicoes]
+    mediana, mad, contagem = _mediana_mad_moveis(km_litro, placas[posicoes])
+    escala = np.maximum(mad, MAD_MINIMO_RELATIVO * mediana)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        escore = 0.6745 * (km_litro - mediana) / escala
+    atipico = (contagem >= HISTORICO_MINIMO) & (np.abs(escore) > LIMITE_ESCORE)
+    registrar('consumo_atipico', posicoes[atipico], km_litro[atipico], mediana[atipico], escore[atipico])
+
+    return pd.concat(achados, ignore_index=True)
+
+
+# --- Leitura dos abastecimentos ---
+
+def _colunas_snapshot():
+    """Toda a tabela a partir do snapshot colunar: (colunas, nomes das placas, último id)."""
+    snapshot = obter_snapshot('abastecimentos')
+    colunas = {nome: np.asarray(snapshot.coluna(nome)) for nome in ('id', 'placa', 'dia', 'odometro', 'litros')}
+    ultimo_id = int(colunas['id'].max()) if len(colunas['id']) else 0
+    return colunas, np.array(snapshot.dicionarios['placa'], dtype=object), ultimo_id
+
+
+def _colunas_placas_novas(cursor, ultimo_id, placas=()):
+    """Histórico completo das placas com abastecimentos acima de ultimo_id (e das placas dadas), lido do banco."""
+    colunas = {'id': [], 'placa': [], 'dia': [], 'odometro': [], 'litros': []}
+    cursor.execute("""
+        SELECT id, placa, CAST(julianday(data) - 2440587.5 AS INTEGER), odometro, litros
+        FROM abastecimentos
+        WHERE placa IN (SELECT DISTINCT placa FROM abastecimentos WHERE id > ?
+                        UNION SELECT value FROM json_each(?))
+    """, (ultimo_id, json.dumps(sorted(placas), ensure_ascii=False)))
+    while True:
+        lote = cursor.fetchmany(100000)
+        if not lote:
+            break
+        for nome, valores in zip(colunas, zip(*lote)):
+            colunas[nome].extend(valores)
+    codigos, nomes = pd.factorize(pd.Series(colunas['placa'], dtype=object))
+    return {
+        'id': np.array(colunas['id'], dtype=np.int64),
+        'placa': codigos.astype(np.int32),
+        'dia': np.array([np.iinfo(np.int32).min if d is None else d for d in colunas['dia']], dtype=np.int32),
+        'odometro': np.array(colunas['odometro'], dtype=np.float64),
+        'litros': np.array(colunas['litros'], dtype=np.float64),
+    }, np.asarray(nomes, dtype=object)
+
+
+# --- Varredura ---
+
+def _ultimo_id_varrido(cursor):
+    return cursor.execute("SELECT MAX(ultimo_id) FROM varreduras_qualidade").fetchone()[0]
+
+
+def varrer_abastecimentos(incremental=False, placas=()):
+    """
+    Executa a varredura e grava as inconsistências. incremental=True só reavalia as placas com
+    abastecimentos novos e as de `placas` (alteradas ou excluídas); sem varredura anterior, faz a
+    completa. Retorna o resumo da execução, ou None quando a incremental não tinha o que reavaliar.
+    """
+    placas = {p for p in placas if p}
+    inicio = time.perf_counter()
+    with _lock:
+        conn = database.abrir_conexao_avulsa()
+        conn.row_factory = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN")  # transação de leitura: marca d'água e histórico do mesmo instante
+            ultimo_varrido = _ultimo_id_varrido(cursor)
+            if incremental and ultimo_varrido is not None:
+                ultimo_id = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM abastecimentos").fetchone()[0]
+                if ultimo_id <= ultimo_varrido and not placas:
+                    conn.rollback()
+                    return None
+                ultimo_id = max(ultimo_id, ultimo_varrido)
+                colunas, nomes_placas = _colunas_placas_novas(cursor, ultimo_varrido, placas)
+                modo = 'incremental'
+                conn.rollback()
+            else:
+                conn.rollback()
+                colunas, nomes_placas, ultimo_id = _colunas_snapshot()
+                modo = 'completa'
+
+            achados = detectar(colunas['id'], colunas['placa'], colunas['dia'], colunas['odometro'], colunas['litros'])
+            indices = achados['indice'].to_numpy()
+            dias = colunas['dia'][indices]
+            datas = np.where(dias == np.iinfo(np.int32).min, None,
+                             dias.astype('datetime64[D]').astype(str).astype(object))
+            registros = list(zip(
+                colunas['id'][indices].tolist(), nomes_placas[colunas['placa'][indices]].tolist(), datas.tolist(),
+                achados['regra'].tolist(),
+                *(achados[campo].astype(object).where(achados[campo].notna(), None).tolist()
+                  for campo in ('valor', 'referencia', 'escore')),
+            ))
+            placas_varridas = np.unique(colunas['placa'])
+
+            cursor.execute("BEGIN IMMEDIATE")
+            if modo == 'completa':
+                cursor.execute("DELETE FROM inconsistencias_abastecimentos")
+            else:
+                cursor.execute("DELETE FROM inconsistencias_abastecimentos WHERE placa IN (SELECT value FROM json_each(?))",
+                               (json.dumps(sorted(placas.union(nomes_placas[placas_varridas].tolist())),
+                                           ensure_ascii=False),))
+                cursor.execute("""
+                    DELETE FROM inconsistencias_abastecimentos
+                    WHERE NOT EXISTS (SELECT 1 FROM abastecimentos a WHERE a.id = abastecimento_id)
+                """)
+            cursor.executemany("""
+                INSERT OR REPLACE INTO inconsistencias_abastecimentos
+                    (abastecimento_id, placa, data, regra, valor, referencia, escore)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, registros)
+            duracao_ms = round((time.perf_counter() - inicio) * 1000, 1)
+            cursor.execute("""
+                INSERT INTO varreduras_qualidade (modo, ultimo_id, placas, linhas, inconsistencias, duracao_ms)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (modo, int(ultimo_id), len(placas_varridas), len(colunas['id']), len(registros), duracao_ms))
+            conn.commit()
+        finally:
+            conn.close()
+
+    return {
+        'modo': modo, 'ultimo_id': int(ultimo_id), 'placas': len(placas_varridas), 'linhas': len(colunas['id']),
+        'inconsistencias': len(registros), 'por_regra': achados['regra'].value_counts().to_dict(),
+        'duracao_ms': duracao_ms,
+    }
+
+
+def agendar_varredura_incremental(*placas):
+    """
+    Pede uma varredura incremental em segundo plano depois de gravar abastecimentos, passando as
+    placas de registros alterados ou excluídos (os novos são achados pelo id). Pedidos feitos
+    enquanto outra já está na fila juntam-se a ela: no máximo uma executando e uma aguardando.
+    Não cria job nem arquivo de resultado, e não faz nada antes da primeira varredura completa.
+    """
+    global _placas_agendadas
+    with _agendamento_lock:
+        na_fila = _placas_agendadas is not None
+        _placas_agendadas = (_placas_agendadas or set()) | {p for p in placas if p}
+        if na_fila:
+            return
+    threading.Thread(target=_executar_agendada, daemon=True).start()
+
+
+def _executar_agendada():
+    global _placas_agendadas
+    with _lock:  # espera a que estiver executando; o que chegar durante esta vai para a próxima
+        with _agendamento_lock:
+            placas, _placas_agendadas = _placas_agendadas, None
+        try:
+            if obter_ultima_varredura():
+                varrer_abastecimentos(incremental=True, placas=placas)
+        except Exception as e:
+            print(f"Erro na varredura incremental agendada: {e}")
+
+
+# --- Consulta ---
+
+def obter_inconsistencias(regra=None, placa=None, data_inicio=None, data_fim=None, pagina=1, por_pagina=100):
+    """
+    Inconsistências gravadas, com os dados atuais do abastecimento, da mais recente para a mais antiga.
+    Retorna (linhas, total, contagem por regra), a contagem com os mesmos filtros exceto a regra.
+    """
+    if regra and regra not in REGRAS:
+        raise ValueError(f'Regra inválida. Use: {", ".join(REGRAS)}.')
+    condicoes, params = [], []
+    if placa:
+        condicoes.append("i.placa = ?")
+        params.append(placa.strip().upper())
+    if data_inicio:
+        condicoes.append("i.data >= ?")
+        params.append(data_inicio)
+    if data_fim:
+        condicoes.append("i.data <= ?")
+        params.append(data_fim)
+    where = ("WHERE " + " AND ".join(condicoes)) if condicoes else ""
+    where_regra = (where + (" AND " if where else "WHERE ") + "i.regra = ?") if regra else where
+    params_regra = params + [regra] if regra else params
+
+    conn = database.get_db_connection()
+    try:
+        cursor = conn.cursor()
+        por_regra = {nome: 0 for nome in REGRAS}
+        for linha in cursor.execute(f"SELECT i.regra, COUNT(*) FROM inconsistencias_abastecimentos i {where} GROUP BY i.regra",
+                                    params):
+            por_regra[linha[0]] = linha[1]
+        total = por_regra[regra] if regra else sum(por_regra.values())
+        cursor.execute(f"""
+            SELECT i.id, i.abastecimento_id, i.placa, i.data, i.regra, i.valor, i.referencia, i.escore,
+                   i.data_deteccao, a.litros, a.odometro, a.km_litro, a.posto, a.responsavel
+            FROM inconsistencias_abastecimentos i
+            LEFT JOIN abastecimentos a ON a.id = i.abastecimento_id
+            {where_regra}
+            ORDER BY i.data DESC, i.abastecimento_id DESC, i.regra
+            LIMIT ? OFFSET ?
+        """, params_regra + [por_pagina, (max(pagina, 1) - 1) * por_pagina])
+        linhas = [{**dict(linha), 'descricao': REGRAS[linha['regra']]} for linha in cursor.fetchall()]
+        return linhas, total, por_regra
+    except Exception as e:
+        print(f"Erro ao obter inconsistências de abastecimentos: {e}")
+        return [], 0, {}
+    finally:
+        conn.close()
+
+
+def obter_ultima_varredura():
+    """Última execução registrada em varreduras_qualidade (ou None)."""
+    conn = database.get_db_connection()
+    try:
+        linha = conn.execute("SELECT * FROM varreduras_qualidade ORDER BY id DESC LIMIT 1").fetchone()
+        return dict(linha) if linha else None
+    finally:
+        conn.close()
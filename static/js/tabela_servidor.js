@@ -0,0 +1,284 @@
+// Tabela paginada no servidor: fala o protocolo do DataTables com /api/listas/<nome>
+// (draw, start, length, search[value], order[i][...], columns[i][...]) e desenha só a página atual.
+//
+//   const tabela = new TabelaServidor({
+//       url: '/api/listas/manutencoes',
+//       tabela: document.getElementById('tabelaManutencoes'),
+//       colunas: ['id', 'identificacao', null, ...],   // uma por <th>; null = não ordenável
+//       linha: item => `<tr>...</tr>`,
+//       vazio: 'Nenhuma manutenção encontrada.',
+//       filtros: () => ({ tipo: 'corretiva', data_abertura: '2025-01-01|2025-01-31' }),
+//       busca: document.getElementById('campoBusca'),    // opcional
+//       ordem: [['data_abertura', 'desc']],
+//   });
+//
+// Clique no cabeçalho ordena; Shift+clique acrescenta a coluna à ordenação.
+// tabela.recarregar() volta à primeira página; tabela.recarregar(false) mantém a página atual.
+//
+// Com rolagem: true a tabela não tem paginador: as linhas são acrescentadas quando o fim da tabela
+// aparece na tela. Cada bloco envia o 'cursor' devolvido pelo anterior, e o servidor pagina por
+// keyset quando a listagem e a ordenação permitem (senão usa start como OFFSET).
+
+class TabelaServidor {
+    constructor(opcoes) {
+        this.url = opcoes.url;
+        this.tabela = opcoes.tabela;
+        this.corpo = opcoes.corpo || this.tabela.tBodies[0];
+        this.colunas = opcoes.colunas;
+        this.linha = opcoes.linha;
+        this.vazio = opcoes.vazio || 'Nenhum registro encontrado.';
+        this.filtros = opcoes.filtros || (() => ({}));
+        this.busca = opcoes.busca || null;
+        this.ordem = (opcoes.ordem || []).map(([coluna, direcao]) => [coluna, direcao]);
+        this.porPagina = opcoes.porPagina || 25;
+        this.aoCarregar = opcoes.aoCarregar || null;
+        this.rolagem = !!opcoes.rolagem;
+        this.inicio = 0;
+        this.cursor = null;
+        this.carregadas = 0;
+        this.fim = false;
+        this.carregando = false;
+        this.draw = 0;
+        this.controle = null;
+        this.totalFiltrado = 0;
+
+        this.montarCabecalho();
+        this.montarRodape();
+        if (this.busca) {
+            let espera = null;
+            this.busca.addEventListener('input', () => {
+                clearTimeout(espera);
+                espera = setTimeout(() => this.recarregar(), 300);
+            });
+        }
+    }
+
+    montarCabecalho() {
+        const titulos = this.tabela.tHead.rows[0].cells;
+        this.colunas.forEach((coluna, indice) => {
+            if (!coluna || !titulos[indice]) return;
+            const th = titulos[indice];
+            th.style.cursor = 'pointer';
+            th.style.userSelect = 'none';
+            th.title = 'Clique para ordenar (Shift+clique para ordenar por mais de uma coluna)';
+            th.insertAdjacentHTML('beforeend', ' <i class="bi small" data-indicador-ordem></i>');
+            th.addEventListener('click', evento => this.alternarOrdem(coluna, evento.shiftKey));
+        });
+        this.atualizarIndicadores();
+    }
+
+    montarRodape() {
+        if (this.rolagem) return this.montarRodapeRolagem();
+        this.rodape = document.createElement('div');
+        this.rodape.className = 'd-flex flex-wrap justify-content-between align-items-center gap-2 mt-2';
+        this.rodape.innerHTML = `
+            <div class="d-flex align-items-center gap-2">
+                <select class="form-select form-select-sm w-auto" data-por-pagina>
+                    ${[10, 25, 50, 100].map(n => `<option value="${n}" ${n === this.porPagina ? 'selected' : ''}>${n}</option>`).join('')}
+                </select>
+                <small class="text-muted" data-resumo></small>
+            </div>
+            <nav><ul class="pagination pagination-sm mb-0" data-paginas></ul></nav>`;
+        const container = this.tabela.closest('.table-responsive') || this.tabela;
+        container.insertAdjacentElement('afterend', this.rodape);
+
+        this.rodape.querySelector('[data-por-pagina]').addEventListener('change', evento => {
+            this.porPagina = parseInt(evento.target.value, 10);
+            this.recarregar();
+        });
+        this.rodape.querySelector('[data-paginas]').addEventListener('click', evento => {
+            const link = evento.target.closest('[data-pagina]');
+            if (!link) return;
+            evento.preventDefault();
+            this.irParaPagina(parseInt(link.dataset.pagina, 10));
+        });
+    }
+
+    montarRodapeRolagem() {
+        this.rodape = document.createElement('div');
+        this.rodape.className = 'text-center text-muted py-3';
+        this.rodape.innerHTML = `
+            <small data-resumo></small>
+            <div data-sentinela class="d-none"><span class="spinner-border spinner-border-sm"></span> Carregando...</div>`;
+        const container = this.tabela.closest('.table-responsive') || this.tabela;
+        container.insertAdjacentElement('afterend', this.rodape);
+
+        this.sentinela = this.rodape.querySelector('[data-sentinela]');
+        this.observador = new IntersectionObserver(entradas => {
+            if (entradas.some(entrada => entrada.isIntersecting)) this.carregarMais();
+        }, { rootMargin: '400px' });
+        this.observador.observe(this.sentinela);
+    }
+
+    alternarOrdem(coluna, acumular) {
+        const atual = this.ordem.find(([nome]) => nome === coluna);
+        const direcao = atual && atual[1] === 'asc' ? 'desc' : 'asc';
+        if (acumular) {
+            if (atual) atual[1] = direcao;
+            else this.ordem.push([coluna, direcao]);
+        } else {
+            this.ordem = [[coluna, direcao]];
+        }
+        this.atualizarIndicadores();
+        this.recarregar();
+    }
+
+    atualizarIndicadores() {
+        const titulos = this.tabela.tHead.rows[0].cells;
+        this.colunas.forEach((coluna, indice) => {
+            const indicador = coluna && titulos[indice] && titulos[indice].querySelector('[data-indicador-ordem]');
+            if (!indicador) return;
+            const posicao = this.ordem.findIndex(([nome]) => nome === coluna);
+            indicador.className = 'bi small ' + (posicao < 0 ? 'bi-arrow-down-up opacity-50'
+                : this.ordem[posicao][1] === 'asc' ? 'bi-sort-up' : 'bi-sort-down');
+            indicador.textContent = posicao >= 0 && this.ordem.length > 1 ? String(posicao + 1) : '';
+        });
+    }
+
+    parametros() {
+        const params = new URLSearchParams();
+        params.append('draw', ++this.draw);
+        params.append('start', this.inicio);
+        params.append('length', this.porPagina);
+        params.append('search[value]', this.busca ? this.busca.value.trim() : '');
+        if (this.cursor) params.append('cursor', JSON.stringify(this.cursor));
+
+        // Colunas fora do cabeçalho (filtros e ordem inicial) entram como colunas extras do protocolo
+        const filtros = this.filtros();
+        const colunas = this.colunas.map(coluna => ({ nome: coluna, ordenavel: !!coluna }));
+        this.ordem.forEach(([nome]) => {
+            if (!colunas.some(coluna => coluna.nome === nome)) colunas.push({ nome: nome, ordenavel: true });
+        });
+        Object.keys(filtros).forEach(nome => {
+            if (!colunas.some(coluna => coluna.nome === nome)) colunas.push({ nome: nome, ordenavel: false });
+        });
+        colunas.forEach((coluna, indice) => {
+            params.append(`columns[${indice}][data]`, coluna.nome || '');
+            params.append(`columns[${indice}][orderable]`, coluna.ordenavel);
+            params.append(`columns[${indice}][search][value]`, (coluna.nome && filtros[coluna.nome]) || '');
+        });
+        this.ordem.forEach(([nome, direcao], posicao) => {
+            params.append(`order[${posicao}][column]`, colunas.findIndex(coluna => coluna.nome === nome));
+            params.append(`order[${posicao}][dir]`, direcao);
+        });
+        return params;
+    }
+
+    recarregar(primeiraPagina = true) {
+        // Na rolagem não há página atual: recarregar sempre recomeça do topo
+        if (primeiraPagina || this.rolagem) {
+            this.inicio = 0;
+            this.cursor = null;
+            this.fim = false;
+        }
+        return this.buscar(false);
+    }
+
+    carregarMais() {
+        if (!this.rolagem || this.carregando || this.fim) return;
+        this.inicio = this.carregadas;
+        this.buscar(true);
+    }
+
+    buscar(acrescentar) {
+        if (this.controle) this.controle.abort();
+        this.controle = new AbortController();
+        const params = this.parametros();
+        const draw = this.draw;
+        this.carregando = true;
+        if (!acrescentar) this.corpo.style.opacity = '0.5';
+
+        return fetch(`${this.url}?${params.toString()}`, { signal: this.controle.signal })
+            .then(response => response.json())
+            .then(resposta => {
+                if (resposta.draw !== draw) return;  // resposta de uma requisição já substituída
+                if (resposta.error) throw new Error(resposta.error);
+                // A página atual pode ter ficado vazia após uma exclusão
+                if (!this.rolagem && !resposta.data.length && this.inicio > 0 && resposta.recordsFiltered > 0) {
+                    this.inicio = Math.max(0, (Math.ceil(resposta.recordsFiltered / this.porPagina) - 1) * this.porPagina);
+                    return this.recarregar(false);
+                }
+                if (this.rolagem) this.acrescentar(resposta, acrescentar);
+                else this.desenhar(resposta);
+                if (this.aoCarregar) this.aoCarregar(resposta);
+            })
+            .catch(erro => {
+                if (erro.name === 'AbortError') return;
+                console.error('Erro ao carregar listagem:', erro);
+                this.fim = true;
+                this.corpo.innerHTML = this.linhaMensagem(`Erro ao carregar dados: ${escaparHtmlTabela(erro.message)}`, 'text-danger');
+            })
+            .finally(() => {
+                if (draw !== this.draw) return;
+                this.carregando = false;
+                this.corpo.style.opacity = '';
+            });
+    }
+
+    irParaPagina(pagina) {
+        const ultima = Math.max(1, Math.ceil(this.totalFiltrado / this.porPagina));
+        this.inicio = (Math.min(Math.max(pagina, 1), ultima) - 1) * this.porPagina;
+        this.recarregar(false);
+    }
+
+    linhaMensagem(texto, classe = 'text-muted') {
+        return `
+            <tr>
+                <td colspan="${this.colunas.length}" class="text-center py-4">
+                    <i class="bi bi-inbox"></i>
+                    <p class="${classe} mb-0">${texto}</p>
+                </td>
+            </tr>`;
+    }
+
+    acrescentar(resposta, acrescentar) {
+        const html = resposta.data.map(this.linha).join('');
+        if (acrescentar) this.corpo.insertAdjacentHTML('beforeend', html);
+        else this.corpo.innerHTML = html || this.linhaMensagem(this.vazio);
+        this.carregadas = (acrescentar ? this.carregadas : 0) + resposta.data.length;
+        this.cursor = resposta.cursor || null;
+        this.fim = resposta.data.length < this.porPagina || this.carregadas >= resposta.recordsFiltered;
+        this.totalFiltrado = resposta.recordsFiltered;
+
+        let resumo = `${this.carregadas} de ${resposta.recordsFiltered}`;
+        if (resposta.recordsFiltered !== resposta.recordsTotal) resumo += ` (filtrado de ${resposta.recordsTotal})`;
+        this.rodape.querySelector('[data-resumo]').textContent = resumo;
+        this.sentinela.classList.toggle('d-none', this.fim);
+        // Se o fim da tabela continua visível, o observador não dispara de novo sozinho
+        if (!this.fim) {
+            this.observador.unobserve(this.sentinela);
+            this.observador.observe(this.sentinela);
+        }
+    }
+
+    desenhar(resposta) {
+        this.totalFiltrado = resposta.recordsFiltered;
+        this.corpo.innerHTML = resposta.data.length ? resposta.data.map(this.linha).join('') : this.linhaMensagem(this.vazio);
+
+        const primeiro = resposta.data.length ? this.inicio + 1 : 0;
+        const ultimo = this.inicio + resposta.data.length;
+        let resumo = `Mostrando ${primeiro}–${ultimo} de ${resposta.recordsFiltered}`;
+        if (resposta.recordsFiltered !== resposta.recordsTotal) resumo += ` (filtrado de ${resposta.recordsTotal})`;
+        this.rodape.querySelector('[data-resumo]').textContent = resumo;
+
+        const atual = Math.floor(this.inicio / this.porPagina) + 1;
+        const total = Math.max(1, Math.ceil(resposta.recordsFiltered / this.porPagina));
+        const paginas = [...new Set([1, atual - 2, atual - 1, atual, atual + 1, atual + 2, total])]
+            .filter(p => p >= 1 && p <= total).sort((a, b) => a - b);
+        const item = (pagina, rotulo, desabilitado, ativo) => `
+            <li class="page-item ${desabilitado ? 'disabled' : ''} ${ativo ? 'active' : ''}">
+                <a class="page-link" href="#" data-pagina="${pagina}">${rotulo}</a>
+            </li>`;
+        let html = item(atual - 1, '&laquo;', atual === 1, false);
+        paginas.forEach((pagina, indice) => {
+            if (indice > 0 && pagina - paginas[indice - 1] > 1) html += '<li class="page-item disabled"><span class="page-link">…</span></li>';
+            html += item(pagina, pagina, false, pagina === atual);
+        });
+        html += item(atual + 1, '&raquo;', atual === total, false);
+        this.rodape.querySelector('[data-paginas]').innerHTML = html;
+    }
+}
+
+function escaparHtmlTabela(valor) {
+    return String(valor ?? '').replace(/[&<>"']/g, c => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c]));
+}
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+
+@pytest.fixture
+def banco(tmp_path):
+    """Banco novo (esquema e migrações aplicados) em um diretório temporário, no lugar de database.DB_PATH."""
+    caminho_original = database.DB_PATH
+    database.DB_PATH = str(tmp_path / 'teste.db')
+    # Os caches são por versão das tabelas, que recomeçam do zero em cada banco novo
+    database._cache_referencia.clear()
+    database._cache_usuarios.clear()
+    database._cache_contagens.clear()
+    database.criar_tabelas()
+    try:
+        yield database.DB_PATH
+    finally:
+        database.DB_PATH = caminho_original
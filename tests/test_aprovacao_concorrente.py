@@ -0,0 +1,37 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import benchmark
+import database
+
+COTACOES, ORCAMENTOS_POR_COTACAO, ITENS_POR_COTACAO = 60, 3, 4
+
+
+def test_aprovacoes_paralelas_geram_um_pedido_por_cotacao(banco, capsys):
+    random.seed(42)
+    conn = database.get_db_connection()
+    benchmark._popular_cotacoes(conn, COTACOES, ORCAMENTOS_POR_COTACAO, taxa_pedidos=0)
+    conn.executemany("INSERT INTO cotacao_itens (cotacao_id, descricao, quantidade) VALUES (?, ?, ?)",
+                     [(c, f'Item {i}', i + 1) for c in range(1, COTACOES + 1) for i in range(ITENS_POR_COTACAO)])
+    conn.commit()
+    orcamentos = [row[0] for row in conn.execute("SELECT id FROM orcamentos")]
+    conn.close()
+    random.shuffle(orcamentos)
+
+    # Vários compradores disputando a mesma cotação ao mesmo tempo
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        resultados = list(executor.map(lambda orcamento_id: database.aprovar_orcamento(orcamento_id, 1), orcamentos))
+
+    conn = database.get_db_connection()
+    try:
+        pedidos_por_cotacao = [n for (n,) in conn.execute("SELECT COUNT(*) FROM pedidos_compra GROUP BY cotacao_id")]
+        itens_por_pedido = [n for (n,) in conn.execute("SELECT COUNT(*) FROM pedido_itens GROUP BY pedido_id")]
+        aprovados_por_cotacao = [n for (n,) in conn.execute("SELECT SUM(aprovado) FROM orcamentos GROUP BY cotacao_id")]
+    finally:
+        conn.close()
+
+    assert sum(1 for r in resultados if r) == COTACOES
+    assert pedidos_por_cotacao == [1] * COTACOES
+    assert itens_por_pedido == [ITENS_POR_COTACAO] * COTACOES
+    assert aprovados_por_cotacao == [1] * COTACOES
+    assert 'database is locked' not in capsys.readouterr().out
@@ -0,0 +1,27 @@
+import random
+
+import benchmark
+import database
+import migracao
+
+
+def test_funcoes_com_sql_monitoradas_ou_justificadas():
+    monitoradas = {nome.split(' (')[0] for nome, _ in migracao.CONSULTAS_MONITORADAS}
+    faltando = set(migracao.funcoes_com_sql()) - monitoradas - set(migracao.FUNCOES_NAO_MONITORADAS)
+    assert not faltando, f"funções com SQL fora de CONSULTAS_MONITORADAS e de FUNCOES_NAO_MONITORADAS: {sorted(faltando)}"
+
+
+def test_exclusoes_existem_em_database():
+    assert not [nome for nome in migracao.FUNCOES_NAO_MONITORADAS if not hasattr(database, nome)]
+
+
+def test_sem_scan_em_tabelas_grandes(banco):
+    random.seed(42)
+    conn = database.get_db_connection()
+    benchmark._popular_frota(conn, 200, 50, abastecimentos_por_veiculo=20, checklists_por_maquina=20)
+    benchmark._popular_abastecimentos(conn, 20000, veiculos=200, perfil_fixo=True)
+    benchmark._popular_cotacoes(conn, 2000)
+    benchmark._popular_manutencoes(conn, 5000)
+    conn.close()
+
+    assert migracao.verificar_planos_consulta(banco) == []
@@ -1,9 +1,10 @@
 # utils.py
 
-from flask import g, session, redirect, url_for, flash
+from flask import g, session, request, redirect, url_for, flash, make_response
 from functools import wraps
-from database import get_user_by_id
-from datetime import datetime
+from database import obter_usuario_sessao, obter_estado_tabelas
+from datetime import datetime, timezone
+import hashlib
 
 # --- Context Processor ---
 def inject_now():
@@ -11,12 +12,19 @@ def inject_now():
     return {'now': datetime.now(), 'g': g}
 
 # --- Session Management (g.user loading) ---
+# Endpoints que não usam g.user (arquivos estáticos; None = rota inexistente)
+ENDPOINTS_PUBLICOS = {'static', None}
+
 def load_logged_in_user():
     """
     Carrega o usuário logado para o objeto global 'g'.
+    Usa o cache de usuários do database e não consulta nada para endpoints públicos.
     """
     user_id = session.get('user_id')
-    g.user = get_user_by_id(user_id) if user_id else None
+    if request.endpoint in ENDPOINTS_PUBLICOS or not user_id:
+        g.user = None
+        return
+    g.user = obter_usuario_sessao(user_id)
 
 # --- Decorators ---
 def login_required(view):
@@ -47,4 +55,42 @@ def roles_required(roles):
                 return redirect(url_for('frota.index'))
             return view(*args, **kwargs)
         return wrapped_view
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+def resposta_condicional(tabelas, chave=None):
+    """
+    Decorator de GET condicional para APIs JSON: ETag e Last-Modified vêm das versões das tabelas
+    (versoes_tabelas). Se o cliente já tem a versão atual, responde 304 sem executar a view.
+    Deve ficar abaixo de login_required/roles_required. Outros métodos (POST, PUT...) passam direto.
+    chave: função sem argumentos para respostas que dependem de algo além das tabelas (por exemplo a
+    data de hoje); o valor dela entra no ETag e, como a versão das tabelas não acompanha essa
+    dependência, Last-Modified deixa de ser enviado.
+    """
+    def wrapper(view):
+        @wraps(view)
+        def wrapped_view(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(*args, **kwargs)
+
+            versoes, alterado_em = obter_estado_tabelas(*tabelas)
+            usuario = g.user['id'] if g.user else ''
+            extra = chave() if chave else ''
+            etag = hashlib.sha1(f"{request.full_path}|{usuario}|{versoes}|{extra}".encode()).hexdigest()[:24]
+            ultima_alteracao = datetime.fromtimestamp(alterado_em, timezone.utc) if alterado_em and not chave else None
+
+            # If-None-Match tem precedência; If-Modified-Since só vale quando não há ETag na requisição
+            if request.if_none_match:
+                inalterado = request.if_none_match.contains_weak(etag)
+            else:
+                inalterado = bool(ultima_alteracao and request.if_modified_since
+                                  and ultima_alteracao <= request.if_modified_since)
+
+            response = make_response(('', 304) if inalterado else view(*args, **kwargs))
+            if response.status_code in (200, 304):
+                response.set_etag(etag, weak=True)
+                if ultima_alteracao:  # atribuir None faria o werkzeug enviar a hora atual
+                    response.last_modified = ultima_alteracao
+                response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapped_view
+    return wrapper